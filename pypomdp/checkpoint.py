@@ -0,0 +1,56 @@
+import os
+import time
+import pickle
+import tempfile
+
+
+class Checkpoint(object):
+    """
+    Pickled state of a long run, rewritten atomically (temporary file, fsync, rename) so that an interrupted write
+    never corrupts the previous checkpoint. save() only writes once 'interval' seconds passed since the last write,
+    unless forced
+    """
+    def __init__(self, path, interval=60.0):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.interval = interval
+        self.last_save = time.time()
+
+    @staticmethod
+    def in_folder(folder, name, interval=60.0):
+        return Checkpoint(os.path.join(folder, name + '.pkl'), interval)
+
+    def due(self):
+        return time.time() - self.last_save >= self.interval
+
+    def save(self, state, force=False):
+        """
+        :return: whether the state was written
+        """
+        if not force and not self.due():
+            return False
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.last_save = time.time()
+        return True
+
+    def load(self):
+        """
+        :return: the last saved state, None if there is none
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
@@ -1,25 +1,53 @@
+import os
+import sys
+import argparse
+
+# the maker writes the model formats of the models package, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from grid_world_maker import GridWorldMaker
 
+# also defines the immediate reward map
+BOARD = [
+    [-1, -1, 10, 10, -1, -1, -1],
+    [-1, -1, -1, 10,  1, -1, -1],
+    [-1, -1, -1, -1, -1, -1, -1],
+    [-1, -1, -1, -1, -1, -1, -1],
+    [20, -1, -1, -1, -1, -1, -1],
+    [20, -1, -1, -1, -1, -1, 40],
+    [-1, -1, -1, -1, -1, 40, 40]
+]
+
+
+def scaled_board(size):
+    """
+    :return: the example board stretched to size x size cells
+    """
+    n = len(BOARD)
+    return [[BOARD[i * n // size][j * n // size] for j in range(size)] for i in range(size)]
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes the grid world example as a sparse model file')
+    parser.add_argument('--size', type=int, default=7, help='Number of rows and columns of the board')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Path of the model file, defaults to ./pomdp/GridWorld-<size>x<size>.npz')
+    parser.add_argument('--text', action='store_true', help='Also export the model in the .POMDP text format')
+    args = parser.parse_args()
+
+    size = args.size
     definition = {
         'discount': 0.90,
         'values': 'reward',
-        'states':  ' '.join(map(str, list(range(7*7)))),
+        'states':  ' '.join(map(str, list(range(size*size)))),
         'actions': ' '.join(['up', 'down', 'left', 'right', 'halt']),
         'costs':   ' '.join(map(str, [1, 1, 1, 1, 0.25])),
-        'observations': ' '.join(map(str, list(range(7*7)))),
-        'observation_probability': 0.85, # the probability of O_s = S_s, i.e., an accurate observation 
-        'init_state': '24',
-        'board': [ # also defines the immediate reward map
-            [-1, -1, 10, 10, -1, -1, -1],
-            [-1, -1, -1, 10,  1, -1, -1],
-            [-1, -1, -1, -1, -1, -1, -1],
-            [-1, -1, -1, -1, -1, -1, -1],
-            [20, -1, -1, -1, -1, -1, -1],
-            [20, -1, -1, -1, -1, -1, 40],
-            [-1, -1, -1, -1, -1, 40, 40]
-        ],
-        'action_map': lambda action, i,j : {
+        'observations': ' '.join(map(str, list(range(size*size)))),
+        'observation_probability': 0.85, # the probability of O_s = S_s, i.e., an accurate observation
+        'init_state': str(size * size // 2),
+        'board': scaled_board(size),
+        # evaluated on the index arrays of all the cells at once
+        'action_map': lambda action, i, j: {
             'up': (i - 1, j),
             'down': (i + 1, j),
             'left': (i, j - 1),
@@ -29,12 +57,7 @@ if __name__ == '__main__':
     }
 
     maker = GridWorldMaker(definition)
-    
-    lines = []
-    maker.make_meta(lines)
-    maker.make_R(lines)
-    maker.make_T(lines)
-    maker.make_O(lines)
-
-    with open('./pomdp/GridWorld-5D.POMDP', 'w+') as outfile:
-        outfile.writelines(lines)
+    path = args.out or os.path.join('pomdp', 'GridWorld-{0}x{0}.npz'.format(size))
+    maker.save(path)
+    if args.text:
+        maker.write_pomdp(os.path.splitext(path)[0] + '.POMDP')
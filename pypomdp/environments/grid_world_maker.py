@@ -1,3 +1,14 @@
+import numpy as np
+
+from models.compiled_model import CompiledModel
+from models.sparse_model import save_sparse
+
+# neighbourhood of a cell, in the order of Board.adjacent_cells
+OFFSETS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx != 0 or dy != 0]
+# reward of a move off the board
+OFF_BOARD_REWARD = -10
+
+
 class Board:
     def __init__(self, board):
         self.board = board
@@ -11,27 +22,161 @@ class Board:
     def state(self, i, j):
         if i < 0 or j < 0 or i >= self.h or j >= self.w:
             raise IndexError
-        return i * self.h + j
+        return i * self.w + j
 
     def for_each_cell(self, visitor_fn):
         for i in range(self.h):
             for j in range(self.w):
                 visitor_fn(i, j)
-    
+
     def adjacent_cells(self, i, j):
         cells = []
-        for y, x in [(i+dy, j+dx) for dy in (-1,0,1) for dx in (-1,0,1) if dx != 0 or dy != 0]:
+        for y, x in [(i+dy, j+dx) for dy, dx in OFFSETS]:
             if y >= 0 and x >= 0 and y < self.h and x < self.w:
                 cells.append((y, x))
         return cells
 
 
 class GridWorldMaker():
+    """
+    Builds the tables of a grid world with array operations over all the cells at once: moves are deterministic
+    (moves off the board stay put), rewards are read off the board and the agent observes the cell it reaches
+    with 'observation_probability', or one of its neighbours otherwise.
+    The tables come out as a CompiledModel, or as a sparse model file (models.sparse_model) for boards whose dense
+    tables would not fit, e.g. 100x100. The .POMDP text format remains as an export (make_meta, make_R, make_T,
+    make_O, write_pomdp)
+    """
     def __init__(self, configs):
         self.board = Board(configs['board'])
         self.configs = configs
         self.actions = configs['actions'].split(' ')
-    
+        self.rewards = np.array(configs['board'], dtype=float)
+        self.__tables = None
+
+    @property
+    def num_states(self):
+        return self.board.h * self.board.w
+
+    @property
+    def states(self):
+        names = self.configs.get('states')
+        return names.split(' ') if names else [str(s) for s in range(self.num_states)]
+
+    @property
+    def observations(self):
+        names = self.configs.get('observations')
+        return names.split(' ') if names else [str(s) for s in range(self.num_states)]
+
+    def env(self):
+        """
+        :return: the names and scalars of the model, see models.shared_model.ENV_FIELDS
+        """
+        _ = self.configs
+        costs = _.get('costs')
+        return {
+            'model_name': _.get('model_name', 'GridWorld'),
+            'model_spec': _.get('model_spec', '{}x{}'.format(self.board.h, self.board.w)),
+            'discount': _['discount'],
+            'init_state': _.get('init_state'),
+            'values': _.get('values', 'reward'),
+            'start': None,
+            'states': self.states,
+            'costs': list(map(float, costs.split(' '))) if costs else None,
+            'actions': self.actions,
+            'observations': self.observations,
+        }
+
+    def tables(self):
+        """
+        :return: next_state (A, S) indices, valid (A, S) whether the move stays on the board, R (A, S), and the
+        observation distribution of each reached cell as neighbours (S, 9) indices (-1 padded) and their
+        probabilities (S, 9), the first column being the cell itself
+        """
+        if self.__tables is not None:
+            return self.__tables
+
+        h, w = self.board.h, self.board.w
+        I, J = np.divmod(np.arange(h * w), w)
+        A, S = len(self.actions), h * w
+
+        next_state, valid, R = np.empty((A, S), dtype=np.int64), np.empty((A, S), dtype=bool), np.empty((A, S))
+        for ai, action in enumerate(self.actions):
+            ni, nj = self.configs['action_map'](action, I, J)
+            ni, nj = np.broadcast_to(ni, I.shape), np.broadcast_to(nj, J.shape)
+            on_board = (ni >= 0) & (nj >= 0) & (ni < h) & (nj < w)
+            ni, nj = np.where(on_board, ni, I), np.where(on_board, nj, J)
+            reward = self.rewards[ni, nj]
+            if action == 'halt':
+                reward = np.maximum(reward, 0)
+            next_state[ai], valid[ai] = ni * w + nj, on_board
+            R[ai] = np.where(on_board, reward, OFF_BOARD_REWARD)
+
+        p = self.configs['observation_probability']
+        neighbours = np.full((S, len(OFFSETS) + 1), -1, dtype=np.int64)
+        neighbours[:, 0] = np.arange(S)
+        for k, (dy, dx) in enumerate(OFFSETS):
+            y, x = I + dy, J + dx
+            inside = (y >= 0) & (x >= 0) & (y < h) & (x < w)
+            neighbours[inside, k + 1] = (y * w + x)[inside]
+        count = (neighbours[:, 1:] >= 0).sum(axis=1, keepdims=True)
+        obs_probs = np.where(neighbours[:, 1:] >= 0, (1.0 - p) / np.maximum(count, 1), 0.0)
+        obs_probs = np.hstack([np.full((S, 1), p), obs_probs])
+
+        self.__tables = next_state, valid, R, neighbours, obs_probs
+        return self.__tables
+
+    def reached(self):
+        """
+        :return: (A, S) whether a cell is reached by a move on the board, only those cells get observations
+        """
+        next_state, valid, _, _, _ = self.tables()
+        reached = np.zeros(valid.shape, dtype=bool)
+        for ai in range(len(self.actions)):
+            reached[ai, next_state[ai, valid[ai]]] = True
+        return reached
+
+    def sparse(self):
+        """
+        :return: T, Z and R as coordinate lists, see models.sparse_model.save_sparse
+        """
+        next_state, valid, R, neighbours, obs_probs = self.tables()
+        A, S = R.shape
+        actions, states = np.divmod(np.arange(A * S), S)
+        T = (actions, states, next_state.ravel(), np.ones(A * S))
+
+        za, zs = np.nonzero(self.reached())
+        rows = neighbours[zs] >= 0
+        Z = (np.repeat(za, rows.sum(axis=1)), np.repeat(zs, rows.sum(axis=1)), neighbours[zs][rows],
+             obs_probs[zs][rows])
+        return T, Z, (actions, states, R.ravel())
+
+    def compiled(self, dtype=None):
+        """
+        Only usable for small boards: T and Z take A x S x S floats each, e.g. 1.9 GB apiece in float32 for 100x100,
+        larger boards are written with save() and played by the solvers not needing the dense tables (POMCP, DESPOT)
+        :param dtype: floating point type of the tables, see CompiledModel.resolve_dtype
+        :return: the dense CompiledModel of the grid
+        """
+        next_state, _, R, _, _ = self.tables()
+        A, S = R.shape
+        dtype = CompiledModel.resolve_dtype(dtype, S)
+        T = np.zeros((A, S, S), dtype=dtype)
+        T[np.repeat(np.arange(A), S), np.tile(np.arange(S), A), next_state.ravel()] = 1.0
+
+        _, (za, zs, zo, zp), _ = self.sparse()
+        Z = np.zeros((A, S, S), dtype=dtype)
+        Z[za, zs, zo] = zp
+        env = self.env()
+        return CompiledModel(env['states'], env['actions'], env['observations'], env['discount'], T, Z,
+                             R.astype(dtype))
+
+    def save(self, path):
+        """
+        Writes the grid as a sparse model file (.npz), which PomdpRunner loads given as --env
+        """
+        T, Z, R = self.sparse()
+        save_sparse(path, self.env(), T, Z, R)
+
     def make_meta(self, lines):
         _ = self.configs
         templates = [
@@ -39,68 +184,46 @@ class GridWorldMaker():
             'values: {}'.format(_['values']),
             'actions: {}'.format(_['actions']),
             'costs: {}'.format(_['costs']),
-            'states: {}'.format(_['states']),
-            'observations: {}'.format(_['observations']),
+            'states: {}'.format(' '.join(self.states)),
+            'observations: {}'.format(' '.join(self.observations)),
             'init_state: {}\n\n'.format(_['init_state']),
         ]
         lines.append('\n'.join(templates))
 
     def make_R(self, lines):
-        def algorithm(action):
-            def wrapper(i, j):
-                try:
-                    next_state = self.configs['action_map'](action, i, j)
-                    reward = self.board.at(next_state[0], next_state[1])
-                    if action == 'halt':
-                        lines.append(template.format(a=action, si=self.board.state(i, j), r=0 if reward < 0 else reward))
-                    else:
-
-                        lines.append(template.format(a=action, si=self.board.state(i, j), r=reward))
-                except IndexError:
-                    lines.append(template.format(a=action, si=self.board.state(i, j), r=-10))
-            return wrapper
-        
+        _, _, R, _, _ = self.tables()
         template = 'R: {a} : {si} : *  : *       {r}\n'
-        for action in self.actions:
-            self.board.for_each_cell(algorithm(action))
-
+        for ai, action in enumerate(self.actions):
+            lines.extend(template.format(a=action, si=si, r=format_number(r)) for si, r in enumerate(R[ai].tolist()))
 
     def make_T(self, lines):
-        def algorithm(action):
-            def wrapper(i, j):
-                try:
-                    next_state = self.configs['action_map'](action, i, j)
-                    lines.append(template.format(a=action, si=self.board.state(i, j),
-                                                 sj=self.board.state(*next_state), p=1.0))
-                except IndexError:
-                    lines.append(template.format(a=action, si=self.board.state(i, j),
-                                                 sj=self.board.state(i, j), p=1.0))
-            return wrapper
-
+        next_state, _, _, _, _ = self.tables()
         template = 'T: {a} : {si} : {sj}         {p}\n'
-        for action in self.actions:
-            self.board.for_each_cell(algorithm(action))
-
+        for ai, action in enumerate(self.actions):
+            lines.extend(template.format(a=action, si=si, sj=sj, p=1.0) for si, sj in enumerate(next_state[ai].tolist()))
 
     def make_O(self, lines):
-        def algorithm(action):
-            def wrapper(i, j):
-                obs_prob = self.configs['observation_probability']
-                try:
-                    next_point = self.configs['action_map'](action, i, j)
-                    next_state = self.board.state(*next_point)
-                    lines.append(template.format(a=action, sj=next_state,
-                                                 oj=next_state, p=obs_prob))
-                    neighbours = self.board.adjacent_cells(*next_point)
-                    for y, x in neighbours:
-                        lines.append(template.format(a=action, sj=next_state,
-                                                     oj=self.board.state(y, x), p=(1.0 - obs_prob)/len(neighbours)))
-
-                except IndexError:
-                    pass
-            return wrapper
-
+        next_state, valid, _, neighbours, obs_probs = self.tables()
         template = 'O: {a} : {sj} : {oj}         {p}\n'
-        for action in self.actions:
-            self.board.for_each_cell(algorithm(action))
+        for ai, action in enumerate(self.actions):
+            # cells in the order of the moves reaching them
+            for sj in next_state[ai, valid[ai]].tolist():
+                lines.extend(template.format(a=action, sj=sj, oj=oj, p=p)
+                             for oj, p in zip(neighbours[sj].tolist(), obs_probs[sj].tolist()) if oj >= 0)
+
+    def write_pomdp(self, path):
+        """
+        Exports the grid in the .POMDP text format
+        """
+        lines = []
+        self.make_meta(lines)
+        self.make_R(lines)
+        self.make_T(lines)
+        self.make_O(lines)
+        with open(path, 'w+') as outfile:
+            outfile.writelines(lines)
+
 
+def format_number(x):
+    # board rewards are written as the integers they usually are
+    return int(x) if float(x).is_integer() else x
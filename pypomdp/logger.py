@@ -1,45 +1,205 @@
 import os
+import sys
 import time
+import queue
+import atexit
 import logging
+import threading
+import multiprocessing.util
+from logging.handlers import QueueHandler, QueueListener, MemoryHandler
 
 
-class PrinterLogger:
-    new = lambda *args, **kwargs: 1
-    info = print
-    warning = print
-    error = print
+class LazyMessage(object):
+    """
+    Message template and its arguments, only formatted when a handler renders the record (on the writer thread)
+    """
+    __slots__ = ('msg', 'args', 'kwargs')
+
+    def __init__(self, msg, args, kwargs):
+        self.msg = msg
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        if not self.args and not self.kwargs:
+            return str(self.msg)
+        return self.msg.format(*self.args, **self.kwargs)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are, QueueHandler would otherwise format them in the calling thread
+    """
+    def prepare(self, record):
+        return record
+
+
+class FlushRequest(object):
+    """
+    Queued behind the pending records, the listener flushes its handlers once it reaches it
+    """
+    __slots__ = ('done',)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class FlushingQueueListener(QueueListener):
+    """
+    QueueListener answering FlushRequests, so that the pending records can be written out without stopping it
+    """
+    def handle(self, record):
+        if isinstance(record, FlushRequest):
+            for handler in self.handlers:
+                handler.flush()
+            record.done.set()
+            return
+        QueueListener.handle(self, record)
 
 
 class Logger:
-    __logger__ = PrinterLogger
+    """
+    Asynchronous logger: callers only enqueue a record, a background listener formats and writes it.
+    Messages are str.format templates whose arguments are only rendered if the level is enabled, e.g.
+        log.info('New Belief: {}', belief)
+    Arguments are rendered later on, so they must not be mutated after the call.
+    """
+    __logger__ = None
+    __listener__ = None
+    __records__ = None
+    __handlers__ = None
+    __finalizer_pid__ = None
+    __file__ = None
+    __pid__ = None
+    level = logging.INFO
+
+    @staticmethod
+    def start(handlers):
+        """
+        Routes the 'EARL' logger through a queue drained by a listener thread
+        :param handlers: builds the handlers the listener writes to, called again by forked processes
+        """
+        Logger.stop()
+        records = queue.SimpleQueue()
+        listener = FlushingQueueListener(records, *handlers(), respect_handler_level=True)
+        listener.start()
+
+        logger = logging.getLogger('EARL')
+        logger.setLevel(Logger.level)
+        logger.propagate = False
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(DeferredQueueHandler(records))
+
+        Logger.__logger__, Logger.__listener__, Logger.__handlers__ = logger, listener, handlers
+        Logger.__records__ = records
+        Logger.__pid__ = os.getpid()
+        if Logger.__finalizer_pid__ != Logger.__pid__:
+            # flushes pending records at exit, pool workers skip atexit hooks but run multiprocessing finalizers,
+            # registered once per process as stop() only ever stops the current listener
+            multiprocessing.util.Finalize(Logger, Logger.stop, exitpriority=0)
+            Logger.__finalizer_pid__ = Logger.__pid__
+
+    @staticmethod
+    def stop():
+        """
+        Writes out the pending records and stops the listener, the next record starts a new one
+        """
+        listener, Logger.__listener__ = Logger.__listener__, None
+        if listener is None or Logger.__pid__ != os.getpid():
+            return
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        Logger.__pid__ = None
 
     @staticmethod
-    def new(logPath, filename=time.strftime("%Y-%m-%d")):
-        if Logger.__logger__ is PrinterLogger:
-            if not os.path.exists(logPath):
-                os.makedirs(logPath)
+    def flush():
+        """
+        Blocks until the pending records are written, e.g. before a pool worker may be terminated, the listener
+        keeps running
+        """
+        if Logger.__listener__ is None or Logger.__pid__ != os.getpid():
+            return
+        request = FlushRequest()
+        Logger.__records__.put(request)
+        request.done.wait()
 
+    @staticmethod
+    def console():
+        def handlers():
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            return [handler]
+
+        Logger.start(handlers)
+
+    @staticmethod
+    def new(logPath, filename=time.strftime("%Y-%m-%d"), capacity=1024):
+        """
+        Logs into <logPath>/<filename>.log, records are written in batches of 'capacity' (warnings and errors
+        are written right away)
+        """
+        if Logger.__file__ is not None:
+            return
+        if not os.path.exists(logPath):
+            os.makedirs(logPath)
+
+        path = Logger.__file__ = os.path.join(logPath, filename + '.log')
+
+        def handlers():
             formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-            path = os.path.join(logPath, filename + '.log')
             handler = logging.FileHandler(path)
             handler.setFormatter(formatter)
+            return [MemoryHandler(capacity, flushLevel=logging.WARNING, target=handler)]
+
+        Logger.start(handlers)
 
-            logger = logging.getLogger('EARL')
-            logger.setLevel(logging.DEBUG)
-            logger.addHandler(handler)
+    @staticmethod
+    def set_level(level):
+        """
+        :param level: logging level or its name, e.g. 'WARNING'
+        """
+        Logger.level = logging.getLevelName(level) if isinstance(level, str) else level
+        if Logger.__logger__ is not None:
+            Logger.__logger__.setLevel(Logger.level)
+
+    @staticmethod
+    def enabled(level):
+        """
+        Whether records of the given level are emitted, to guard messages that are expensive to build
+        """
+        return level >= Logger.level
+
+    @staticmethod
+    def log(level, msg, args, kwargs):
+        if level < Logger.level:
+            return
+        if Logger.__pid__ != os.getpid():
+            # first record of this process: either nothing was started yet, or the listener thread of the
+            # parent was not carried over by fork, in which case fresh handlers are built
+            Logger.__listener__ = None
+            if Logger.__handlers__ is not None:
+                Logger.start(Logger.__handlers__)
+            else:
+                Logger.console()
+        Logger.__logger__.log(level, LazyMessage(msg, args, kwargs))
+
+    @staticmethod
+    def debug(msg, *args, **kwargs):
+        Logger.log(logging.DEBUG, msg, args, kwargs)
 
-            Logger.__logger__ = logger
-    
     @staticmethod
-    def info(msg):
-        Logger.__logger__.info(msg)
+    def info(msg, *args, **kwargs):
+        Logger.log(logging.INFO, msg, args, kwargs)
 
     @staticmethod
-    def warning(msg):
-        Logger.__logger__.warning(msg)
+    def warning(msg, *args, **kwargs):
+        Logger.log(logging.WARNING, msg, args, kwargs)
 
     @staticmethod
-    def error( msg):
-        Logger.__logger__.error(msg)
+    def error(msg, *args, **kwargs):
+        Logger.log(logging.ERROR, msg, args, kwargs)
 
 
+atexit.register(Logger.stop)
@@ -1,11 +1,91 @@
 import argparse
 import os
+import copy
 import json
+import random
 import multiprocessing
 from pomdp_runner import PomdpRunner
-from util import RunnerParams
+from models import SharedModel
+from models.compiled_model import LARGE_MODEL_STATES
+from util import RunnerParams, RunningStats, set_seed
 from logger import Logger as log
-import statistics
+from metrics import MetricsSink
+from profiler import Profiler
+from checkpoint import Checkpoint
+
+
+runner = None
+
+
+def init_worker(params, algo_params, seed, pooled=False):
+    """
+    Builds the model and solver of a worker process once, seeding it identically in every worker so that
+    offline policies come out the same. Pooled workers write their metrics to their own stream
+    """
+    global runner
+    set_seed(seed)
+    if pooled and params.metrics:
+        params.metrics = MetricsSink.per_process(params.metrics)
+    runner = PomdpRunner(params)
+    runner.setup(**algo_params)
+
+
+def run_episode(job):
+    """
+    Plays one benchmark episode on the worker's runner, the episode's own seed makes it independent of the
+    other workers' random streams, and replays the same environment noise in every run sharing --seed
+    """
+    algo_params, seed = job
+    runner.seed_episode(seed)
+    result = runner.runBench(**algo_params)
+    # pool workers are terminated without any teardown
+    log.flush()
+    return result
+
+
+def local_runner(params):
+    """
+    Runner of the main process preparing what the workers share, the workers write the metrics and snapshots
+    """
+    params = copy.copy(params)
+    params.metrics, params.snapshot = None, False
+    return PomdpRunner(params)
+
+
+def benchmark_fingerprint(params, algo_params):
+    """
+    :return: what the benchmark episodes depend on, a checkpointed benchmark only resumes a run sharing it
+    """
+    return {
+        'env': params.env,
+        'config': params.config,
+        'algo_params': algo_params,
+        'budget': params.budget,
+        'max_play': params.max_play,
+        'random_prior': params.random_prior,
+        'dtype': params.dtype,
+    }
+
+
+def play_benchmark(setup, jobs, workers):
+    """
+    :return: iterator over the (steps, reward) results of the benchmark episodes in episode order, closing it
+    early stops the remaining episodes
+    """
+    if not jobs:
+        return
+    if workers > 1:
+        with multiprocessing.Pool(min(workers, len(jobs)), initializer=init_worker, initargs=setup + (True,)) as pool:
+            # ordered results keep the stopping point independent of the workers' scheduling
+            for result in pool.imap(run_episode, jobs, chunksize=1):
+                yield result
+    else:
+        init_worker(*setup)
+        try:
+            for job in jobs:
+                yield run_episode(job)
+        finally:
+            runner.close()
 
 
 if __name__ == '__main__':
@@ -14,39 +94,181 @@ if __name__ == '__main__':
     parser.add_argument('config', type=str, help='The file name of algorithm configuration (without JSON extension)')
     parser.add_argument('--env', type=str, default='Tiger-2D.POMDP', help='The name of environment\'s config file')
     parser.add_argument('--budget', type=float, default=float('inf'), help='The total action budget (defeault to inf)')
-    parser.add_argument('--snapshot', type=bool, default=False, help='Whether to snapshot the belief tree after each episode')
+    parser.add_argument('--snapshot', type=bool, default=False, help='Whether to snapshot the belief tree after each step')
+    parser.add_argument('--snapshot_dir', type=str, default=os.path.join('dev', 'snapshots'),
+                        help='Folder of the tree snapshot dumps, render them with render_snapshots.py')
+    parser.add_argument('--snapshot_depth', type=int, default=4, help='Tree levels kept below the root in a snapshot')
+    parser.add_argument('--snapshot_top_k', type=int, default=5, help='Most visited children kept per node in a snapshot')
     parser.add_argument('--logfile', type=str, default=None, help='Logfile path')
     parser.add_argument('--random_prior', type=bool, default=False,
                         help='Whether or not to use a randomly generated distribution as prior belief, default to False')
     parser.add_argument('--max_play', type=int, default=1000, help='Maximum number of play steps')
     #New argument
     parser.add_argument('--benchmark', type=int, default=0, help='Sets the simulation to benchmark type, if present, must be followed of either "1" or "True"')
+    parser.add_argument('--ponder', action='store_true',
+                        help='Keep planning in a background thread between decisions (numba POMCP engine)')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Play the benchmark episodes of an offline policy (pbvi, qmdp) in lockstep')
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='Path of the per step and per episode metrics stream (.jsonl, or .csv)')
+    parser.add_argument('--profile', type=str, nargs='?', const='profiles', default=None,
+                        help='Time the solver phases and dump a breakdown and a pstats file into the given folder '
+                             '(defaults to ./profiles), benchmark episodes are then played in-process')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of processes playing benchmark episodes in parallel (defaults to the CPU count)')
+    parser.add_argument('--target_ci', type=float, default=None,
+                        help='Stop the benchmark once the half-width of the confidence interval of the mean reward is '
+                             'below this value, --benchmark being the maximum number of episodes')
+    parser.add_argument('--target_rel_error', type=float, default=None,
+                        help='Stop the benchmark once the confidence interval half-width is below this fraction of '
+                             'the absolute mean reward')
+    parser.add_argument('--min_episodes', type=int, default=10,
+                        help='Episodes played before the stopping targets are checked (defaults to 10)')
+    parser.add_argument('--z', type=float, default=1.96,
+                        help='Normal quantile of the reported confidence intervals (defaults to 1.96, i.e. 95%%)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed of the episodes, runs sharing it face the same environment noise whatever the solver')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Folder of the checkpoints of the benchmark results and offline solve, rewritten '
+                             'atomically every --checkpoint_interval seconds')
+    parser.add_argument('--checkpoint_interval', type=float, default=60.0,
+                        help='Minimum number of seconds between two checkpoints (defaults to 60)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Carry on from the checkpoints found in the --checkpoint folder')
+    parser.add_argument('--dtype', type=str, default='auto', choices=['auto', 'float32', 'float64'],
+                        help='Floating point type of the compiled tables, beliefs and alpha vectors (defaults to auto, '
+                             'i.e. float32 for models of {} states or more)'.format(LARGE_MODEL_STATES))
+    parser.add_argument('--log_level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Messages below this level are neither formatted nor written (defaults to INFO)')
 
     args = vars(parser.parse_args())
+    workers = args.pop('workers')
+    profile = args.pop('profile')
+    target_ci, target_rel_error = args.pop('target_ci'), args.pop('target_rel_error')
+    min_episodes, z = args.pop('min_episodes'), args.pop('z')
+    log.set_level(args.pop('log_level'))
     params = RunnerParams(**args)
+    # episode seeds are drawn from this one, so the i-th episode of every run sharing --seed gets the same seed
+    set_seed(params.seed)
+
+    if profile is not None:
+        if workers > 1:
+            log.warning('Profiling plays the benchmark episodes in-process, ignoring --workers {}', workers)
+            workers = 1
+        Profiler.enable()
 
     with open(params.algo_config) as algo_config:
         algo_params = json.load(algo_config)
-        runner = PomdpRunner(params)
         #If interactive simulation is selected, the system will simulate only 1 simulation
         if params.benchmark == 0:
+            runner = PomdpRunner(params)
+            if params.seed is not None:
+                runner.seed_episode(params.seed)
             runner.run(**algo_params)
+            runner.close()
+        elif params.vectorized:
+            runner = PomdpRunner(params)
+            if params.seed is not None:
+                runner.seed_episode(params.seed)
+            stats = runner.runVectorized(**algo_params)
+            log.info('\n'.join([
+                '+'*20,
+                'Results after ending {} simulations:'.format(stats['episodes']),
+                '='*20,
+                'Unfinished episodes: {}'.format(stats['unfinished']),
+                'Average steps: {} +/- {}'.format(stats['mean_steps'], stats['ci_steps']),
+                'Average reward: {} +/- {}'.format(stats['mean_reward'], stats['ci_reward']),
+                'Standard deviation of the steps: {}'.format(stats['std_steps']),
+                'Standard deviation of the reward: {}'.format(stats['std_reward']),
+                '=' * 20
+            ]))
         else:
-            # If benchmark simulation is selected, the system will simulate provided simulations
-            for i in range(params.benchmark):
-                runner.runBench(**algo_params)
+            # If benchmark simulation is selected, the system will simulate up to the provided simulations,
+            # spread across a pool of processes with one seed per episode, and stop early once the mean reward is
+            # known precisely enough
+            checkpoint, state = None, None
+            if params.checkpoint is not None:
+                checkpoint = Checkpoint.in_folder(params.checkpoint, 'benchmark', params.checkpoint_interval)
+                state = checkpoint.load() if params.resume else None
+            fingerprint = benchmark_fingerprint(params, algo_params)
+            if state is not None:
+                if state.get('fingerprint') != fingerprint:
+                    raise ValueError('The checkpoint in {} is a benchmark of another setup: {}, this one is {}'.format(
+                        params.checkpoint, state.get('fingerprint'), fingerprint))
+                log.info('Resuming the benchmark after {} episode(s)', state['rewards'].n)
+                random.setstate(state['rng'])
+            else:
+                state = {
+                    'fingerprint': fingerprint,
+                    'setup_seed': random.randrange(2 ** 32),
+                    'seeds': [],
+                    'steps': RunningStats(),
+                    'rewards': RunningStats(),
+                }
+            # the seeds fix every episode, together with the generator drawing them they are all the random state
+            # a resumed run needs, also when it asks for more episodes
+            state['seeds'] += [random.randrange(2 ** 32) for _ in range(params.benchmark - len(state['seeds']))]
+            state['rng'] = random.getstate()
+            steps, rewards = state['steps'], state['rewards']
+
+            shared = None
+            if workers > 1 and params.shared_model is None and not params.sparse_env:
+                # the workers attach to a single copy of the model's tables instead of each loading their own,
+                # sparse model files are loaded by each worker rather than published as dense tables
+                shared = SharedModel.publish(local_runner(params).load_model())
+                params.shared_model = shared.path
+            try:
+                setup = (params, algo_params, state['setup_seed'])
+                if checkpoint is not None and algo_params['algo'] in ('pbvi', 'qmdp') and workers > 1:
+                    # solves (or resumes solving) the offline policy once here, the workers load the finished solve
+                    # from its checkpoint instead of solving it again each
+                    set_seed(state['setup_seed'])
+                    local_runner(params).setup(**algo_params)
+                    params.resume = True
+
+                # a resumed run asking for fewer episodes than the checkpoint holds seeds for stops at --benchmark
+                jobs = [(algo_params, seed) for seed in state['seeds'][rewards.n:params.benchmark]]
+                sequential = target_ci is not None or target_rel_error is not None
+                results = play_benchmark(setup, jobs, workers)
+                for episode_steps, reward in results:
+                    steps.push(episode_steps)
+                    rewards.push(reward)
+                    if checkpoint is not None:
+                        checkpoint.save(state, force=rewards.n == params.benchmark)
+                    if sequential and rewards.n >= min_episodes and rewards.precise(z, target_ci, target_rel_error):
+                        log.info('Stopping after {} episodes, the mean reward is precise enough', rewards.n)
+                        if checkpoint is not None:
+                            checkpoint.save(state, force=True)
+                        break
+                results.close()
+            finally:
+                if shared is not None:
+                    shared.close()
 
              #Showing final results
             log.info('\n'.join([
                 '+'*20,
-                'Results after ending {} simulations:'.format(params.benchmark),
+                'Results after ending {} simulations:'.format(rewards.n),
                 '='*20,
-                'Total steps: {}'.format(runner.steps),
-                'Final reward: {}'.format(runner.fReward),
+                'Total steps: {}'.format(steps.total),
+                'Final reward: {}'.format(rewards.total),
                 '='*5 + ' Analysing results ' + '='*5,
-                'Average steps: {}'.format(runner.steps / params.benchmark),
-                'Average reward: {}'.format(runner.fReward/params.benchmark),
-                'Standard deviation of the steps: {}'.format(statistics.stdev(runner.step_list)),
-                'Standard deviation of the reward: {}'.format(statistics.stdev(runner.fReward_list)),
+                'Average steps: {} +/- {}'.format(steps.mean, steps.ci(z)),
+                'Average reward: {} +/- {}'.format(rewards.mean, rewards.ci(z)),
+                'Standard deviation of the steps: {}'.format(steps.std),
+                'Standard deviation of the reward: {}'.format(rewards.std),
                 '=' * 20
-            ]))
\ No newline at end of file
+            ]))
+            # only known for the episodes played in this process
+            cache = getattr(runner.pomdp, 'belief_cache', None) if runner is not None else None
+            if cache is not None:
+                log.info('Belief cache: {hits} hits, {misses} misses, hit rate {hit_rate:.3f}, {size} entries in {bytes} bytes',
+                         **cache.stats())
+
+    if profile is not None:
+        pstats_path = Profiler.dump(profile, '{}-{}'.format(params.config, os.path.splitext(params.env)[0]))
+        log.info('\n'.join([
+            '='*5 + ' Profile ' + '='*5,
+            Profiler.report(),
+            'cProfile statistics: {}'.format(pstats_path)
+        ]))
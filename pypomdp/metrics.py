@@ -0,0 +1,93 @@
+import os
+import csv
+import json
+import resource
+
+
+STEP_FIELDS = ['type', 'pid', 'episode', 'step', 'action', 'observation', 'reward', 'cost', 'plan_time',
+               'simulations', 'tree_nodes', 'particles', 'rss']
+EPISODE_FIELDS = ['type', 'pid', 'episode', 'steps', 'total_reward', 'total_cost', 'wall_time', 'rss']
+
+
+def current_rss():
+    """
+    Resident set size of the process in bytes, falls back to the peak RSS where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def solver_stats(pomdp):
+    """
+    Search statistics of the last planning call, None where the solver has no such notion
+    """
+    tree = getattr(pomdp, 'tree', None)
+    if tree is not None:
+        particles = len(tree.root.B)
+    else:
+        particles = len(pomdp.particles) if getattr(pomdp, 'particles', None) is not None else None
+    # the numba engine's tree lives in the kernel, the BeliefTree only mirrors its top levels
+    kernel = getattr(pomdp, 'kernel', None)
+    if kernel is not None:
+        tree_nodes = kernel.size()
+    else:
+        tree_nodes = len(tree.nodes) if tree is not None else None
+    return {
+        'simulations': getattr(pomdp, 'simulations', None),
+        'tree_nodes': tree_nodes,
+        'particles': particles,
+    }
+
+
+class MetricsSink(object):
+    """
+    Buffered structured metrics stream, one record per step and one per episode.
+    Records are written as JSON lines, or as CSV rows (union of step and episode fields) when the path ends in .csv
+    """
+    def __init__(self, path, buffer_size=1 << 20):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.pid = os.getpid()
+        self.file = open(path, 'a', buffering=buffer_size, newline='')
+        self.writer = None
+        if path.endswith('.csv'):
+            fields = STEP_FIELDS + [f for f in EPISODE_FIELDS if f not in STEP_FIELDS]
+            self.writer = csv.DictWriter(self.file, fieldnames=fields)
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+
+    @staticmethod
+    def per_process(path):
+        """
+        Path of the stream written by the current worker process, e.g. metrics.jsonl -> metrics-<pid>.jsonl
+        """
+        base, ext = os.path.splitext(path)
+        return '{}-{}{}'.format(base, os.getpid(), ext)
+
+    def write(self, record):
+        record['pid'] = self.pid
+        if self.writer is not None:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+
+    def step(self, episode, step, action, observation, reward, cost, plan_time, pomdp):
+        record = {'type': 'step', 'episode': episode, 'step': step, 'action': action, 'observation': observation,
+                  'reward': reward, 'cost': cost, 'plan_time': plan_time, 'rss': current_rss()}
+        record.update(solver_stats(pomdp))
+        self.write(record)
+
+    def episode(self, episode, steps, total_reward, total_cost, wall_time):
+        self.write({'type': 'episode', 'episode': episode, 'steps': steps, 'total_reward': total_reward,
+                    'total_cost': total_cost, 'wall_time': wall_time, 'rss': current_rss()})
+        # episodes are the unit of work of pool workers, which may be terminated without any teardown
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
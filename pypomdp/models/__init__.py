@@ -1,3 +1,6 @@
-
 from .model import Model
-from .rock_sample_problem import RockSampleModel
\ No newline at end of file
+from .compiled_model import CompiledModel
+from .rock_sample_problem import RockSampleModel
+from .tag_problem import TagModel
+from .shared_model import SharedModel
+from .sparse_model import save_sparse, load_sparse
@@ -0,0 +1,107 @@
+import numpy as np
+
+# models with at least this many states default to float32 tables, see CompiledModel.resolve_dtype
+LARGE_MODEL_STATES = 500
+
+
+class CompiledModel(object):
+    """
+    Array-backed view of a model's dynamics, indexed by integer state, action and observation positions:
+        T[a, si, sj]: transition probability
+        Z[a, sj, o]: observation probability
+        R[a, si]: immediate reward (same semantics as Model.reward_function(a, si))
+    The tables, and the beliefs and alpha vectors computed from them, share the floating point type of T
+    """
+    def __init__(self, states, actions, observations, discount, T, Z, R):
+        self.states = states
+        self.actions = actions
+        self.observations = observations
+        self.discount = discount
+        self.T, self.Z, self.R = T, Z, R
+
+        self.state_index = {s: i for i, s in enumerate(states)}
+        self.action_index = {a: i for i, a in enumerate(actions)}
+        self.obs_index = {o: i for i, o in enumerate(observations)}
+
+        self.V_mdp = None
+        self.Q_mdp = None
+
+    @property
+    def dtype(self):
+        return self.T.dtype
+
+    @staticmethod
+    def resolve_dtype(dtype, num_states):
+        """
+        :param dtype: 'float32', 'float64', or None / 'auto' to pick float32 for large models, whose matrix
+        products are bound by memory bandwidth, and float64 otherwise
+        """
+        if dtype is None or dtype == 'auto':
+            return np.dtype(np.float32 if num_states >= LARGE_MODEL_STATES else np.float64)
+        return np.dtype(dtype)
+
+    @staticmethod
+    def from_model(model, dtype=None):
+        """
+        Builds the arrays from the model's dictionary tables, unlisted entries are zero
+        :param dtype: floating point type of the arrays, defaults to the model's
+        """
+        S, A, O = len(model.states), len(model.actions), len(model.observations)
+        if dtype is None:
+            dtype = getattr(model, 'dtype', np.float64)
+        sidx = {s: i for i, s in enumerate(model.states)}
+        aidx = {a: i for i, a in enumerate(model.actions)}
+        oidx = {o: i for i, o in enumerate(model.observations)}
+
+        T = np.zeros((A, S, S), dtype=dtype)
+        for (a, si, sj), p in model.T.items():
+            if a in aidx and si in sidx and sj in sidx:
+                T[aidx[a], sidx[si], sidx[sj]] = p
+
+        Z = np.zeros((A, S, O), dtype=dtype)
+        for (a, sj, o), p in model.Z.items():
+            if a in aidx and sj in sidx and o in oidx:
+                Z[aidx[a], sidx[sj], oidx[o]] = p
+
+        R = np.zeros((A, S), dtype=dtype)
+        for (a, si, sj, o), r in model.R.items():
+            if a in aidx and si in sidx and sj == '*' and o == '*':
+                R[aidx[a], sidx[si]] = r
+
+        return CompiledModel(model.states, model.actions, model.observations, model.discount, T, Z, R)
+
+    def value_iteration(self, epsilon=1e-6, max_iterations=1000):
+        """
+        Solves the fully observable MDP by vectorised value iteration, results are cached on the instance
+        :param epsilon: stops once the largest change of V is below this threshold
+        :param max_iterations: upper bound on the number of Bellman backups
+        :return: V_mdp (S,) and Q_mdp (A, S)
+        """
+        if self.V_mdp is not None:
+            return self.V_mdp, self.Q_mdp
+
+        V = np.zeros(len(self.states), dtype=self.dtype)
+        Q = self.R.copy()
+        resolution = np.finfo(self.dtype).eps
+        for _ in range(max_iterations):
+            Q = self.R + self.discount * np.dot(self.T, V)
+            V_new = Q.max(axis=0)
+            delta = np.abs(V_new - V).max()
+            V = V_new
+            # float32 values stop changing well above small epsilons
+            if delta < max(epsilon, 4 * resolution * np.abs(V).max()):
+                break
+
+        self.V_mdp, self.Q_mdp = V, Q
+        return V, Q
+
+    def belief_update(self, belief, ai, oi):
+        """
+        Bayesian belief update b'(sj) ~ Z(a, sj, o) * sum_si T(a, si, sj) b(si)
+        :return: the normalised new belief, or None if the observation is impossible under 'belief'
+        """
+        b_new = self.Z[ai, :, oi] * np.dot(np.asarray(belief, dtype=self.dtype), self.T[ai])
+        total = b_new.sum()
+        if total <= 0:
+            return None
+        return b_new / total
@@ -1,6 +1,7 @@
 
 from abc import abstractmethod
-from util import draw_arg
+from util import draw_arg, draw_arg_det, normalise
+from models.compiled_model import CompiledModel
 import numpy as np
 
 
@@ -19,11 +20,36 @@ class Model(object):
             T
             Z
             R
+        Optional:
+            dtype
         """
         for k, v in env.items():
             self.__dict__[k] = v
 
-        self.curr_state = self.init_state or np.random.choice(self.states)
+        self.reset()
+        # tables may come compiled already, e.g. attached from a SharedModel
+        self._compiled = self.__dict__.pop('compiled', None)
+        # floating point type of the compiled tables, beliefs and alpha vectors ('float32', 'float64' or 'auto')
+        if self._compiled is not None:
+            self.dtype = self._compiled.dtype
+        else:
+            self.dtype = CompiledModel.resolve_dtype(env.get('dtype'), len(self.states))
+        # non zero rows of T and Z, built on first use by simulate_action
+        self._successors, self._emissions = None, None
+
+        # per state bitmask of the selectable actions, used by the solvers' expansions and rollouts
+        self.legal_mask = self.build_legal_mask()
+        self.legal_actions = {s: [a for a, legal in zip(self.actions, row) if legal]
+                              for s, row in zip(self.states, self.legal_mask)}
+
+    def reset(self, seed=None):
+        """
+        Puts the environment back in its initial state
+        :param seed: seed of the environment's own random stream (initial state, transition and observation noise),
+        None draws from the global generator shared with the solvers
+        """
+        self.rng = np.random.RandomState(seed) if seed is not None else np.random
+        self.curr_state = self.init_state or self.states[self.rng.randint(len(self.states))]
 
     @property
     def num_states(self):
@@ -31,7 +57,53 @@ class Model(object):
 
     @property
     def num_actions(self):
-        return len(self.states)
+        return len(self.actions)
+
+    @property
+    def num_observations(self):
+        return len(self.observations)
+
+    @property
+    def compiled(self):
+        """
+        Array-backed tables of the model, built on first access
+        """
+        if self._compiled is None:
+            self._compiled = CompiledModel.from_model(self)
+        return self._compiled
+
+    @staticmethod
+    def sparse_rows(table, columns):
+        """
+        Groups the non zero entries of a T or Z table by their (action, state) prefix. The probabilities of a row
+        are normalised in double precision, as tables read from float32 arrays (e.g. a published SharedModel) only
+        sum to 1 up to their rounding
+        :param columns: names of the last key entry (states or observations), giving the order within a row
+        :return: {(action, state): ([column names], [probabilities])}
+        """
+        order = {c: i for i, c in enumerate(columns)}
+        rows = {}
+        for key, p in table.items():
+            if p:
+                rows.setdefault(key[:2], []).append((order[key[2]], p))
+        return {k: ([columns[i] for i, _ in row], normalise([p for _, p in row])) for k, row in
+                ((k, sorted(row)) for k, row in rows.items())}
+
+    def successors(self, action, state):
+        """
+        :return: the next states of the given state and action with their probabilities, in the order of states
+        """
+        if self._successors is None:
+            self._successors = self.sparse_rows(self.T, self.states)
+        return self._successors[(action, state)]
+
+    def emissions(self, action, state):
+        """
+        :return: the observations of the state reached by the given action with their probabilities
+        """
+        if self._emissions is None:
+            self._emissions = self.sparse_rows(self.Z, self.observations)
+        return self._emissions[(action, state)]
 
     def gen_particles(self, n, prob=None):
         if prob is None:
@@ -40,93 +112,29 @@ class Model(object):
 
         return [self.states[draw_arg(prob)] for i in range(n)]
 
+    def build_legal_mask(self):
+        """
+        Simplest situation is every action is legal, but the actual model class may mask out actions according to
+        the specific knowledge domain, e.g. moves into a wall
+        :return: boolean array (num_states, num_actions)
+        """
+        return np.ones((self.num_states, self.num_actions), dtype=bool)
+
     def get_legal_actions(self, state):
         """
-        Simplest situation is every action is legal, but the actual model class
-        may handle it differently according to the specific knowledge domain
+        Looks up the legal actions precomputed from legal_mask at load
         :param state:
         :return: actions selectable at the given state
         """
-        #Tag problem, managing the possible actions
-
-        # if 'Srv' in state:
-        #     # Getting the column and row
-        #     vertical = state[3:4]
-        #     horiz = state[6:7]
-        #
-        #     # FIRST ROW
-        #     # If the robot A is in the first row of the map, he shouldn't be able to move to the North
-        #     f_actions = self.actions
-        #     if vertical == 0:
-        #         #del f_actions[0]
-        #         f_actions.remove('North')
-        #         # Cell 26, cant go north nor west
-        #         if horiz == 5:
-        #             #del f_actions[3]
-        #             f_actions.remove('West')
-        #         # Cell 28, cant go north nor east
-        #         if horiz == 7:
-        #             #del f_actions[2]
-        #             f_actions.remove('East')
-        #
-        #     # SECOND ROW
-        #     # If the robot A is in the second row may not be able to go west or east, depending on the cell
-        #     if vertical == 1:
-        #         # Cell 23, cant go west
-        #         if horiz == 5:
-        #             #del f_actions[3]
-        #             f_actions.remove('West')
-        #         # Cell 25, cant go east
-        #         if horiz == 7:
-        #             #del f_actions[2]
-        #             f_actions.remove('East')
-        #
-        #     # THIRD ROW
-        #     # If the robot A is in the third row may not be able to go west or east, depending on the cell
-        #     if vertical == 2:
-        #         # Cell 20, cant go west
-        #         if horiz == 5:
-        #             #del f_actions[3]
-        #             f_actions.remove('West')
-        #         # Cell 22, cant go east
-        #         if horiz == 7:
-        #             #del f_actions[2]
-        #             f_actions.remove('East')
-        #
-        #     # FOURTH ROW
-        #     # If the robot A is in the fourth row may not be able to go north, west or east, depending on the cell
-        #     if vertical == 3:
-        #         # Cells 10, 11, 12, 13, 14, 18 and 19 can't go north
-        #         if horiz == 0 or horiz == 1 or horiz == 2 or horiz == 3 or horiz == 4 or horiz == 8 or horiz == 9:
-        #             #del f_actions[0]
-        #             f_actions.remove('North')
-        #             # Cell 10, can't go west either
-        #             if horiz == 0:
-        #                 #del f_actions[3]
-        #                 f_actions.remove('West')
-        #             # Cell 19, can't go east either
-        #             if horiz == 9:
-        #                 #del f_actions[2]
-        #                 f_actions.remove('East')
-        #
-        #     # FIFTH ROW / LAST ROW
-        #     # If the robot A is in the last row of the map, he shouldn't be able to move to the South
-        #     if vertical == 4:
-        #         #del f_actions[1]
-        #         f_actions.remove('South')
-        #         # Cell 0, can't go west either
-        #         if horiz == 0:
-        #             #del f_actions[3]
-        #             f_actions.remove('West')
-        #
-        #         # Cell 10, can't go east either
-        #         if horiz == 9:
-        #             #del f_actions[2]
-        #             f_actions.remove('East')
-        #
-        #     return f_actions
-
-        return self.actions
+        return self.legal_actions[state]
+
+    # Domain specific rollout policy, i.e. a method mapping a state to an action, may be supplied by subclasses
+    # and selected for POMCP with "rollout_policy": "model"
+    rollout_policy = None
+
+    # Set by subclasses overriding simulate_action with the dynamics of their T, Z and R tables, which the table
+    # driven solvers (e.g. the numba POMCP engine) rely on
+    matches_tables = False
 
     def observation_function(self, action, state, obs):
         return self.Z.get((action, state, obs), 0.0)
@@ -150,13 +158,13 @@ class Model(object):
         ai: action taken at the current state
         return: next state, observation and reward
         """
-        # get new state
-        s_probs = [self.transition_function(ai, si, sj) for sj in self.states]
-        state = self.states[draw_arg(s_probs)]
+        # get new state, zero probability outcomes are skipped as they can't be drawn anyway
+        next_states, s_probs = self.successors(ai, si)
+        state = next_states[draw_arg(s_probs)]
 
         # get new observation
-        o_probs = [self.observation_function(ai, state, oj) for oj in self.observations]
-        observation = self.observations[draw_arg(o_probs)]
+        observations, o_probs = self.emissions(ai, state)
+        observation = observations[draw_arg(o_probs)]
 
         if debug:
             print('taking action {} at state {}'.format(ai ,si))
@@ -170,14 +178,36 @@ class Model(object):
 
         return state, observation, reward, cost
 
+    def simulate_scenario(self, si, ai, rand_nums):
+        """
+        Determinized version of simulate_action, the outcome is fixed by the scenario's random numbers
+
+        si: current state
+        ai: action taken at the current state
+        rand_nums: pair of uniform numbers in [0, 1) used to draw the new state and observation respectively
+        return: next state, observation and reward
+        """
+        next_states, s_probs = self.successors(ai, si)
+        state = next_states[draw_arg_det(s_probs, rand_nums[0])]
+
+        observations, o_probs = self.emissions(ai, state)
+        observation = observations[draw_arg_det(o_probs, rand_nums[1])]
+
+        reward = self.reward_function(ai, si)
+        cost = self.cost_function(ai)
+
+        return state, observation, reward, cost
+
     def take_action(self, action):
         """
-        Accepts an action and changes the underlying environment state
-        
+        Accepts an action and changes the underlying environment state, the outcome is drawn from the two
+        uniform numbers of this step on the environment's stream, so that every solver facing a seeded episode
+        meets the same noise (common random numbers)
+
         action: action to take
         return: next state, observation and reward
         """
-        state, observation, reward, cost = self.simulate_action(self.curr_state, action)
+        state, observation, reward, cost = self.simulate_scenario(self.curr_state, action, self.rng.random_sample(2))
         self.curr_state = state
 
         return state, observation, reward, cost
@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+from models.compiled_model import CompiledModel
+
+# environment entries published next to the tables
+ENV_FIELDS = ['model_name', 'model_spec', 'discount', 'init_state', 'values', 'start', 'states', 'costs', 'actions',
+              'observations']
+
+
+class ArrayTable(object):
+    """
+    Read-only dictionary view of a compiled table, looked up with the keys of Model.T, Model.Z or Model.R.
+    Keys must end with 'suffix' (the wildcards of R), anything else reads as missing
+    """
+    def __init__(self, array, names, suffix=()):
+        self.array = array
+        self.names = names
+        self.indices = [{name: i for i, name in enumerate(axis)} for axis in names]
+        self.suffix = suffix
+
+    def get(self, key, default=0.0):
+        n = len(self.indices)
+        if tuple(key[n:]) != self.suffix:
+            return default
+        try:
+            position = tuple(index[k] for index, k in zip(self.indices, key))
+        except KeyError:
+            return default
+        return float(self.array[position])
+
+    def __getitem__(self, key):
+        value = self.get(key, None)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def items(self):
+        for position in zip(*np.nonzero(self.array)):
+            key = tuple(axis[i] for axis, i in zip(self.names, position))
+            yield key + self.suffix, float(self.array[position])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.array))
+
+
+class SharedModel(object):
+    """
+    Compiled tables of a model published once as memory mapped .npy files (under /dev/shm where available), to
+    which the models of other processes attach read-only. The pages are shared between the processes, so a worker
+    neither parses the environment nor holds its own copy of T, Z and R.
+        shared = SharedModel.publish(model)
+        env = SharedModel.attach(shared.path)   # in any process of the host
+    """
+    def __init__(self, path, owner=False):
+        self.path = path
+        self.owner = owner
+
+    @staticmethod
+    def publish(model, directory=None):
+        """
+        :param directory: parent folder of the published files, defaults to /dev/shm or the temporary folder
+        :return: the owner of the published model, whose close() removes it
+        """
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        path = tempfile.mkdtemp(prefix='pomdp-model-', dir=directory)
+
+        c = model.compiled
+        for name in ('T', 'Z', 'R'):
+            np.save(os.path.join(path, name + '.npy'), getattr(c, name))
+        with open(os.path.join(path, 'env.json'), 'w') as f:
+            json.dump({k: getattr(model, k, None) for k in ENV_FIELDS}, f)
+        return SharedModel(path, owner=True)
+
+    @staticmethod
+    def attach(path):
+        """
+        :return: environment of the published model, i.e. what PomdpParser.copy_env returns, with T, Z and R read
+        through views of the mapped tables and the tables themselves under 'compiled'
+        """
+        with open(os.path.join(path, 'env.json')) as f:
+            env = json.load(f)
+        T, Z, R = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ('T', 'Z', 'R')]
+
+        states, actions, observations = env['states'], env['actions'], env['observations']
+        env['compiled'] = CompiledModel(states, actions, observations, env['discount'], T, Z, R)
+        env['T'] = ArrayTable(T, [actions, states, states])
+        env['Z'] = ArrayTable(Z, [actions, states, observations])
+        env['R'] = ArrayTable(R, [actions, states], suffix=('*', '*'))
+        return env
+
+    def close(self):
+        if self.owner and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
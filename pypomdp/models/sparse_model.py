@@ -0,0 +1,52 @@
+import os
+import json
+import numpy as np
+
+from models.shared_model import ENV_FIELDS
+
+# coordinate list columns of each table in a sparse model file
+TABLES = {
+    'T': ('action', 'state', 'next_state', 'p'),
+    'Z': ('action', 'next_state', 'observation', 'p'),
+    'R': ('action', 'state', 'r'),
+}
+
+
+def save_sparse(path, env, T, Z, R):
+    """
+    Writes a model as a .npz of coordinate lists, for models whose dense tables (CompiledModel) or .POMDP text
+    would not fit, e.g. large grid worlds. Only the non zero entries are stored, indices refer to the positions of
+    the states, actions and observations of 'env'
+    :param env: the ENV_FIELDS entries of the model
+    :param T: (action, state, next_state, p) index and value arrays
+    :param Z: (action, next_state, observation, p) index and value arrays
+    :param R: (action, state, r) index and value arrays of the rewards R(a, s)
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    columns = {}
+    for name, table in (('T', T), ('Z', Z), ('R', R)):
+        keep = np.asarray(table[-1]) != 0
+        for column, values in zip(TABLES[name], table):
+            columns['{}_{}'.format(name, column)] = np.asarray(values)[keep]
+    meta = json.dumps({k: env.get(k) for k in ENV_FIELDS})
+    np.savez_compressed(path, env=np.array(meta), **columns)
+
+
+def load_sparse(path):
+    """
+    :return: the environment of a sparse model file, i.e. what PomdpParser.copy_env returns
+    """
+    with np.load(path) as f:
+        env = json.loads(str(f['env']))
+        states, actions, observations = env['states'], env['actions'], env['observations']
+
+        a, si, sj, p = [f['T_' + c].tolist() for c in TABLES['T']]
+        env['T'] = {(actions[x], states[y], states[z]): v for x, y, z, v in zip(a, si, sj, p)}
+        a, sj, o, p = [f['Z_' + c].tolist() for c in TABLES['Z']]
+        env['Z'] = {(actions[x], states[y], observations[z]): v for x, y, z, v in zip(a, sj, o, p)}
+        a, si, r = [f['R_' + c].tolist() for c in TABLES['R']]
+        env['R'] = {(actions[x], states[y], '*', '*'): v for x, y, v in zip(a, si, r)}
+    return env
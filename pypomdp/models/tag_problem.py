@@ -0,0 +1,161 @@
+from models.model import Model
+from util import draw_arg, draw_arg_det
+import numpy as np
+
+
+class TagModel(Model):
+    """
+    Tag (Pineau et al. 2003): a robot chases a target on a grid, it sees its own cell and whether the target shares
+    it. The target moves away from the robot: 0.4 along each axis (split in two when aligned on that axis) and
+    stays with 0.2, moves blocked by a wall leave it in place. Catching costs 10 when missed and pays 10 otherwise,
+    every move costs 1.
+
+    The dynamics are computed from GRID, so the model does not need the tables of Tag.POMDP: generate_env builds the
+    environment the parser would have produced, and transitions are simulated without scanning the states.
+    """
+    # rows are north to south (v), columns west to east (h), '.' cells are free
+    GRID = ('     ...  ',
+            '     ...  ',
+            '     ...  ',
+            '..........',
+            '..........')
+    MOVES = {'North': (-1, 0), 'South': (1, 0), 'East': (0, 1), 'West': (0, -1)}
+    ACTIONS = ['North', 'South', 'East', 'West', 'Catch']
+    matches_tables = True
+
+    def __init__(self, env):
+        cells = TagModel.cells()
+        self.free = set(cells)
+        # state name <=> (robot cell, target cell or None once tagged), needed by the legal mask built at load
+        self.positions = dict(TagModel.states_of(cells))
+        self.names = {position: name for name, position in self.positions.items()}
+        Model.__init__(self, env)
+
+    @staticmethod
+    def cells(grid=GRID):
+        """
+        :return: free cells as (v, h), in the order of the .POMDP file (south to north, west to east)
+        """
+        return [(v, h) for v in reversed(range(len(grid))) for h in range(len(grid[v])) if grid[v][h] == '.']
+
+    @staticmethod
+    def cell_name(cell):
+        return 'rv{}rh{}'.format(*cell)
+
+    @staticmethod
+    def states_of(cells):
+        """
+        :return: (state name, (robot, target)) pairs, each robot cell followed by its target cells and tagged state
+        """
+        for robot in cells:
+            for target in cells:
+                yield 'S{}tv{}th{}'.format(TagModel.cell_name(robot), *target), (robot, target)
+            yield 'S{}tagged'.format(TagModel.cell_name(robot)), (robot, None)
+
+    @staticmethod
+    def move(cell, action, free):
+        v, h = cell
+        dv, dh = TagModel.MOVES[action]
+        return (v + dv, h + dh) if (v + dv, h + dh) in free else cell
+
+    @staticmethod
+    def target_moves(robot, target, free):
+        """
+        :return: {target's next cell: probability}
+        """
+        outcomes = {target: 0.2}
+        for axis, (toward, away) in enumerate([('North', 'South'), ('West', 'East')]):
+            if target[axis] == robot[axis]:
+                moves = [(toward, 0.2), (away, 0.2)]
+            else:
+                moves = [(away if target[axis] > robot[axis] else toward, 0.4)]
+            for action, p in moves:
+                cell = TagModel.move(target, action, free)
+                outcomes[cell] = outcomes.get(cell, 0.0) + p
+        return outcomes
+
+    @staticmethod
+    def outcomes(robot, target, action, free):
+        """
+        :return: reward and {(robot's next cell, target's next cell or None): probability} of an action
+        """
+        if target is None:
+            return 0, {(robot, None): 1.0}
+        if action == 'Catch':
+            if target == robot:
+                return 10, {(robot, None): 1.0}
+            ri, reward = robot, -10
+        else:
+            ri, reward = TagModel.move(robot, action, free), -1
+        # the target flees from where the robot was before its move
+        return reward, {(ri, tj): p for tj, p in TagModel.target_moves(robot, target, free).items()}
+
+    @staticmethod
+    def observe(robot, target, action):
+        # Catch never ends in a shared cell (the target is tagged or flees), the tables report the robot's cell there
+        return 'yes' if robot == target and action != 'Catch' else 'O' + TagModel.cell_name(robot)
+
+    @staticmethod
+    def generate_env(model_spec=None):
+        """
+        Builds the environment of Tag.POMDP from GRID, i.e. the dictionary PomdpParser.copy_env returns
+        """
+        cells = TagModel.cells()
+        free = set(cells)
+        positions = list(TagModel.states_of(cells))
+        names = {position: name for name, position in positions}
+        states = [name for name, _ in positions]
+        actions = list(TagModel.ACTIONS)
+        T, Z, R = {}, {}, {}
+        for si, (robot, target) in positions:
+            for a in actions:
+                reward, nexts = TagModel.outcomes(robot, target, a, free)
+                R[(a, si, '*', '*')] = reward
+                for position, p in nexts.items():
+                    T[(a, si, names[position])] = p
+                # observations only depend on the state reached
+                Z[(a, si, TagModel.observe(robot, target, a))] = 1.0
+
+        untagged = [name for name, (_, target) in positions if target is not None]
+        return {
+            'model_name': 'Tag',
+            'model_spec': model_spec,
+            'discount': 0.95,
+            'init_state': None,
+            'values': 'reward',
+            'start': [1 / len(untagged) if target is not None else 0.0 for _, (_, target) in positions],
+            'states': states,
+            'costs': None,
+            'actions': actions,
+            'observations': ['O' + TagModel.cell_name(cell) for cell in cells] + ['yes'],
+            'T': T,
+            'Z': Z,
+            'R': R,
+        }
+
+    def build_legal_mask(self):
+        """
+        Moves into a wall or off the grid are pointless, Catch is always allowed
+        """
+        mask = np.ones((self.num_states, self.num_actions), dtype=bool)
+        for si, state in enumerate(self.states):
+            robot, _ = self.positions[state]
+            for ai, action in enumerate(self.actions):
+                mask[si, ai] = action not in TagModel.MOVES or TagModel.move(robot, action, self.free) != robot
+        return mask
+
+    def __step(self, si, ai, u=None):
+        robot, target = self.positions[si]
+        reward, nexts = TagModel.outcomes(robot, target, ai, self.free)
+        positions, probs = list(nexts), list(nexts.values())
+        k = draw_arg(probs) if u is None else draw_arg_det(probs, u)
+        robot, target = positions[k]
+        state = self.names[(robot, target)]
+        return state, TagModel.observe(robot, target, ai), reward, self.cost_function(ai)
+
+    def simulate_action(self, si, ai, debug=False):
+        return self.__step(si, ai)
+
+    def simulate_scenario(self, si, ai, rand_nums):
+        # the observation is deterministic, only the first random number is used
+        return self.__step(si, ai, rand_nums[0])
@@ -1,4 +1,5 @@
 
 from .env_parser import PomdpxParser
-from .env_parser import PomdpParser
+from .env_parser import PomdpParser, GeneratedEnv, parse_model_name
 from .tree_visualiser import GraphViz
+from .tree_snapshot import TreeSnapshot
@@ -11,6 +11,17 @@ import os
 import itertools
 
 
+def parse_model_name(config_file):
+    """
+    :return: model name and spec encoded in an environment file name, e.g. RockSample-7x8.POMDP => RockSample, 7x8
+    """
+    fname = os.path.basename(config_file)
+    if '-' in fname:
+        name, spec = fname.split('-')
+        return name.split('.')[0], spec.split('.')[0]
+    return fname.split('.')[0], None
+
+
 class PomdpxParser:
     # TODO
     pass
@@ -55,13 +66,7 @@ class PomdpParser:
         self = None
 
     def __get_model(self):
-        fname = os.path.basename(self.config_file)
-        if '-' in fname:
-            name, spec = fname.split('-')
-            self.model_spec = spec.split('.')[0]
-            self.model_name = name.split('.')[0]
-        else:
-            self.model_name = fname.split('.')[0]
+        self.model_name, self.model_spec = parse_model_name(self.config_file)
 
     def __get_discount(self, i):
         line = self.contents[i]
@@ -347,9 +352,10 @@ class PomdpParser:
             "costs": deepcopy(self.costs),
             "actions": deepcopy(self.actions),
             "observations": deepcopy(self.observations),
-            "T": deepcopy(self.T),
-            "Z": deepcopy(self.Z),
-            "R": deepcopy(self.R)
+            # the tables are handed over rather than copied, the parser is discarded once the model is built
+            "T": self.T,
+            "Z": self.Z,
+            "R": self.R
         }
 
     def random_beliefs(self):
@@ -365,3 +371,22 @@ class PomdpParser:
         # must be many better ways to do it
         beliefs = [[random.uniform() for s in self.states] for p in arange(0., 1. + stepsize, stepsize)]
         return array(beliefs)
+
+
+class GeneratedEnv(PomdpParser):
+    """
+    Environment built by its model class (e.g. TagModel.generate_env) or attached from a SharedModel instead of
+    parsed from a file, with the interface of PomdpParser
+    """
+    def __init__(self, env):
+        PomdpParser.__init__(self, None)
+        self.values = None
+        for k, v in env.items():
+            setattr(self, k, v)
+        self.env = env
+
+    def __enter__(self):
+        return self
+
+    def copy_env(self):
+        return dict(self.env)
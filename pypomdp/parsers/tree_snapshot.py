@@ -0,0 +1,84 @@
+import os
+import json
+import queue
+import threading
+
+# columns of the node rows of a snapshot record
+NODE_FIELDS = ['id', 'parent', 'type', 'name', 'N', 'V', 'particles']
+
+
+def node_row(node, parent_id):
+    kind = 'action' if hasattr(node, 'action') else 'belief'
+    particles = len(node.B) if kind == 'belief' else None
+    return [node.id, parent_id, kind, node.name, node.N, node.V, particles]
+
+
+class TreeSnapshot(object):
+    """
+    Compact dump of the search tree, one JSON line per snapshot holding the nodes as NODE_FIELDS rows.
+    Only the top_k most visited children of each node are kept, down to 'depth' levels below the root (action and
+    belief levels both count). The capture walks the bounded tree in the caller's thread since the tree keeps
+    changing, serialising and writing happen in a background thread.
+    Snapshots are rendered offline, see render_snapshots.py
+    """
+    def __init__(self, directory, depth=4, top_k=5):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = os.path.join(directory, 'tree-{}.jsonl'.format(os.getpid()))
+        self.depth = depth
+        self.top_k = top_k
+        self.file = open(self.path, 'a')
+        self.records = queue.Queue()
+        self.writer = threading.Thread(target=self.__write, daemon=True)
+        self.writer.start()
+
+    def capture(self, root):
+        """
+        :return: the NODE_FIELDS rows of the bounded tree, parents before their children
+        """
+        rows, frontier = [node_row(root, None)], [(root, 0)]
+        while frontier:
+            node, depth = frontier.pop()
+            if depth >= self.depth:
+                continue
+            children = sorted(node.children, key=lambda ch: ch.N, reverse=True)[:self.top_k]
+            for ch in children:
+                rows.append(node_row(ch, node.id))
+                frontier.append((ch, depth + 1))
+        return rows
+
+    def snapshot(self, tree, episode, step):
+        self.records.put({'episode': episode, 'step': step, 'nodes': self.capture(tree.root)})
+
+    def flush(self):
+        """
+        Blocks until the queued snapshots are written
+        """
+        self.records.join()
+        self.file.flush()
+
+    def close(self):
+        self.records.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def __write(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                self.records.task_done()
+                return
+            self.file.write(json.dumps(record) + '\n')
+            self.records.task_done()
+
+    @staticmethod
+    def load(path):
+        """
+        :return: the snapshot records of a dump, node rows converted to dictionaries
+        """
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                record['nodes'] = [dict(zip(NODE_FIELDS, row)) for row in record['nodes']]
+                yield record
@@ -1,5 +1,4 @@
 import json
-import graphviz
 from abc import abstractmethod
 from util.belief_tree import Node, ActionNode, BeliefNode
 
@@ -29,21 +28,44 @@ class GraphViz(TreeVisualiser):
         # self.graph = graphviz.Digraph(description)
 
     def update(self, node, parent=None):
+        import graphviz  # only needed once a graph gets built
         self.graph = graphviz.Digraph(self.description)
         self.graph.attr(rankdir='LR')
         self.__update(node)
         if parent:
             self.graph.edge(parent, node)
 
+    def update_from_snapshot(self, nodes):
+        """
+        Builds the graph of a TreeSnapshot record
+        :param nodes: node dictionaries of the record, see TreeSnapshot.load
+        """
+        import graphviz
+        self.graph = graphviz.Digraph(self.description)
+        self.graph.attr(rankdir='LR')
+        labels = {}
+        for node in nodes:
+            prefix = 'Aid' if node['type'] == 'action' else 'Bid'
+            labels[node['id']] = '{} = {}, N = {}, V = {}'.format(prefix, node['id'], node['N'], round(node['V'], 6))
+            if node['parent'] is not None:
+                self.graph.edge(labels[node['parent']], labels[node['id']], label=node['name'])
+
     def render(self, fname=None, directory=None):
         self.graph.render(filename=fname, directory=directory)
 
-    def __update(self, node):
-        if not node.children:
-            return
+    def save(self, fname=None, directory=None):
+        """
+        Writes the DOT source only, without calling the graphviz binaries
+        """
+        self.graph.save(filename=fname, directory=directory)
 
-        for ch in node.children:
-            self.graph.edge(str(node), str(ch), label=ch.name )
-            self.__update(ch)
+    def __update(self, root):
+        # iterative, deep trees would exceed the recursion limit
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for ch in node.children:
+                self.graph.edge(str(node), str(ch), label=ch.name)
+                stack.append(ch)
 
 
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+import resource
+import tracemalloc
+
+import numpy as np
+
+from models import CompiledModel
+from solvers import PBVI, POMCP, QMDP
+from pomdp_runner import PomdpRunner
+from util import RunnerParams, set_seed, rand_choice, draw_arg
+from logger import Logger as log
+
+ENV_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'environments')
+
+# metric => whether larger values are better
+METRICS = {
+    'parse_s': False,
+    'parse_peak_bytes': False,
+    'compile_s': False,
+    'pbvi_iteration_s': False,
+    'pomcp_simulations_per_s': True,
+    'pomcp_update_belief_s': False,
+    'belief_update_s': False,
+}
+
+
+def env_runner(path, dtype=None):
+    """
+    Runner of the environment file, which loads and builds models the way benchmarks do (e.g. Tag is generated)
+    """
+    params = RunnerParams(os.path.basename(path), None, None, float('inf'), 0, False, False, 0, dtype=dtype)
+    params.env_folder = os.path.dirname(path)
+    return PomdpRunner(params)
+
+
+def create_model(path, env, dtype=None):
+    return env_runner(path, dtype).create_model(dict(env))
+
+
+def belief_points(path, stepsize):
+    with env_runner(path).open_env() as ctx:
+        return ctx.generate_belief_points(stepsize)
+
+
+def best_of(repeat, fn):
+    """
+    :return: the result of fn and the fastest of 'repeat' timed calls, the minimum being the least noisy estimate
+    """
+    timings = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - begin)
+    return result, min(timings)
+
+
+def parse(path):
+    with env_runner(path).open_env() as ctx:
+        return ctx.copy_env(), ctx.generate_beliefs()
+
+
+def parse_peak_bytes(path):
+    """
+    :return: peak memory allocated while parsing
+    """
+    tracemalloc.start()
+    parse(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def sample_steps(model, prior, n):
+    """
+    :return: n (action, observation) pairs produced by random play from a state drawn from the prior,
+    used to time a sequence of belief updates
+    """
+    steps, state = [], model.states[draw_arg(prior)]
+    for _ in range(n):
+        action = rand_choice(model.actions)
+        state, obs, _, _ = model.simulate_action(state, action)
+        steps.append((action, obs))
+    return steps
+
+
+def bench_env(path, args):
+    result = {}
+    (env, prior), result['parse_s'] = best_of(args.repeat, lambda: parse(path))
+    result['parse_peak_bytes'] = parse_peak_bytes(path)
+    model = create_model(path, env)
+    _, result['compile_s'] = best_of(args.repeat, lambda: CompiledModel.from_model(model))
+
+    steps = sample_steps(model, prior, args.belief_updates)
+
+    # exact belief update of PBVI over the compiled tables
+    pbvi = PBVI(model)
+
+    def update_beliefs():
+        belief = prior
+        for action, obs in steps:
+            belief = pbvi.update_belief(belief, action, obs)
+
+    _, elapsed = best_of(args.repeat, update_beliefs)
+    result['belief_update_s'] = elapsed / len(steps)
+
+    if model.num_states <= args.pbvi_max_states:
+        pbvi.add_configs(belief_points(path, args.pbvi_stepsize))
+        begin = time.perf_counter()
+        pbvi.solve(args.pbvi_iterations)
+        result['pbvi_iteration_s'] = (time.perf_counter() - begin) / args.pbvi_iterations
+    else:
+        result['pbvi_iteration_s'] = None
+
+    # a sequence of decisions, each belief update needs the tree grown by the solve before it
+    pomcp = POMCP(model)
+    pomcp.add_configs(initial_belief=prior, simulation_time=args.pomcp_time, max_particles=args.pomcp_particles,
+                      C=args.pomcp_c)
+    belief, state = prior, model.states[draw_arg(prior)]
+    simulations, solve_time, update_time = 0, 0.0, 0.0
+    for _ in range(args.pomcp_updates):
+        begin = time.perf_counter()
+        pomcp.solve(args.pomcp_horizon)
+        solve_time += time.perf_counter() - begin
+        simulations += pomcp.simulations
+
+        action = pomcp.get_action(belief)
+        state, obs, _, _ = model.simulate_action(state, action)
+        begin = time.perf_counter()
+        belief = pomcp.update_belief(belief, action, obs)
+        update_time += time.perf_counter() - begin
+    result['pomcp_simulations_per_s'] = simulations / solve_time
+    result['pomcp_update_belief_s'] = update_time / args.pomcp_updates
+
+    return result
+
+
+def run(args):
+    """
+    Benchmarks every environment shipped in the environments folder and writes the results as JSON
+    """
+    set_seed(args.seed)
+    paths = sorted(glob.glob(os.path.join(ENV_FOLDER, 'pomdp', '*.POMDP')))
+    # .pomdpx environments join the suite once PomdpxParser is able to load them
+    if args.env:
+        paths = [p for p in paths if os.path.basename(p) in args.env]
+
+    results = {}
+    for path in paths:
+        name = os.path.basename(path)
+        log.info('~~~ benchmarking {} ~~~', name)
+        results[name] = bench_env(path, args)
+
+    baseline = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'settings': {k: v for k, v in vars(args).items() if k not in ('func', 'out')},
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as out:
+        json.dump(baseline, out, indent=2)
+    log.info('Results written to {}', args.out)
+
+
+def dtype_accuracy(path, args):
+    """
+    Plays the same random steps with the float32 and float64 versions of the environment
+    :return: largest differences of the tables, QMDP values and beliefs, the largest float64 value lost (relative)
+    by acting on the float32 policies (QMDP, and PBVI on small models) and the share of identical actions
+    """
+    env, prior = parse(path)
+    models = {dtype: create_model(path, env, dtype) for dtype in ('float64', 'float32')}
+    exact, reduced = models['float64'].compiled, models['float32'].compiled
+    result = {
+        'compiled_bytes_float64': exact.T.nbytes + exact.Z.nbytes + exact.R.nbytes,
+        'compiled_bytes_float32': reduced.T.nbytes + reduced.Z.nbytes + reduced.R.nbytes,
+        'table_error': max(float(np.abs(getattr(exact, t) - getattr(reduced, t)).max()) for t in ('T', 'Z', 'R')),
+    }
+
+    policies = {dtype: [QMDP(m)] for dtype, m in models.items()}
+    for dtype, m in models.items():
+        policies[dtype][0].add_configs()
+        policies[dtype][0].solve(args.qmdp_iterations)
+        if m.num_states <= args.pbvi_max_states:
+            set_seed(args.seed)
+            pbvi = PBVI(m)
+            pbvi.add_configs(belief_points(path, args.pbvi_stepsize))
+            pbvi.solve(args.pbvi_iterations)
+            policies[dtype].append(pbvi)
+    Q = policies['float64'][0].Q
+    result['qmdp_value_error'] = float(np.abs(Q - policies['float32'][0].Q).max() / max(np.abs(Q).max(), 1e-12))
+
+    belief_error, value_loss, agreements, decisions = 0.0, 0.0, 0, 0
+    for _ in range(args.episodes):
+        beliefs = {dtype: np.asarray(prior, dtype=dtype) for dtype in models}
+        for action, obs in sample_steps(models['float64'], prior, args.steps):
+            for dtype, m in models.items():
+                c = m.compiled
+                beliefs[dtype] = c.belief_update(beliefs[dtype], c.action_index[action], c.obs_index[obs])
+            belief_error = max(belief_error, float(np.abs(beliefs['float64'] - beliefs['float32']).max()))
+            for exact_policy, reduced_policy in zip(policies['float64'], policies['float32']):
+                # actions of (nearly) tied values may differ, what matters is the float64 value they give up
+                gamma, actions = exact_policy.policy_matrix()
+                values = np.dot(beliefs['float64'], gamma)
+                chosen = exact.action_index[reduced_policy.get_action(beliefs['float32'])]
+                regret = values.max() - values[actions == chosen].max()
+                value_loss = max(value_loss, float(regret / max(np.abs(values).max(), 1e-12)))
+                decisions += 1
+                agreements += exact_policy.get_action(beliefs['float64']) == exact.actions[chosen]
+    result['belief_error'] = belief_error
+    result['value_loss'] = value_loss
+    result['action_agreement'] = agreements / max(decisions, 1)
+    return result
+
+
+def accuracy(args):
+    """
+    Checks the float32 mode against float64 on every environment shipped in the environments folder
+    :return: process exit status, 1 when an environment exceeds the tolerances
+    """
+    set_seed(args.seed)
+    paths = sorted(glob.glob(os.path.join(ENV_FOLDER, 'pomdp', '*.POMDP')))
+    if args.env:
+        paths = [p for p in paths if os.path.basename(p) in args.env]
+
+    log.info('{:<22}{:>13}{:>13}{:>12}{:>12}{:>12}{:>12}{:>10}',
+             'environment', 'float64', 'float32', 'tables', 'QMDP V', 'beliefs', 'value loss', 'agreement')
+    failures = []
+    for path in paths:
+        name = os.path.basename(path)
+        result = dtype_accuracy(path, args)
+        failed = result['belief_error'] > args.belief_tolerance or result['value_loss'] > args.value_tolerance
+        log.info('{:<22}{:>10.1f} MB{:>10.1f} MB{:>12.2g}{:>12.2g}{:>12.2g}{:>12.2g}{:>10.2%}  {}',
+                 name, result['compiled_bytes_float64'] / 2 ** 20, result['compiled_bytes_float32'] / 2 ** 20,
+                 result['table_error'], result['qmdp_value_error'], result['belief_error'], result['value_loss'],
+                 result['action_agreement'], 'FAILED' if failed else '')
+        if failed:
+            failures.append(name)
+
+    log.info('{} environment(s) beyond the tolerances', len(failures))
+    return 1 if failures else 0
+
+
+def compare(args):
+    """
+    Flags the metrics of 'current' which are worse than 'baseline' by more than the threshold
+    :return: process exit status, 1 when any regression was found
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = []
+    for env, metrics in sorted(current.items()):
+        for metric, value in sorted(metrics.items()):
+            before = baseline.get(env, {}).get(metric)
+            if before is None or value is None or metric not in METRICS or before == 0:
+                continue
+            change = (value - before) / abs(before)
+            worse = -change if METRICS[metric] else change
+            flag = 'REGRESSION' if worse > args.threshold else ''
+            log.info('{:<22}{:<26}{:>14.6g}{:>14.6g}{:>+9.1%}  {}', env, metric, before, value, change, flag)
+            if flag:
+                regressions.append((env, metric))
+
+    log.info('{} regression(s) beyond {:.0%}', len(regressions), args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Performance benchmarks of the shipped environments and solvers')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='Benchmark the environments and write a JSON baseline')
+    run_parser.add_argument('--out', type=str, default='perf_baseline.json', help='Output JSON path')
+    run_parser.add_argument('--env', type=str, nargs='*', default=None, help='Only benchmark these environment files')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the random number generators')
+    run_parser.add_argument('--repeat', type=int, default=5,
+                            help='Repetitions of the cheap measurements (parse, compile, belief update), the best is kept')
+    run_parser.add_argument('--belief_updates', type=int, default=20, help='Belief updates timed per environment')
+    run_parser.add_argument('--pbvi_iterations', type=int, default=2, help='PBVI backups timed per environment')
+    run_parser.add_argument('--pbvi_stepsize', type=float, default=0.1, help='PBVI belief points step size')
+    run_parser.add_argument('--pbvi_max_states', type=int, default=100,
+                            help='Skip PBVI on environments with more states than this')
+    run_parser.add_argument('--pomcp_time', type=float, default=1.0, help='POMCP planning time (seconds)')
+    run_parser.add_argument('--pomcp_horizon', type=int, default=3, help='POMCP planning horizon')
+    run_parser.add_argument('--pomcp_particles', type=int, default=700, help='POMCP particles')
+    run_parser.add_argument('--pomcp_c', type=float, default=10.0, help='POMCP UCB constant')
+    run_parser.add_argument('--pomcp_updates', type=int, default=5,
+                            help='POMCP decisions (solve then belief update) timed per environment')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON results and flag regressions')
+    compare_parser.add_argument('baseline', type=str, help='Baseline JSON path')
+    compare_parser.add_argument('current', type=str, help='Current JSON path')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative change counted as a regression (default 0.1, i.e. 10%%)')
+    compare_parser.set_defaults(func=compare)
+
+    accuracy_parser = commands.add_parser('accuracy', help='Check the float32 mode against float64')
+    accuracy_parser.add_argument('--env', type=str, nargs='*', default=None, help='Only check these environment files')
+    accuracy_parser.add_argument('--seed', type=int, default=0, help='Seed of the random number generators')
+    accuracy_parser.add_argument('--episodes', type=int, default=20, help='Random plays whose beliefs are compared')
+    accuracy_parser.add_argument('--steps', type=int, default=50, help='Steps per random play')
+    accuracy_parser.add_argument('--qmdp_iterations', type=int, default=1000, help='QMDP value iteration sweeps')
+    accuracy_parser.add_argument('--pbvi_iterations', type=int, default=2, help='PBVI backups')
+    accuracy_parser.add_argument('--pbvi_stepsize', type=float, default=0.1, help='PBVI belief points step size')
+    accuracy_parser.add_argument('--pbvi_max_states', type=int, default=1000,
+                                 help='Skip PBVI on environments with more states than this')
+    accuracy_parser.add_argument('--belief_tolerance', type=float, default=1e-4,
+                                 help='Largest difference of a belief probability allowed (default 1e-4)')
+    accuracy_parser.add_argument('--value_tolerance', type=float, default=1e-4,
+                                 help='Largest relative float64 value lost by a float32 decision (default 1e-4)')
+    accuracy_parser.set_defaults(func=accuracy)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args) or 0)
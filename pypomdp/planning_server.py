@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from pomdp_runner import PomdpRunner
+from vector_evaluator import VectorEvaluator, episode_ended
+from util import RunnerParams, set_seed, draw_arg
+from logger import Logger as log
+
+
+# largest deviation from 1 of the sum of a belief given to reset
+BELIEF_TOLERANCE = 1e-6
+
+
+class Session(object):
+    """
+    One agent planning with the shared policy: reset() starts an episode and returns its first action, act(obs)
+    feeds the observation the last action led to and returns the next action
+    """
+    def __init__(self, service):
+        self.service = service
+        self.belief = None
+        self.action = None
+
+    async def reset(self, belief=None):
+        """
+        :param belief: prior belief of the episode, defaults to the environment's
+        """
+        self.belief = self.service.check_belief(belief) if belief is not None else \
+            np.array(self.service.prior, dtype=self.service.compiled.dtype)
+        self.action = None
+        return await self.service.submit(self, None)
+
+    async def act(self, obs):
+        if self.action is None:
+            raise RuntimeError('The session must be reset before acting')
+        if obs not in self.service.compiled.obs_index:
+            raise ValueError('Unknown observation: {}'.format(obs))
+        return await self.service.submit(self, obs)
+
+    def close(self):
+        self.service.sessions.discard(self)
+
+
+class PlanningService(object):
+    """
+    Plans for many concurrent sessions with one offline policy (PBVI, QMDP) over one compiled model.
+    The requests queued while a batch is served make up the next batch, whose belief updates and action queries
+    each take a single vectorized call, so throughput grows with the number of sessions of one process
+    """
+    def __init__(self, model, solver, prior, max_batch=4096):
+        self.model = model
+        self.compiled = model.compiled
+        self.gamma, self.alpha_actions = solver.policy_matrix()
+        self.updater = VectorEvaluator(model, solver)
+        self.prior = prior
+        self.max_batch = max_batch
+        self.sessions = set()
+        self.requests = None
+        self.server = None
+        self.batches, self.served = 0, 0
+
+    @staticmethod
+    def from_runner(params, algo, T, **kwargs):
+        """
+        Solves the policy of the given algorithm configuration, see PomdpRunner.setup
+        """
+        if algo not in ('pbvi', 'qmdp'):
+            raise ValueError('The planning service needs an offline policy (pbvi, qmdp), got {}'.format(algo))
+        runner = PomdpRunner(params)
+        runner.setup(algo, T, **kwargs)
+        return PlanningService(runner.model, runner.pomdp, runner.prior)
+
+    def start(self):
+        """
+        Starts serving the requests, within the running event loop
+        """
+        self.requests = asyncio.Queue()
+        self.server = asyncio.ensure_future(self.__serve())
+
+    async def stop(self):
+        self.server.cancel()
+        try:
+            await self.server
+        except asyncio.CancelledError:
+            pass
+
+    def check_belief(self, belief):
+        """
+        :return: the belief as an array of the model's dtype
+        :raise ValueError: unless it is a distribution over the states of the model
+        """
+        try:
+            b = np.array(belief, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError('A belief is a list of {} probabilities'.format(len(self.compiled.states)))
+        if b.shape != (len(self.compiled.states),):
+            raise ValueError('A belief is a list of {} probabilities, got shape {}'.format(
+                len(self.compiled.states), b.shape))
+        if not np.all(np.isfinite(b)) or np.any(b < 0) or abs(b.sum() - 1.0) > BELIEF_TOLERANCE:
+            raise ValueError('A belief is a probability distribution, got {}'.format(belief))
+        return b.astype(self.compiled.dtype)
+
+    def session(self):
+        session = Session(self)
+        self.sessions.add(session)
+        return session
+
+    async def submit(self, session, obs):
+        future = asyncio.get_running_loop().create_future()
+        self.requests.put_nowait((session, obs, future))
+        return await future
+
+    async def __serve(self):
+        while True:
+            batch = [await self.requests.get()]
+            while len(batch) < self.max_batch and not self.requests.empty():
+                batch.append(self.requests.get_nowait())
+            try:
+                self.plan(batch)
+            except Exception:
+                # plan() leaves the sessions untouched when it fails, the requests are then served one by one so
+                # that only the offending ones fail
+                for request in batch:
+                    try:
+                        self.plan([request])
+                    except Exception as e:
+                        if not request[2].done():
+                            request[2].set_exception(e)
+
+    def plan(self, batch):
+        """
+        Updates the beliefs of the sessions which observed something, then picks the action of every session
+        :param batch: (session, observation or None, future) requests, futures get the session's next action
+        """
+        c = self.compiled
+        beliefs = np.array([session.belief for session, _, _ in batch])
+
+        rows = [i for i, (_, obs, _) in enumerate(batch) if obs is not None]
+        if rows:
+            actions = np.array([c.action_index[batch[i][0].action] for i in rows])
+            observations = np.array([c.obs_index[batch[i][1]] for i in rows])
+            beliefs[rows] = self.updater.update_beliefs(beliefs[rows], actions, observations)
+
+        best = self.alpha_actions[np.argmax(np.dot(beliefs, self.gamma), axis=1)]
+        for (session, _, future), belief, ai in zip(batch, beliefs, best):
+            session.belief = belief
+            session.action = c.actions[ai]
+            if not future.done():
+                future.set_result(session.action)
+
+        self.batches += 1
+        self.served += len(batch)
+
+    async def serve_unix(self, path):
+        """
+        Serves one session per connection over a Unix socket, with one JSON request per line:
+            {"op": "reset"} | {"op": "reset", "belief": [...]} | {"op": "act", "obs": "..."} | {"op": "close"}
+        answered by {"action": "..."}, {"closed": true} or {"error": "..."}
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        return await asyncio.start_unix_server(self.__connection, path=path)
+
+    async def __connection(self, reader, writer):
+        session = self.session()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('Requests are JSON objects, got: {}'.format(line.decode().strip()))
+                    if request['op'] == 'close':
+                        writer.write(b'{"closed": true}\n')
+                        break
+                    elif request['op'] == 'reset':
+                        reply = {'action': await session.reset(request.get('belief'))}
+                    elif request['op'] == 'act':
+                        reply = {'action': await session.act(request['obs'])}
+                    else:
+                        reply = {'error': 'Unknown op: {}'.format(request['op'])}
+                except (ValueError, KeyError, TypeError, RuntimeError) as e:
+                    reply = {'error': str(e)}
+                writer.write((json.dumps(reply) + '\n').encode())
+                await writer.drain()
+        finally:
+            session.close()
+            writer.close()
+
+
+class SocketSession(object):
+    """
+    Client side of a session served over a Unix socket, with the interface of Session
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    async def connect(path):
+        return SocketSession(*await asyncio.open_unix_connection(path))
+
+    async def request(self, **request):
+        self.writer.write((json.dumps(request) + '\n').encode())
+        await self.writer.drain()
+        reply = json.loads(await self.reader.readline())
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply
+
+    async def reset(self, belief=None):
+        request = {'op': 'reset'} if belief is None else {'op': 'reset', 'belief': list(belief)}
+        return (await self.request(**request))['action']
+
+    async def act(self, obs):
+        return (await self.request(op='act', obs=obs))['action']
+
+    async def close(self):
+        await self.request(op='close')
+        self.writer.close()
+
+
+async def play(session, model, prior, steps):
+    """
+    Plays 'steps' decisions of a session against the model, restarting episodes as they end
+    :param prior: distribution of the start states, the belief the sessions start from
+    :return: the total reward collected
+    """
+    state, total = None, 0.0
+    for _ in range(steps):
+        if state is None:
+            state = model.states[draw_arg(prior)]
+            action = await session.reset()
+        state, obs, reward, _ = model.simulate_action(state, action)
+        total += reward
+        if episode_ended(action, state):
+            state = None
+        else:
+            action = await session.act(obs)
+    return total
+
+
+async def bench(service, sessions, steps, socket=None):
+    """
+    Plays concurrent sessions, in process or through the Unix socket, and reports the throughput
+    """
+    service.start()
+    server = await service.serve_unix(socket) if socket else None
+    clients = [await SocketSession.connect(socket) if socket else service.session() for _ in range(sessions)]
+
+    begin = time.time()
+    rewards = await asyncio.gather(*[play(client, service.model, service.prior, steps) for client in clients])
+    elapsed = time.time() - begin
+
+    for client in clients:
+        if socket:
+            await client.close()
+        else:
+            client.close()
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    await service.stop()
+
+    log.info('\n'.join([
+        '{} sessions x {} decisions in {:.3f}s: {:.0f} decisions/s'.format(sessions, steps, elapsed,
+                                                                        sessions * steps / elapsed),
+        '{} batches of {:.1f} requests on average'.format(service.batches, service.served / max(service.batches, 1)),
+        'Average reward per session: {}'.format(sum(rewards) / sessions),
+    ]))
+
+
+async def serve(service, socket):
+    service.start()
+    server = await service.serve_unix(socket)
+    log.info('Planning on {}', socket)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Planning service batching the sessions of an offline policy')
+    parser.add_argument('config', type=str, help='The algorithm configuration (pbvi or qmdp, without JSON extension)')
+    parser.add_argument('--env', type=str, default='Tiger-2D.POMDP', help='The name of environment\'s config file')
+    parser.add_argument('--socket', type=str, default=os.path.join('dev', 'planner.sock'),
+                        help='Path of the Unix socket the sessions connect to')
+    parser.add_argument('--max_batch', type=int, default=4096, help='Maximum number of requests served at once')
+    parser.add_argument('--bench', type=int, default=None, metavar='SESSIONS',
+                        help='Play this many concurrent sessions against the model and report the throughput')
+    parser.add_argument('--steps', type=int, default=100, help='Decisions per session of --bench')
+    parser.add_argument('--in_process', action='store_true', help='--bench sessions skip the socket')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the random number generators')
+    parser.add_argument('--dtype', type=str, default='auto', choices=['auto', 'float32', 'float64'],
+                        help='Floating point type of the tables, beliefs and policy (auto: float32 for large models)')
+    args = parser.parse_args()
+
+    set_seed(args.seed)
+    with open(os.path.join('configs', args.config + '.json')) as algo_config:
+        algo_params = json.load(algo_config)
+    params = RunnerParams(args.env, None, args.config, float('inf'), 0, False, False, 0, dtype=args.dtype)
+    service = PlanningService.from_runner(params, **algo_params)
+    service.max_batch = args.max_batch
+
+    socket_dir = os.path.dirname(args.socket)
+    if socket_dir and not os.path.exists(socket_dir):
+        os.makedirs(socket_dir)
+    if args.bench:
+        asyncio.run(bench(service, args.bench, args.steps, None if args.in_process else args.socket))
+    else:
+        asyncio.run(serve(service, args.socket))
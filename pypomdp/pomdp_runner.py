@@ -1,21 +1,34 @@
 import os
+import time
 
-from models import RockSampleModel, Model
-from solvers import POMCP, PBVI
-from parsers import PomdpParser, GraphViz
+from models import RockSampleModel, TagModel, Model, SharedModel, load_sparse
+from solvers import POMCP, PBVI, DESPOT, QMDP, Ponderer
+from parsers import PomdpParser, GeneratedEnv, TreeSnapshot, parse_model_name
 from logger import Logger as log
+from util import gen_distribution, set_seed, split_seed
+from vector_evaluator import VectorEvaluator, episode_ended
+from metrics import MetricsSink
+from checkpoint import Checkpoint
+import numpy as np
+
+# step report, its arguments are only formatted if the info level is enabled
+STEP_LOG = 'Taking action: {}\nObservation: {}\nReward: {}\n'
+RULE = '=' * 20
 
-class PomdpRunner:
 
-    #Creating variables to compute total steps and reward
-    steps = 0
-    fReward = 0
-    # Creating variables to compute stdev of steps and reward
-    step_list = []
-    fReward_list = []
+class PomdpRunner:
 
     def __init__(self, params):
         self.params = params
+        # model, solver and prior belief shared by the benchmark episodes
+        self.model, self.pomdp, self.prior = None, None, None
+        self.metrics = MetricsSink(params.metrics) if params.metrics else None
+        self.snapshots = None
+        if params.snapshot:
+            self.snapshots = TreeSnapshot(params.snapshot_dir, params.snapshot_depth, params.snapshot_top_k)
+        self.episodes = 0
+        # seed of the environment stream of the next episode, see seed_episode
+        self.env_seed = None
         if params.logfile is not None:
             log.new(params.logfile)
 
@@ -27,9 +40,34 @@ class PomdpRunner:
         """
         MODELS = {
             'RockSample': RockSampleModel,
+            'Tag': TagModel,
         }
+        env_configs['dtype'] = self.params.dtype
         return MODELS.get(env_configs['model_name'], Model)(env_configs)
 
+    def open_env(self):
+        """
+        Environments whose model class can generate them (e.g. Tag) are built procedurally instead of parsed, sparse
+        model files (.npz, e.g. written by GridWorldMaker) are loaded and a model published by another process is
+        attached to
+        :return: context exposing the environment, see PomdpParser
+        """
+        if self.params.shared_model is not None:
+            return GeneratedEnv(SharedModel.attach(self.params.shared_model))
+        GENERATORS = {
+            'Tag': TagModel.generate_env,
+        }
+        name, spec = parse_model_name(self.params.env_config)
+        if name in GENERATORS:
+            return GeneratedEnv(GENERATORS[name](spec))
+        if self.params.env_config.endswith('.npz'):
+            return GeneratedEnv(load_sparse(self.params.env_config))
+        return PomdpParser(self.params.env_config)
+
+    def load_model(self):
+        with self.open_env() as ctx:
+            return self.create_model(ctx.copy_env())
+
     def create_solver(self, algo, model):
         """
         Builder method for creating solver instance
@@ -40,35 +78,175 @@ class PomdpRunner:
         SOLVERS = {
             'pbvi': PBVI,
             'pomcp': POMCP,
+            'despot': DESPOT,
+            'qmdp': QMDP,
         }
         return SOLVERS.get(algo)(model)
 
-    def snapshot_tree(self, visualiser, tree, filename):
-        visualiser.update(tree.root)
-        visualiser.render('./dev/snapshots/{}'.format(filename))  # TODO: parametrise the dev folder path
+    def create_ponderer(self, pomdp, T):
+        """
+        Background planner of the numba POMCP engine, if requested
+        """
+        if not self.params.ponder or not isinstance(pomdp, POMCP):
+            return None
+        if pomdp.kernel is None:
+            log.warning('--ponder needs the numba POMCP engine ("engine": "numba"), planning without pondering')
+            return None
+        return Ponderer(pomdp, T)
+
+    def setup(self, algo, T, **kwargs):
+        """
+        Parses the environment and builds the model and solver once for all the benchmark episodes.
+        Offline policies (PBVI, QMDP) do not depend on the episode, so they are solved here
+        """
+        params, configs = self.params, dict(kwargs)
+        with self.open_env() as ctx:
+            self.model = self.create_model(ctx.copy_env())
+            self.pomdp = self.create_solver(algo, self.model)
+            self.prior = ctx.generate_beliefs()
+
+            if algo == 'pbvi':
+                belief_points = ctx.generate_belief_points(kwargs.pop('stepsize'))
+                self.pomdp.add_configs(belief_points, **kwargs)
+            elif algo in ('pomcp', 'despot'):
+                self.pomdp.add_configs(params.budget, self.prior, **kwargs)
+            elif algo == 'qmdp':
+                self.pomdp.add_configs(**kwargs)
+
+        if algo in ('pbvi', 'qmdp'):
+            save = self.checkpoint_solver(self.pomdp, self.solver_fingerprint(algo, T, self.model, configs))
+            iterations = getattr(self.pomdp, 'iterations', None)
+            self.pomdp.solve(T)
+            # a solve resumed complete (e.g. by the workers of a benchmark solved in the main process) is not
+            # written back
+            if save is not None and getattr(self.pomdp, 'iterations', None) != iterations:
+                save(force=True)
+
+    def solver_fingerprint(self, algo, T, model, configs):
+        """
+        :return: what an offline solve depends on, a checkpointed solve only resumes a run sharing it
+        """
+        return {
+            'env': self.params.env,
+            'config': self.params.config,
+            'algo': algo,
+            'T': T,
+            'configs': configs,
+            'dtype': str(model.dtype),
+            'num_states': model.num_states,
+        }
+
+    def checkpoint_solver(self, pomdp, fingerprint):
+        """
+        Saves the progress of an offline solve every checkpoint_interval seconds, and restores the last saved one
+        with --resume
+        :param fingerprint: see solver_fingerprint, saved with the solver's state
+        :return: the function saving the solver's state, None if checkpoints are off
+        """
+        params = self.params
+        if params.checkpoint is None:
+            return None
+
+        checkpoint = Checkpoint.in_folder(params.checkpoint, 'solver', params.checkpoint_interval)
+        saved = checkpoint.load() if params.resume else None
+        if saved is not None:
+            if saved.get('fingerprint') != fingerprint:
+                raise ValueError('The solver checkpoint in {} was saved by another solve: {}, this one is {}'.format(
+                    params.checkpoint, saved.get('fingerprint'), fingerprint))
+            pomdp.set_state(saved['state'])
+            log.info('Resuming the solve after {} iteration(s)', saved['state'].get('iterations'))
+
+        def save(force=False):
+            state = pomdp.get_state()
+            if state is not None:
+                checkpoint.save({'fingerprint': fingerprint, 'state': state}, force=force)
+        pomdp.on_iteration = lambda solver: save()
+        return save
+
+    def seed_episode(self, seed):
+        """
+        Splits an episode seed into the environment stream (initial state, transition and observation noise) and
+        the solver stream (the global generators). Episodes sharing a seed replay the same environment noise
+        whatever the solver or its configuration consume, which correlates their results
+        """
+        self.env_seed, solver_seed = split_seed(seed)
+        set_seed(solver_seed)
+
+    def reset_episode(self):
+        """
+        Puts the shared model and solver back to the start of an episode
+        :return: the prior belief of the episode
+        """
+        belief = gen_distribution(self.model.num_states) if self.params.random_prior else list(self.prior)
+        self.model.reset(self.env_seed)
+        self.pomdp.reset(self.params.budget, belief)
+        return belief
+
+    def runVectorized(self, algo, T, **kwargs):
+        """
+        Plays all the benchmark episodes of an offline policy (PBVI, QMDP) in lockstep
+        :return: reward and step statistics, see VectorEvaluator.evaluate
+        """
+        params = self.params
+        if algo not in ('pbvi', 'qmdp'):
+            raise ValueError('Vectorized evaluation needs an offline policy (pbvi, qmdp), got {}'.format(algo))
+        if self.pomdp is None:
+            self.setup(algo, T, **kwargs)
+
+        n, num_states = params.benchmark, self.model.num_states
+        if params.random_prior:
+            priors = np.array([gen_distribution(num_states) for _ in range(n)])
+        else:
+            priors = np.tile(self.prior, (n, 1))
+
+        log.info('~~~ Evaluating {} episodes in lockstep ~~~', n)
+        rng = np.random.RandomState(self.env_seed) if self.env_seed is not None else np.random
+        return VectorEvaluator(self.model, self.pomdp, rng).evaluate(priors, params.max_play)
+
+    def end_episode(self, steps, total_rewards, total_cost, wall_time):
+        if self.metrics is not None:
+            self.metrics.episode(self.episodes, steps, total_rewards, total_cost, wall_time)
+        if self.snapshots is not None:
+            self.snapshots.flush()
+        self.episodes += 1
+
+    def close(self):
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.snapshots is not None:
+            self.snapshots.close()
+
+    def snapshot_tree(self, pomdp, step):
+        if isinstance(pomdp, POMCP) and pomdp.kernel is not None:
+            # the BeliefTree of the numba engine mirrors the top of the kernel's tree only
+            pomdp.sync_tree(depth=self.snapshots.depth)
+        self.snapshots.snapshot(pomdp.tree, self.episodes, step)
 
 
     def run(self, algo, T, **kwargs):
-        visualiser = GraphViz(description='tmp')
-        params, pomdp = self.params, None
-        total_rewards, budget = 0, params.budget
+        params, pomdp, configs = self.params, None, dict(kwargs)
+        total_rewards, total_costs, budget = 0, 0, params.budget
         environment = params.env_config
         benchmark = params.benchmark
 
         log.info('~~~ initialising ~~~')
-        with PomdpParser(params.env_config) as ctx:
+        with self.open_env() as ctx:
             # creates model and solver
             model = self.create_model(ctx.copy_env())
+            model.reset(self.env_seed)
             pomdp = self.create_solver(algo, model)
 
             # supply additional algo params
             belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
 
             if algo == 'pbvi':
-                belief_points = ctx.generate_belief_points(kwargs['stepsize'])
-                pomdp.add_configs(belief_points)
-            elif algo == 'pomcp':
+                belief_points = ctx.generate_belief_points(kwargs.pop('stepsize'))
+                pomdp.add_configs(belief_points, **kwargs)
+            elif algo in ('pomcp', 'despot'):
                 pomdp.add_configs(budget, belief, **kwargs)
+            elif algo == 'qmdp':
+                pomdp.add_configs(**kwargs)
+            self.checkpoint_solver(pomdp, self.solver_fingerprint(algo, T, model, configs))
 
         # have fun!
         log.info('''
@@ -78,22 +256,40 @@ class PomdpRunner:
             Init Belief: {}
             Time Horizon: {}
             Max Play: {}
-        ++++++++++++++++++++++'''.format(model.curr_state, budget, belief, T, params.max_play))
+        ++++++++++++++++++++++''', model.curr_state, budget, belief, T, params.max_play)
 
+        episode_begin = time.time()
+        ponderer = self.create_ponderer(pomdp, T)
         for i in range(params.max_play):
             # plan, take action and receive environment feedbacks
+            if ponderer is not None:
+                ponderer.pause()
+                log.info('# Pondered = {} in {:.6f}s', *ponderer.collect())
+            plan_begin = time.time()
             pomdp.solve(T)
             action = pomdp.get_action(belief)
+            plan_time = time.time() - plan_begin
+            if ponderer is not None:
+                # keep growing the subtree of the chosen action while the environment executes it
+                ponderer.resume(action)
             new_state, obs, reward, cost = pomdp.take_action(action)
+            if ponderer is not None:
+                ponderer.pause()
 
-            if params.snapshot and isinstance(pomdp, POMCP):
+            if self.snapshots is not None and isinstance(pomdp, (POMCP, DESPOT)):
                 # takes snapshot of belief tree before it gets updated
-                self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+                self.snapshot_tree(pomdp, i + 1)
             
             # update states
             belief = pomdp.update_belief(belief, action, obs)
+            if ponderer is not None:
+                # plan ahead from the new root while the step gets reported
+                ponderer.resume()
             total_rewards += reward
+            total_costs += cost
             budget -= cost
+            if self.metrics is not None:
+                self.metrics.step(self.episodes, i + 1, action, obs, reward, cost, plan_time, pomdp)
 
             # Printing the details for every step of the interactive simulation
             # log.info('\n'.join([
@@ -110,108 +306,62 @@ class PomdpRunner:
             # When the open action is selected, the tiger problem will end, either the person scapes or is eaten by the tiger, so it has to stop.
             if "Tiger-2D.POMDP" in environment:
                     if "open" in action:
-                        log.info('\n'.join([
-                            'Taking action: {}'.format(action),
-                            'Observation: {}'.format(obs),
-                            'Reward: {}'.format(reward),
-                            '=' * 20
-                        ]))
+                        log.info(STEP_LOG + RULE, action, obs, reward)
                         break;
-                    log.info('\n'.join([
-                        'Taking action: {}'.format(action),
-                        'Observation: {}'.format(obs),
-                        'Reward: {}'.format(reward),
-                        'New Belief: {}'.format(belief),
-                        '=' * 20
-                    ]))
+                    log.info(STEP_LOG + 'New Belief: {}\n' + RULE, action, obs, reward, belief)
             # Web ads problem ----------------------------------------------------------------
             # When the adv action is selected, the web ad problem will end, either the person gets a tie or a skate advertisement so it has to stop.
             if "Web.POMDP" in environment:
                 if params.benchmark == 0:
                      if "adv" in action:
-                        log.info('\n'.join([
-                            'Taking action: {}'.format(action),
-                            'Observation: {}'.format(obs),
-                            'Reward: {}'.format(reward),
-                             '=' * 20
-                        ]))
+                        log.info(STEP_LOG + RULE, action, obs, reward)
                         break;
-                     log.info('\n'.join([
-                        'Taking action: {}'.format(action),
-                        'Observation: {}'.format(obs),
-                        'Reward: {}'.format(reward),
-                        'New Belief: {}'.format(belief),
-                        '=' * 20
-                    ]))
+                     log.info(STEP_LOG + 'New Belief: {}\n' + RULE, action, obs, reward, belief)
 
             # Landing problem ----------------------------------------------------------------
             # When the arrive action is selected, the landing problem will end, either the tripulation finds a treasure or they die horribly to the creatures in the landing.
             if "Landing.POMDP" in environment:
                 if "arrive" in action:
-                    log.info('\n'.join([
-                        'Taking action: {}'.format(action),
-                        'Observation: {}'.format(obs),
-                        'Reward: {}'.format(reward),
-                        '=' * 20
-                    ]))
+                    log.info(STEP_LOG + RULE, action, obs, reward)
                     break;
-                log.info('\n'.join([
-                    'Taking action: {}'.format(action),
-                    'Observation: {}'.format(obs),
-                    'Reward: {}'.format(reward),
-                    'New Belief: {}'.format(belief),
-                    '=' * 20
-                ]))
+                log.info(STEP_LOG + 'New Belief: {}\n' + RULE, action, obs, reward, belief)
 
             #Tag problem ----------------------------------------------------------------
             # When the status is tagger, the robot s will catch robot t, the tag problem will end so it has to stop.
             if "Tag.POMDP" in environment:
                 if params.benchmark == 0:
                     if "tagged" in model.curr_state:
-                        log.info('\n'.join([
-                            'Taking action: {}'.format(action),
-                            'Observation: {}'.format(obs),
-                            'Reward: {}'.format(reward),
-                            '=' * 20
-                        ]))
+                        log.info(STEP_LOG + RULE, action, obs, reward)
                         break;
-                    log.info('\n'.join([
-                        'Taking action: {}'.format(action),
-                        'Observation: {}'.format(obs),
-                        'Reward: {}'.format(reward),
-                        'New state: {}'.format(new_state),
-                        #'New Belief: {}'.format(belief),
-                        '=' * 20
-                    ]))
+                    log.info(STEP_LOG + 'New state: {}\n' + RULE, action, obs, reward, new_state)
+
+        if ponderer is not None:
+            ponderer.close()
+        self.end_episode(i + 1, total_rewards, total_costs, time.time() - episode_begin)
 
         # Printing the total steps and reward when the loop ends.
         if params.benchmark == 0:
-            log.info('Simulation ended after {} steps. Total reward = {}'.format(i + 1, total_rewards))
+            log.info('Simulation ended after {} steps. Total reward = {}', i + 1, total_rewards)
 
         return pomdp
 
     def runBench(self, algo, T, **kwargs):
-        visualiser = GraphViz(description='tmp')
+        """
+        Plays a single benchmark episode
+        :return: number of steps played and total reward collected
+        """
         params, pomdp = self.params, None
-        total_rewards, budget = 0, params.budget
+        total_rewards, total_costs, budget = 0, 0, params.budget
         environment = params.env_config
         benchmark = params.benchmark
 
 
         log.info('~~~ Initialising simulation ~~~')
-        with PomdpParser(params.env_config) as ctx:
-            # creates model and solver
-            model = self.create_model(ctx.copy_env())
-            pomdp = self.create_solver(algo, model)
-
-            # supply additional algo params
-            belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
-
-            if algo == 'pbvi':
-                belief_points = ctx.generate_belief_points(kwargs['stepsize'])
-                pomdp.add_configs(belief_points)
-            elif algo == 'pomcp':
-                pomdp.add_configs(budget, belief, **kwargs)
+        if self.pomdp is None:
+            # parse, create the model and solver and solve offline policies for the first episode only
+            self.setup(algo, T, **kwargs)
+        model, pomdp = self.model, self.pomdp
+        belief = self.reset_episode()
 
         # have fun!
         log.info('''
@@ -221,31 +371,44 @@ class PomdpRunner:
                Init Belief: {}
                Time Horizon: {}
                Max Play: {}
-           ++++++++++++++++++++++'''.format(model.curr_state, budget, belief, T, params.max_play))
+           ++++++++++++++++++++++''', model.curr_state, budget, belief, T, params.max_play)
 
+        episode_begin = time.time()
+        ponderer = self.create_ponderer(pomdp, T)
         for i in range(params.max_play):
             # plan, take action and receive environment feedbacks
+            if ponderer is not None:
+                ponderer.pause()
+                log.info('# Pondered = {} in {:.6f}s', *ponderer.collect())
+            plan_begin = time.time()
             pomdp.solve(T)
             action = pomdp.get_action(belief)
+            plan_time = time.time() - plan_begin
+            if ponderer is not None:
+                # keep growing the subtree of the chosen action while the environment executes it
+                ponderer.resume(action)
             new_state, obs, reward, cost = pomdp.take_action(action)
+            if ponderer is not None:
+                ponderer.pause()
 
-            if params.snapshot and isinstance(pomdp, POMCP):
+            if self.snapshots is not None and isinstance(pomdp, (POMCP, DESPOT)):
                 # takes snapshot of belief tree before it gets updated
-                self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+                self.snapshot_tree(pomdp, i + 1)
 
             # update states
             belief = pomdp.update_belief(belief, action, obs)
+            if ponderer is not None:
+                # plan ahead from the new root while the step gets reported
+                ponderer.resume()
             total_rewards += reward
+            total_costs += cost
             budget -= cost
+            if self.metrics is not None:
+                self.metrics.step(self.episodes, i + 1, action, obs, reward, cost, plan_time, pomdp)
 
             #Computing final results when a problem stops
-            if "open" in action or "tagged" in model.curr_state or "adv" in action or "arrive" in action:
-                log.info('Ended simulation after {} steps. Total reward = {}'.format(i + 1, total_rewards))
-                self.step_list.append(i+1)
-                self.fReward_list.append(total_rewards)
-                self.steps += i+1
-                self.fReward += total_rewards
-
+            if episode_ended(action, model.curr_state):
+                log.info('Ended simulation after {} steps. Total reward = {}', i + 1, total_rewards)
                 break;
 
             # Printing the details for every step of the interactive simulation
@@ -262,4 +425,9 @@ class PomdpRunner:
             if budget <= 0:
                 log.info('Budget spent.')
 
-        return pomdp
\ No newline at end of file
+        if ponderer is not None:
+            ponderer.close()
+        self.end_episode(i + 1, total_rewards, total_costs, time.time() - episode_begin)
+
+        # Steps played and total reward of the episode
+        return i + 1, total_rewards
\ No newline at end of file
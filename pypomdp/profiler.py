@@ -0,0 +1,125 @@
+import os
+import time
+import cProfile
+from functools import wraps
+
+
+class Profiler:
+    """
+    Cumulative call counters and timers per solver phase.
+    Phases are measured by wrapping the methods implementing them, which only happens once enable() is called,
+    so the hot paths are untouched (and cost nothing) when profiling is off. Recursive calls (e.g. rollout) are
+    counted, but only the outermost call is timed.
+    """
+    stats = {}  # phase name => [calls, seconds]
+    __depths__ = {}  # phase name => nesting depth of its calls
+    __profile__ = None
+
+    @staticmethod
+    def hot_paths():
+        """
+        :return: (owner, method name, phase name) of the instrumented phases
+        """
+        from models import Model
+        from solvers import POMCP, PBVI, DESPOT, QMDP
+        from util.belief_tree import BeliefTree
+
+        return [
+            (POMCP, 'solve', 'pomcp.solve'),
+            (POMCP, 'select', 'pomcp.selection'),
+            (Model, 'simulate_action', 'model.simulate_action'),
+            (BeliefTree, 'find_or_create', 'tree.find_or_create'),
+            (POMCP, 'rollout', 'pomcp.rollout'),
+            (POMCP, 'update_belief', 'pomcp.update_belief'),
+            (PBVI, 'solve', 'pbvi.solve'),
+            (PBVI, 'compute_gamma_action_obs', 'pbvi.gamma_action_obs'),
+            (PBVI, 'cross_sum', 'pbvi.cross_sum'),
+            (PBVI, 'best_alpha_vectors', 'pbvi.best_alpha_vectors'),
+            (PBVI, 'get_action', 'pbvi.get_action'),
+            (PBVI, 'update_belief', 'pbvi.update_belief'),
+            (DESPOT, 'solve', 'despot.solve'),
+            (DESPOT, 'expand', 'despot.expand'),
+            (DESPOT, 'default_policy', 'despot.default_policy'),
+            (DESPOT, 'update_belief', 'despot.update_belief'),
+            (Model, 'simulate_scenario', 'model.simulate_scenario'),
+            (QMDP, 'solve', 'qmdp.solve'),
+            (QMDP, 'update_belief', 'qmdp.update_belief'),
+        ]
+
+    @staticmethod
+    def overriding(owner, attr):
+        """
+        :return: owner and its subclasses defining their own 'attr', e.g. TagModel.simulate_action
+        """
+        classes = [owner]
+        for subclass in owner.__subclasses__():
+            classes += [c for c in Profiler.overriding(subclass, attr) if attr in c.__dict__]
+        return classes
+
+    @staticmethod
+    def instrument(owner, attr, name):
+        fn = getattr(owner, attr)
+        stat = Profiler.stats.setdefault(name, [0, 0.0])
+        # shared by the overrides of a phase, an override calling its base is timed once
+        depth = Profiler.__depths__.setdefault(name, [0])
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            stat[0] += 1
+            if depth[0]:
+                return fn(*args, **kwargs)
+
+            depth[0] += 1
+            begin = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stat[1] += time.perf_counter() - begin
+                depth[0] -= 1
+
+        setattr(owner, attr, wrapper)
+
+    @staticmethod
+    def enable(with_cprofile=True):
+        """
+        Instruments the solver hot paths and optionally starts cProfile
+        """
+        if Profiler.stats:
+            return
+        for owner, attr, name in Profiler.hot_paths():
+            for cls in Profiler.overriding(owner, attr):
+                Profiler.instrument(cls, attr, name)
+
+        if with_cprofile:
+            Profiler.__profile__ = cProfile.Profile()
+            Profiler.__profile__.enable()
+
+    @staticmethod
+    def report():
+        """
+        :return: the phase breakdown as a printable table, phases never called are omitted
+        """
+        lines = ['{:<28}{:>12}{:>14}{:>14}'.format('phase', 'calls', 'total (s)', 'per call (us)')]
+        for name, (calls, seconds) in sorted(Profiler.stats.items(), key=lambda item: -item[1][1]):
+            if calls:
+                lines.append('{:<28}{:>12}{:>14.4f}{:>14.2f}'.format(name, calls, seconds, 1e6 * seconds / calls))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def dump(directory, prefix):
+        """
+        Writes the phase breakdown and the cProfile statistics of the run into 'directory'
+        :return: path of the pstats file, None if cProfile was not running
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        base = os.path.join(directory, '{}-{}'.format(prefix, time.strftime('%Y%m%d-%H%M%S')))
+        with open(base + '.txt', 'w') as breakdown:
+            breakdown.write(Profiler.report() + '\n')
+
+        if Profiler.__profile__ is None:
+            return None
+        Profiler.__profile__.disable()
+        Profiler.__profile__.dump_stats(base + '.pstats')
+        return base + '.pstats'
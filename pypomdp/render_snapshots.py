@@ -0,0 +1,39 @@
+import os
+import argparse
+
+from parsers import GraphViz, TreeSnapshot
+from logger import Logger as log
+
+
+def render(args):
+    """
+    Renders the selected snapshots of a TreeSnapshot dump, one graph per episode step
+    """
+    visualiser = GraphViz(description='tmp')
+    count = 0
+    for record in TreeSnapshot.load(args.path):
+        if args.episode is not None and record['episode'] != args.episode:
+            continue
+        if args.steps and record['step'] not in args.steps:
+            continue
+
+        visualiser.update_from_snapshot(record['nodes'])
+        fname = '{}-{}.gv'.format(record['episode'], record['step'])
+        if args.source_only:
+            visualiser.save(fname, args.out)
+        else:
+            visualiser.render(fname, args.out)
+        count += 1
+    log.info('{} snapshot(s) rendered into {}', count, args.out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the belief tree snapshots dumped with --snapshot')
+    parser.add_argument('path', type=str, help='Snapshot dump (tree-<pid>.jsonl)')
+    parser.add_argument('--out', type=str, default=os.path.join('dev', 'snapshots'), help='Output folder')
+    parser.add_argument('--episode', type=int, default=None, help='Only render this episode')
+    parser.add_argument('--steps', type=int, nargs='*', default=None, help='Only render these steps')
+    parser.add_argument('--source_only', action='store_true',
+                        help='Write the DOT sources without calling the graphviz binaries')
+
+    render(parser.parse_args())
@@ -1,3 +1,6 @@
 from .solver import Solver
 from .pbvi import PBVI
-from .pomcp import POMCP
\ No newline at end of file
+from .pomcp import POMCP
+from .despot import DESPOT
+from .qmdp import QMDP
+from .ponderer import Ponderer
\ No newline at end of file
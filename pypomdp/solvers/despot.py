@@ -0,0 +1,231 @@
+from solvers import Solver
+from util.helper import rand_choice, elem_distribution, round
+from util.scenario_tree import ScenarioTree
+from logger import Logger as log
+import numpy as np
+import time
+
+
+class DESPOT(Solver):
+    """
+    Determinized Sparse Partially Observable Tree (Ye, Somani, Hsu & Lee, 2017).
+    The search is restricted to K sampled scenarios, each being a starting state plus a fixed stream of random
+    numbers, so every (belief, action) pair only branches on the observations those scenarios actually produce.
+    Trials are guided by upper bounds and stopped by the weighted excess uncertainty of the reached node.
+    """
+    def __init__(self, model):
+        Solver.__init__(self, model)
+        self.tree = None
+        self.particles = None
+        self.budget = None
+        self.streams = None
+        self.max_depth = None
+        self.simulations = 0  # trials performed by the last solve
+
+        self.simulation_time = None  # in seconds
+        self.max_particles = None    # size of the particle set representing the current belief
+        self.num_scenarios = None    # number of sampled scenarios (K)
+        self.xi = None               # target gap at a node, as a fraction of the gap at the root
+        self.regularization = None   # penalty for each expanded action node (lambda)
+        self.max_reward = None
+
+    def add_configs(self, budget=float('inf'), initial_belief=None, simulation_time=0.5,
+                    max_particles=350, num_scenarios=500, xi=0.95, regularization=0.0):
+        self.simulation_time = simulation_time
+        self.max_particles = max_particles
+        self.num_scenarios = num_scenarios
+        self.xi = xi
+        self.regularization = regularization
+
+        m = self.model
+        self.max_reward = max(m.reward_function(a, s) for a in m.actions for s in m.states)
+        self.reset(budget, initial_belief)
+
+    def reset(self, budget=float('inf'), initial_belief=None):
+        self.budget = budget
+        self.particles = self.model.gen_particles(n=self.max_particles, prob=initial_belief)
+        self.tree = None
+
+    def reset_tree(self, T):
+        """
+        Samples K scenarios from the current particle set and builds a fresh tree for them
+        :param T: planning horizon
+        """
+        self.max_depth = T
+        self.streams = np.random.random((self.num_scenarios, T + 1, 3))
+        scenarios = [rand_choice(self.particles) for _ in range(self.num_scenarios)]
+        self.tree = ScenarioTree(self.budget, scenarios)
+        self.init_bounds(self.tree.root)
+
+    def default_policy(self, state, sid, depth, budget):
+        """
+        Rolls scenario 'sid' out from 'state' until the max depth, picking actions with the scenario's own
+        random numbers so the resulting lower bound is deterministic
+        :return: discounted return measured from 'depth'
+        """
+        total, discount = 0.0, 1.0
+        while depth <= self.max_depth and budget > 0:
+            u_state, u_obs, u_action = self.streams[sid, depth]
+            actions = self.model.get_legal_actions(state)
+            ai = actions[int(u_action * len(actions))]
+            state, _, r, cost = self.model.simulate_scenario(state, ai, (u_state, u_obs))
+            total += discount * r
+            discount *= self.model.discount
+            budget -= cost
+            depth += 1
+        return total
+
+    def upper_value(self, depth):
+        """
+        Trivial upper bound: the maximum reward collected at every remaining step
+        """
+        steps, gamma = self.max_depth - depth + 1, self.model.discount
+        if steps <= 0:
+            return 0.0
+        if gamma == 1.0:
+            return self.max_reward * steps
+        return self.max_reward * (1 - gamma ** steps) / (1 - gamma)
+
+    def init_bounds(self, node):
+        """
+        Initialises the bounds of a freshly created belief node from its scenarios
+        """
+        weight = self.model.discount ** node.depth / self.num_scenarios
+        lower = sum(self.default_policy(s, sid, node.depth, node.budget) for sid, s in zip(node.scenario_ids, node.B))
+        upper = max(len(node.B) * self.upper_value(node.depth), lower)
+
+        node.default_lower = node.lower = weight * lower
+        node.upper = weight * upper
+
+    def expand(self, node):
+        """
+        Creates one action node per affordable action, each branching on the observations produced by the
+        scenarios of 'node'
+        """
+        m = self.model
+        weight = m.discount ** node.depth / self.num_scenarios
+
+        for ai in m.get_legal_actions(node.B[0]):
+            cost = m.cost_function(ai)
+            if node.budget - cost < 0:
+                continue
+
+            node_a = self.tree.add(node.h + [ai], name=ai, parent=node, action=ai, cost=cost)
+            rewards = 0.0
+            for sid, si in zip(node.scenario_ids, node.B):
+                u_state, u_obs, _ = self.streams[sid, node.depth]
+                sj, oj, r, _ = m.simulate_scenario(si, ai, (u_state, u_obs))
+                rewards += r
+
+                node_ao = node_a.get_child(oj)
+                if node_ao is None:
+                    node_ao = self.tree.add(node_a.h + [oj], name=oj, parent=node_a, observation=oj,
+                                            budget=node.budget - cost)
+                node_ao.add_scenario(sid, sj)
+
+            for node_ao in node_a.children:
+                self.init_bounds(node_ao)
+
+            node_a.rho = weight * rewards - self.regularization
+            self.backup_action(node_a)
+
+    def backup_action(self, node_a):
+        node_a.lower = node_a.rho + sum(child.lower for child in node_a.children)
+        node_a.upper = node_a.rho + sum(child.upper for child in node_a.children)
+
+    def backup(self, node):
+        """
+        Propagates the bounds of 'node' back to the root
+        """
+        while node is not None:
+            if node.children:
+                node.lower = max(node.default_lower, max(child.lower for child in node.children))
+                node.upper = max(child.upper for child in node.children)
+
+            node_a = node.parent
+            if node_a is None:
+                break
+            self.backup_action(node_a)
+            node = node_a.parent
+
+    def excess_uncertainty(self, node):
+        root = self.tree.root
+        share = len(node.B) / self.num_scenarios * self.model.discount ** node.depth
+        return (node.upper - node.lower) - self.xi * share * (root.upper - root.lower)
+
+    def trial(self):
+        """
+        Explores a single path from the root, following the most promising action and the observation branch
+        with the largest excess uncertainty, then backs up the bounds along that path
+        """
+        node = self.tree.root
+        while node.depth <= self.max_depth and self.excess_uncertainty(node) > 0:
+            if not node.children:
+                self.expand(node)
+                if not node.children:
+                    break
+            node_a = max(node.children, key=lambda child: child.upper)
+            if not node_a.children:
+                break
+            node = max(node_a.children, key=self.excess_uncertainty)
+        self.backup(node)
+
+    def solve(self, T):
+        """
+        Runs anytime trials for up to simulation_time seconds, or until the bounds at the root have met
+        """
+        begin = time.time()
+        if self.tree is None or self.max_depth != T:
+            self.reset_tree(T)
+
+        root, n = self.tree.root, 0
+        while True:
+            n += 1
+            self.trial()
+            if root.upper - root.lower <= 1e-6 or time.time() - begin >= self.simulation_time:
+                break
+        self.simulations = n
+        log.info('# Trials = {}, L = {}, U = {}', n, round(root.lower, 6), round(root.upper, 6))
+
+    def get_action(self, belief):
+        """
+        Choose the action with the highest lower bound
+        'belief' is just a part of the function signature but not actually required here
+        """
+        root = self.tree.root
+        action_vals = [(action.lower, action.action) for action in root.children]
+        return max(action_vals)[1]
+
+    def compute_belief(self):
+        base = [0.0] * self.model.num_states
+        particle_dist = elem_distribution(self.particles)
+        for state, prob in particle_dist.items():
+            base[self.model.states.index(state)] = round(prob, 6)
+        return base
+
+    def update_belief(self, belief, action, obs):
+        """
+        Keeps the scenarios consistent with the received observation as the new particle set, tops it up by
+        rejection sampling, and discards the tree so that the next solve samples fresh scenarios
+        """
+        m = self.model
+        node_a = self.tree.root.get_child(action) if self.tree is not None else None
+        node_ao = node_a.get_child(obs) if node_a is not None else None
+        particles = node_ao.B[:] if node_ao is not None else []
+
+        attempts = 0
+        while len(particles) < self.max_particles and attempts < 100 * self.max_particles:
+            attempts += 1
+            sj, oj, r, cost = m.simulate_action(rand_choice(self.particles), action)
+            if oj == obs:
+                particles.append(sj)
+
+        if not particles:
+            log.warning("Warning: observation {} was not reproduced by any particle", obs)
+            particles = m.gen_particles(n=self.max_particles)
+
+        self.particles = particles[:self.max_particles]
+        self.budget -= m.cost_function(action)
+        self.tree = None
+
+        return self.compute_belief()
@@ -2,7 +2,7 @@ import numpy as np
 
 from solvers import Solver
 from util.alpha_vector import AlphaVector
-from array import array
+from util.belief_cache import BeliefCache
 
 MIN = -np.inf
 
@@ -13,22 +13,29 @@ class PBVI(Solver):
         self.belief_points = None
         self.alpha_vecs = None
         self.solved = False
+        self.iterations = 0  # completed backups
+        self.belief_cache = None
 
-    def add_configs(self, belief_points):
+    def add_configs(self, belief_points, belief_cache_mb=0, belief_decimals=6):
+        """
+        :param belief_cache_mb: megabytes of belief updates and actions remembered across steps and episodes (LRU),
+        0 disables the cache
+        :param belief_decimals: precision at which two beliefs are considered the same by the cache
+        """
         Solver.add_configs(self)
-        self.alpha_vecs = [AlphaVector(a=-1, v=np.zeros(self.model.num_states))] # filled with a dummy alpha vector
-        self.belief_points = belief_points
+        dtype = self.model.dtype
+        self.alpha_vecs = [AlphaVector(a=-1, v=np.zeros(self.model.num_states, dtype=dtype))] # filled with a dummy alpha vector
+        self.iterations = 0
+        self.belief_points = np.asarray(belief_points, dtype=dtype)
+        self.belief_cache = BeliefCache(int(belief_cache_mb * 2 ** 20), belief_decimals) if belief_cache_mb else None
         self.compute_gamma_reward()
 
     def compute_gamma_reward(self):
         """
         :return: Action_a => Reward(s,a) matrix
         """
-
-        self.gamma_reward = {
-            a: np.frombuffer(array('d', [self.model.reward_function(a, s) for s in self.model.states]))
-            for a in self.model.actions
-        }
+        c = self.model.compiled
+        self.gamma_reward = {a: c.R[ai] for ai, a in enumerate(c.actions)}
 
     def compute_gamma_action_obs(self, a, o):
         """
@@ -39,26 +46,19 @@ class PBVI(Solver):
         :param a: action index
         :param o: observation index
         """
-        m = self.model
+        c = self.model.compiled
+        ai, oi = c.action_index[a], c.obs_index[o]
 
-        gamma_action_obs = []
-        for alpha in self.alpha_vecs:
-            v = np.zeros(m.num_states)  # initialize the update vector [0, ... 0]
-            for i, si in enumerate(m.states):
-                for j, sj in enumerate(m.states):
-                    v[i] += m.transition_function(a, si, sj) * \
-                        m.observation_function(a, sj, o) * \
-                        alpha.v[j]
-                v[i] *= m.discount
-            gamma_action_obs.append(v)
-        return gamma_action_obs
+        # v[i] = discount * sum_j T(a, si, sj) * Z(a, sj, o) * alpha[j], for all the alpha vectors at once
+        alphas = np.array([alpha.v for alpha in self.alpha_vecs], dtype=c.dtype)
+        return c.discount * np.dot(alphas * c.Z[ai, :, oi], c.T[ai].T)
 
     def solve(self, T):
         if self.solved:
             return
 
         m = self.model
-        for step in range(T):
+        while self.iterations < T:
 
             # First compute a set of updated vectors for every action/observation pair
             # Action(a) => Observation(o) => UpdateOfAlphaVector (a, o)
@@ -70,37 +70,81 @@ class PBVI(Solver):
             }
 
             # Now compute the cross sum
-            gamma_action_belief = {}
-            for a in m.actions:
+            gamma_action_belief = self.cross_sum(gamma_intermediate)
+
+            # Finally compute the new(best) alpha vector set
+            self.alpha_vecs = self.best_alpha_vectors(gamma_action_belief)
+            self.iterations += 1
+            if self.belief_cache is not None:
+                self.belief_cache.clear()
+            if self.on_iteration is not None:
+                self.on_iteration(self)
 
-                gamma_action_belief[a] = {}
-                for bidx, b in enumerate(self.belief_points):
+        self.solved = True
 
-                    gamma_action_belief[a][bidx] = self.gamma_reward[a].copy()
+    def get_state(self):
+        return {
+            'iterations': self.iterations,
+            'belief_points': self.belief_points,
+            'alpha': np.array([av.v for av in self.alpha_vecs]),
+            'actions': [av.action for av in self.alpha_vecs],
+        }
 
-                    for o in m.observations:
-                        # only consider the best point
-                        best_alpha_idx = np.argmax(np.dot(gamma_intermediate[a][o], b))
-                        gamma_action_belief[a][bidx] += gamma_intermediate[a][o][best_alpha_idx]
+    def set_state(self, state):
+        self.iterations = state['iterations']
+        self.belief_points = state['belief_points']
+        self.alpha_vecs = [AlphaVector(a=a, v=v) for a, v in zip(state['actions'], state['alpha'])]
 
-            # Finally compute the new(best) alpha vector set
-            self.alpha_vecs, max_val = [], MIN
+    def cross_sum(self, gamma_intermediate):
+        """
+        :return: Action_a => BeliefPoint_b => the best alpha vector for b after taking a
+        """
+        m = self.model
+        gamma_action_belief = {}
+        for a in m.actions:
 
+            gamma_action_belief[a] = {}
             for bidx, b in enumerate(self.belief_points):
-                best_av, best_aa = None, None
 
-                for a in m.actions:
-                    val = np.dot(gamma_action_belief[a][bidx], b)
-                    if best_av is None or val > max_val:
-                        max_val = val
-                        best_av = gamma_action_belief[a][bidx].copy()
-                        best_aa = a
+                gamma_action_belief[a][bidx] = self.gamma_reward[a].copy()
 
-                self.alpha_vecs.append(AlphaVector(a=best_aa, v=best_av))
+                for o in m.observations:
+                    # only consider the best point
+                    best_alpha_idx = np.argmax(np.dot(gamma_intermediate[a][o], b))
+                    gamma_action_belief[a][bidx] += gamma_intermediate[a][o][best_alpha_idx]
+        return gamma_action_belief
 
-        self.solved = True
+    def best_alpha_vectors(self, gamma_action_belief):
+        """
+        :return: for every belief point, the alpha vector of its best action
+        """
+        alpha_vecs, max_val = [], MIN
+
+        for bidx, b in enumerate(self.belief_points):
+            best_av, best_aa = None, None
+
+            for a in self.model.actions:
+                val = np.dot(gamma_action_belief[a][bidx], b)
+                if best_av is None or val > max_val:
+                    max_val = val
+                    best_av = gamma_action_belief[a][bidx].copy()
+                    best_aa = a
+
+            alpha_vecs.append(AlphaVector(a=best_aa, v=best_av))
+        return alpha_vecs
 
     def get_action(self, belief):
+        if self.belief_cache is None:
+            return self.best_action(belief)
+
+        key = self.belief_cache.key(belief)
+        action = self.belief_cache.get(key)
+        if action is None:
+            action = self.best_action(belief)
+            self.belief_cache.put(key, action)
+        return action
+
+    def best_action(self, belief):
         max_v = -np.inf
         best = None
         for av in self.alpha_vecs:
@@ -111,19 +155,37 @@ class PBVI(Solver):
 
         return best.action
     
-    def update_belief(self, belief, action, obs):
-        m = self.model
-
-        b_new = []
-        for sj in m.states:
-            p_o_prime = m.observation_function(action, sj, obs)
-            summation = 0.0
-            for i, si in enumerate(m.states):
-                p_s_prime = m.transition_function(action, si, sj)
-                summation += p_s_prime * float(belief[i])
-            b_new.append(p_o_prime * summation)
-
-        # normalize
-        total = sum(b_new)
-        return [x / total for x in b_new]
+    def policy_matrix(self):
+        """
+        :return: (S x G) matrix whose columns are the alpha vectors, and the action index of each column
+        """
+        c = self.model.compiled
+        gamma = np.array([av.v for av in self.alpha_vecs], dtype=c.dtype).T
+        return gamma, np.array([c.action_index[av.action] for av in self.alpha_vecs])
 
+    def update_belief(self, belief, action, obs):
+        """
+        With the belief cache, the next belief is looked up together with its best action, which the following
+        get_action then finds in the cache
+        """
+        cache = self.belief_cache
+        if cache is None:
+            return self.next_belief(belief, action, obs).tolist()
+
+        key = cache.key(belief, action, obs)
+        b_new = cache.get(key)
+        if b_new is None:
+            b_new = self.next_belief(belief, action, obs)
+            cache.put(key, b_new)
+            cache.put(cache.key(b_new), self.best_action(b_new))
+        return b_new.tolist()
+
+    def next_belief(self, belief, action, obs):
+        """
+        :return: the next belief as an array of the model's dtype
+        """
+        c = self.model.compiled
+        b_new = c.belief_update(belief, c.action_index[action], c.obs_index[obs])
+        if b_new is None:
+            raise ValueError('Observation {} is impossible after taking {} from the current belief'.format(obs, action))
+        return b_new
@@ -2,8 +2,10 @@ from solvers import Solver
 from util.helper import rand_choice, randint, round
 from util.helper import elem_distribution, ucb
 from util.belief_tree import BeliefTree
+from models import Model
 from logger import Logger as log
 import numpy as np
+import importlib
 import time
 
 MAX = np.inf
@@ -33,6 +35,70 @@ class UtilityFunction():
         return algorithm
 
 
+class RolloutPolicy():
+    """
+    Factories of rollout policies, each returns a function mapping a state to the action to simulate
+    """
+    @staticmethod
+    def random(model):
+        def policy(state):
+            return rand_choice(model.get_legal_actions(state))
+        return policy
+
+    @staticmethod
+    def greedy(model):
+        """
+        Picks the action with the highest immediate reward, ties broken at random
+        """
+        return RolloutPolicy.__argmax(model, model.compiled.R)
+
+    @staticmethod
+    def qmdp(model):
+        """
+        Picks the action with the highest Q_MDP value of the fully observable problem
+        """
+        _, Q = model.compiled.value_iteration()
+        return RolloutPolicy.__argmax(model, Q)
+
+    @staticmethod
+    def model(model):
+        """
+        Uses the domain specific policy supplied by the model class
+        """
+        if not callable(getattr(model, 'rollout_policy', None)):
+            raise ValueError('{} does not supply a rollout policy'.format(type(model).__name__))
+        return model.rollout_policy
+
+    @staticmethod
+    def from_path(model, path):
+        """
+        Loads a user supplied factory given as 'package.module.function', called with the model
+        """
+        module_name, _, fn_name = path.rpartition('.')
+        factory = getattr(importlib.import_module(module_name), fn_name)
+        return factory(model)
+
+    @staticmethod
+    def create(name, model):
+        if name in ('random', 'greedy', 'qmdp', 'model'):
+            return getattr(RolloutPolicy, name)(model)
+        if '.' in name:
+            return RolloutPolicy.from_path(model, name)
+        raise ValueError('Unknown rollout policy: {}'.format(name))
+
+    @staticmethod
+    def __argmax(model, values):
+        c = model.compiled
+
+        def policy(state):
+            si = c.state_index[state]
+            actions = model.get_legal_actions(state)
+            scores = [values[c.action_index[a], si] for a in actions]
+            best = max(scores)
+            return rand_choice([a for a, v in zip(actions, scores) if v == best])
+        return policy
+
+
 class POMCP(Solver):
     def __init__(self, model):
         Solver.__init__(self, model)
@@ -42,9 +108,21 @@ class POMCP(Solver):
         self.max_particles = None    # maximum number of particles can be supplied by hand for a belief node
         self.reinvigorated_particles_ratio = None  # ratio of max_particles to mutate 
         self.utility_fn = None
+        self.leaf_values = None  # V_MDP indexed by state position, replaces rollouts at new nodes when set
+        self.rollout_policy = None
+        self.stop_z = None            # width of the confidence bounds used to stop planning early, 0 disables it
+        self.stop_visit_share = None  # share of root visits of the best action that stops planning early, 0 disables it
+        self.min_simulations = None   # simulations to run before the early stop is considered
+        self.check_interval = None    # simulations between two early stop checks
+        self.simulations = 0          # simulations performed by the last solve
+        self.kernel = None            # KernelTree searched by compiled batches of simulations, if enabled
+        self.kernel_batch = None      # simulations per kernel call
+        self.root_particles = None    # state indices of the root particles, as consumed by the kernel
 
     def add_configs(self, budget=float('inf'), initial_belief=None, simulation_time=0.5,
-                    max_particles=350, reinvigorated_particles_ratio=0.1, utility_fn='ucb1', C=0.5):
+                    max_particles=350, reinvigorated_particles_ratio=0.1, utility_fn='ucb1', C=0.5,
+                    leaf_evaluator='rollout', rollout_policy='random', stop_z=0.0, stop_visit_share=0.0,
+                    min_simulations=100, check_interval=50, engine='python', kernel_batch=1000):
         # acquaire utility function to choose the most desirable action to try
         if utility_fn == 'ucb1':
             self.utility_fn = UtilityFunction.ucb1(C)
@@ -55,14 +133,57 @@ class POMCP(Solver):
                 raise ValueError('Must specify action costs if utility function is MAB_BV1')
             self.utility_fn = UtilityFunction.mab_bv1(min(self.model.costs), C)
 
+        # estimate the value of new nodes either by random rollouts or by the fully observable MDP value
+        if leaf_evaluator == 'qmdp':
+            self.leaf_values, _ = self.model.compiled.value_iteration()
+        elif leaf_evaluator != 'rollout':
+            raise ValueError('Unknown leaf evaluator: {}'.format(leaf_evaluator))
+
+        # policy followed by rollouts: random, greedy, qmdp, model or a 'package.module.function' factory
+        self.rollout_policy = RolloutPolicy.create(rollout_policy, self.model)
+
         # other configs
         self.simulation_time = simulation_time
         self.max_particles = max_particles
         self.reinvigorated_particles_ratio = reinvigorated_particles_ratio
-        
+        self.stop_z = stop_z
+        self.stop_visit_share = stop_visit_share
+        self.min_simulations = min_simulations
+        self.check_interval = check_interval
+
+        # 'python' walks the BeliefTree, 'numba' runs batches of simulations in a compiled kernel over the model's
+        # arrays, whose root statistics are mirrored into the BeliefTree
+        if engine == 'numba':
+            self.kernel = self.create_kernel(C, utility_fn, rollout_policy)
+            self.kernel_batch = kernel_batch
+        elif engine != 'python':
+            raise ValueError('Unknown engine: {}'.format(engine))
+
+        self.reset(budget, initial_belief)
+
+    def create_kernel(self, C, utility_fn, rollout_policy):
+        if utility_fn != 'ucb1':
+            raise ValueError('The numba engine only supports the ucb1 utility function')
+        if rollout_policy not in ('random', 'greedy', 'qmdp'):
+            raise ValueError('The numba engine only supports the random, greedy and qmdp rollout policies')
+        if type(self.model).simulate_action is not Model.simulate_action and not self.model.matches_tables:
+            raise ValueError('The numba engine needs a model defined by its T, Z and R tables')
+
+        from solvers.pomcp_kernel import KernelTree
+        rollout_values = None
+        if rollout_policy == 'greedy':
+            rollout_values = self.model.compiled.R
+        elif rollout_policy == 'qmdp':
+            _, rollout_values = self.model.compiled.value_iteration()
+        return KernelTree(self.model, C, self.leaf_values, rollout_values)
+
+    def reset(self, budget=float('inf'), initial_belief=None):
         # initialise belief search tree
         root_particles = self.model.gen_particles(n=self.max_particles, prob=initial_belief)
         self.tree = BeliefTree(budget, root_particles)
+        self.root_particles = None
+        if self.kernel is not None:
+            self.kernel.reset(budget)
 
     def compute_belief(self):
         base = [0.0] * self.model.num_states
@@ -73,7 +194,7 @@ class POMCP(Solver):
 
     def rollout(self, state, h, depth, max_depth, budget):
         """
-        Perform randomized recursive rollout search starting from 'h' util the max depth has been achived
+        Perform recursive rollout search following the rollout policy, starting from 'h' util the max depth has been achived
         :param state: starting state's index
         :param h: history sequence
         :param depth: current planning horizon
@@ -84,11 +205,26 @@ class POMCP(Solver):
             return 0
 
 
-        ai = rand_choice(self.model.get_legal_actions(state))
+        ai = self.rollout_policy(state)
         sj, oj, r, cost = self.model.simulate_action(state, ai)
 
         return r + self.model.discount * self.rollout(sj, h + [ai, oj], depth + 1, max_depth, budget-cost)
 
+    def evaluate_leaf(self, state, h, depth, max_depth, budget):
+        """
+        Approximate value of a newly created belief node, seen from 'state'
+        """
+        if self.leaf_values is None:
+            return self.rollout(state, h, depth, max_depth, budget)
+        return self.leaf_values[self.model.compiled.state_index[state]]
+
+    def select(self, node_h):
+        """
+        Find the action that maximises the utility value, ties broken at random
+        """
+        np.random.shuffle(node_h.children)
+        return sorted(node_h.children, key=self.utility_fn, reverse=True)[0]
+
     def simulate(self, state, max_depth, depth=0, h=[], parent=None, budget=None):
         """
         Perform MCTS simulation on a POMCP belief search tree
@@ -114,12 +250,10 @@ class POMCP(Solver):
                 if budget - cost >= 0:
                     self.tree.add(h + [ai], name=ai, parent=node_h, action=ai, cost=cost)
 
-            return self.rollout(state, h, depth, max_depth, budget)
+            return self.evaluate_leaf(state, h, depth, max_depth, budget)
 
         # ===== SELECTION =====
-        # Find the action that maximises the utility value
-        np.random.shuffle(node_h.children)
-        node_ha = sorted(node_h.children, key=self.utility_fn, reverse=True)[0]
+        node_ha = self.select(node_h)
 
         # ===== SIMULATION =====
         # Perform monte-carlo simulation of the state under the action
@@ -133,23 +267,115 @@ class POMCP(Solver):
 
         # Update the action node for this action
         node_ha.update_stats(cost, reward)
-        node_ha.N += 1
-        node_ha.V += (R - node_ha.V) / node_ha.N
+        node_ha.update_value(R)
 
         return R
 
+    def simulate_kernel(self, max_depth, n, action=None):
+        """
+        Performs n simulations from the root in the compiled kernel, the first action is fixed if given
+        :return: number of simulations performed
+        """
+        first_action = -1 if action is None else self.model.compiled.action_index[action]
+        return self.kernel.simulate(n, max_depth, self.kernel_particles(), first_action)
+
+    def kernel_particles(self):
+        """
+        State indices of the root particles, cached until the root changes
+        """
+        if self.root_particles is None:
+            c = self.model.compiled
+            self.root_particles = np.array([c.state_index[s] for s in self.tree.root.B], dtype=np.int64)
+        return self.root_particles
+
+    def sync_tree(self, action=None, depth=2):
+        """
+        Mirrors the statistics of the kernel into the BeliefTree, down to 'depth' levels below the root (action and
+        belief levels both count, as in TreeSnapshot). The kernel records particles at the children of the root
+        only, those of the children of 'action' are copied if given
+        """
+        k, c = self.kernel, self.model.compiled
+        frontier = [(0, self.tree.root, 0)]
+        while frontier:
+            nid, node_h, level = frontier.pop()
+            node_h.N = int(k.node_N[nid])
+            if level >= depth:
+                continue
+            for ai in np.flatnonzero(k.valid[nid]):
+                a = c.actions[ai]
+                node_ha = node_h.get_child(a)
+                if node_ha is None:
+                    node_ha = self.tree.add(node_h.h + [a], name=a, parent=node_h, action=a,
+                                            cost=self.model.cost_function(a))
+                node_ha.N = int(k.act_N[nid, ai])
+                node_ha.V, node_ha.M2 = float(k.act_V[nid, ai]), float(k.act_M2[nid, ai])
+                if level + 1 >= depth:
+                    continue
+
+                for oi, child in k.children(nid, ai):
+                    o = c.observations[oi]
+                    child_h = node_ha.get_child(o)
+                    if child_h is None:
+                        child_h = self.tree.add(node_ha.h + [o], name=o, parent=node_ha, observation=o,
+                                                budget=float(k.node_budget[child]))
+                    if level == 0 and a == action:
+                        child_h.B = [c.states[si] for si in k.particles(child)]
+                    frontier.append((child, child_h, level + 2))
+
+    def simulate_root(self, max_depth):
+        """
+        Performs one simulation from a state sampled at the root
+        """
+        if self.kernel is not None:
+            self.simulate_kernel(max_depth, 1)
+            return
+
+        root = self.tree.root
+        self.simulate(root.sample_state(), max_depth=max_depth, h=root.h, budget=root.budget)
+
+    def is_decided(self):
+        """
+        Whether the root action with the highest V can be committed to before the deadline, either because it
+        holds at least stop_visit_share of the root visits, or because its lower confidence bound V - z * stderr
+        lies above the upper confidence bound of every other action
+        """
+        children = self.tree.root.children
+        if not children or any(action.N == 0 for action in children):
+            return False
+
+        best = max(children, key=lambda action: action.V)
+        if self.stop_visit_share > 0 and best.N >= self.stop_visit_share * sum(action.N for action in children):
+            return True
+        if self.stop_z <= 0:
+            return False
+
+        def bound(action, sign):
+            return action.V + sign * self.stop_z * np.sqrt(action.variance / action.N)
+
+        return all(bound(best, -1) > bound(action, 1) for action in children if action is not best)
+
     def solve(self, T):
 
         """
-        Solves for up to T steps
+        Solves for up to T steps, simulating until simulation_time has elapsed or, when an early stop rule is
+        configured, until the best root action is decided
         """
         begin = time.time()
-        n = 0
+        n, next_check = 0, self.min_simulations
         while time.time() - begin < self.simulation_time:
-            n += 1
-            state = self.tree.root.sample_state()
-            self.simulate(state, max_depth=T, h=self.tree.root.h, budget=self.tree.root.budget)
-        log.info('# Step = {}'.format(n))
+            if self.kernel is not None:
+                n += self.simulate_kernel(T, self.kernel_batch)
+                self.sync_tree()
+            else:
+                n += 1
+                self.simulate_root(T)
+
+            if n >= next_check:
+                next_check = n + self.check_interval
+                if self.is_decided():
+                    break
+        self.simulations = n
+        log.info('# Step = {}', n)
 
     def get_action(self, belief):
         """
@@ -160,11 +386,34 @@ class POMCP(Solver):
         action_vals = [(action.V, action.action) for action in root.children]
         return max(action_vals)[1]
 
+    def reject_sample(self, action, obs, n):
+        """
+        :return: up to n successors of the root particles under 'action' which produce 'obs', given up after
+        100 * n draws
+        """
+        if self.kernel is not None:
+            c = self.model.compiled
+            states = self.kernel.reject_sample(self.kernel_particles(), c.action_index[action], c.obs_index[obs], n,
+                                               100 * n)
+            return [c.states[si] for si in states]
+
+        particles, attempts = [], 0
+        while len(particles) < n and attempts < 100 * n:
+            attempts += 1
+            si = self.tree.root.sample_state()
+            sj, oj, r, cost = self.model.simulate_action(si, action)
+
+            if oj == obs:
+                particles.append(sj)
+        return particles
+
     def update_belief(self, belief, action, obs):
         """
         Updates the belief tree given the environment feedback.
         extending the history, updating particle sets, etc
         """
+        if self.kernel is not None:
+            self.sync_tree(action)
         m, root = self.model, self.tree.root
 
         #####################
@@ -172,7 +421,7 @@ class POMCP(Solver):
         #####################
         new_root = root.get_child(action).get_child(obs)
         if new_root is None:
-            log.warning("Warning: {} is not in the search tree".format(root.h + [action, obs]))
+            log.warning("Warning: {} is not in the search tree", root.h + [action, obs])
             # The step result randomly produced a different observation
             action_node = root.get_child(action)
             if action_node.children:
@@ -191,15 +440,12 @@ class POMCP(Solver):
         ##################
         particle_slots = self.max_particles - len(new_root.B)
         if particle_slots > 0:
-            # fill particles by Monte-Carlo using reject sampling
-            particles = []
-            while len(particles) < particle_slots:
-                si = root.sample_state()
-                sj, oj, r, cost = self.model.simulate_action(si, action)
-
-                if oj == obs:
-                    particles.append(sj)
-            new_root.B += particles
+            # fill particles by Monte-Carlo using reject sampling, bounded since the observation may be (nearly)
+            # impossible from the root particles when the new root was grabbed from a sibling
+            new_root.B += self.reject_sample(action, obs, particle_slots)
+            if not new_root.B:
+                log.warning("Warning: observation {} was not reproduced by any particle", obs)
+                new_root.B = self.model.gen_particles(n=self.max_particles)
 
         #####################
         # Advance and Prune #
@@ -220,6 +466,12 @@ class POMCP(Solver):
             # re-compute the current belief distribution after reinvigoration
             new_belief =  self.compute_belief()
             #log.info(('*** {} random particles are added ***'.format(len(mutations))))
+
+        if self.kernel is not None:
+            # carry the searched subtree of the new root over to the next step
+            c = self.model.compiled
+            self.kernel.reroot(c.action_index[action], c.obs_index[new_root.observation])
+            self.root_particles = None
         return new_belief
 
     def draw(self, beliefs):
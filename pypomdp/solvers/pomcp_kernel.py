@@ -0,0 +1,342 @@
+import numpy as np
+from numba import njit
+
+# Imported by POMCP only when "engine": "numba" is configured, so that numba stays off the default startup path
+
+
+@njit(cache=True)
+def seed(value):
+    np.random.seed(value)
+
+
+@njit(cache=True)
+def sample(cdf):
+    """
+    Draws an index from a row of cumulative probabilities
+    """
+    i = np.searchsorted(cdf, np.random.random() * cdf[-1], side='right')
+    return min(i, cdf.shape[0] - 1)
+
+
+@njit(cache=True)
+def rollout_action(s, legal, legal_count, rollout_values, greedy):
+    """
+    Uniformly random legal action, or the legal action with the highest rollout value (ties broken at random)
+    """
+    if not greedy:
+        return legal[s, np.random.randint(legal_count[s])]
+
+    best, best_value, ties = -1, -np.inf, 0
+    for k in range(legal_count[s]):
+        a = legal[s, k]
+        v = rollout_values[a, s]
+        if v > best_value:
+            best, best_value, ties = a, v, 1
+        elif v == best_value:
+            ties += 1
+            if np.random.randint(ties) == 0:
+                best = a
+    return best
+
+
+@njit(cache=True)
+def rollout(s, depth, max_depth, budget, T_cdf, R, costs, discount, legal, legal_count, rollout_values, greedy):
+    total, gamma = 0.0, 1.0
+    while depth <= max_depth and budget > 0:
+        a = rollout_action(s, legal, legal_count, rollout_values, greedy)
+        total += gamma * R[a, s]
+        gamma *= discount
+        budget -= costs[a]
+        s = sample(T_cdf[a, s])
+        depth += 1
+    return total
+
+
+@njit(cache=True)
+def select(node, node_N, act_N, act_V, valid, c):
+    """
+    UCB1 action of a belief node, ties broken at random, -1 when no action is valid
+    """
+    best, best_value, ties = -1, -np.inf, 0
+    for a in range(act_N.shape[1]):
+        if not valid[node, a]:
+            continue
+        if act_N[node, a] == 0:
+            value = np.inf
+        elif node_N[node] == 0:
+            value = act_V[node, a]
+        else:
+            value = act_V[node, a] + c * np.sqrt(np.log(node_N[node]) / act_N[node, a])
+
+        if value > best_value:
+            best, best_value, ties = a, value, 1
+        elif value == best_value:
+            ties += 1
+            if np.random.randint(ties) == 0:
+                best = a
+    return best
+
+
+@njit(cache=True)
+def find_child(node, a, o, act_head, node_obs, node_next):
+    """
+    Belief node reached from 'node' by (a, o), -1 if absent
+    """
+    nxt = act_head[node, a]
+    while nxt >= 0 and node_obs[nxt] != o:
+        nxt = node_next[nxt]
+    return nxt
+
+
+# releases the GIL, so that a pondering thread does not hold up the runner
+@njit(cache=True, nogil=True)
+def simulate(n, max_depth, first_action, root_particles, T_cdf, Z_cdf, R, costs, discount, c, legal, legal_count,
+             leaf_values, use_leaf_values, rollout_values, greedy, node_N, node_budget, node_parent, node_obs,
+             node_next, expanded, valid, act_head, act_N, act_V, act_M2, node_count, particle_head, particle_state,
+             particle_next, particle_count):
+    """
+    Runs n POMCP simulations from states drawn among the root particles, the tree and particle arrays are updated
+    in place and must have room for n more nodes and n more particles: a simulation adds at most one belief node,
+    which it expands and evaluates before stopping.
+    The states reaching the children of the root are recorded as their particles.
+    :param first_action: action forced at the root, -1 to select it by UCB1
+    """
+    path_nodes = np.empty(max_depth + 1, dtype=np.int64)
+    path_actions = np.empty(max_depth + 1, dtype=np.int64)
+    path_rewards = np.empty(max_depth + 1)
+
+    for _ in range(n):
+        s = root_particles[np.random.randint(root_particles.shape[0])]
+        node, budget, depth, k = 0, node_budget[0], 0, 0
+        leaf = 0.0
+
+        while depth <= max_depth:
+            if not expanded[node]:
+                # new belief node: only affordable legal actions are added, its value is estimated by the leaf
+                expanded[node] = True
+                for i in range(legal_count[s]):
+                    if budget - costs[legal[s, i]] >= 0:
+                        valid[node, legal[s, i]] = True
+                if use_leaf_values:
+                    leaf = leaf_values[s]
+                else:
+                    leaf = rollout(s, depth, max_depth, budget, T_cdf, R, costs, discount, legal, legal_count,
+                                   rollout_values, greedy)
+                break
+
+            a = first_action if depth == 0 and first_action >= 0 else select(node, node_N, act_N, act_V, valid, c)
+            if a < 0:
+                break
+            sj = sample(T_cdf[a, s])
+            o = sample(Z_cdf[a, sj])
+            path_nodes[k], path_actions[k], path_rewards[k] = node, a, R[a, s]
+            k += 1
+            budget -= costs[a]
+            depth += 1
+            if depth > max_depth:
+                break
+
+            nxt = find_child(node, a, o, act_head, node_obs, node_next)
+            if nxt < 0:
+                nxt = node_count[0]
+                node_count[0] += 1
+                node_budget[nxt] = budget
+                node_parent[nxt], node_obs[nxt] = node, o
+                node_next[nxt] = act_head[node, a]
+                act_head[node, a] = nxt
+            if depth == 1:
+                p = particle_count[0]
+                particle_count[0] += 1
+                particle_state[p] = sj
+                particle_next[p] = particle_head[nxt]
+                particle_head[nxt] = p
+            node, s = nxt, sj
+
+        # back-propagation of the discounted return along the path
+        ret = leaf
+        for i in range(k - 1, -1, -1):
+            ret = path_rewards[i] + discount * ret
+            nd, a = path_nodes[i], path_actions[i]
+            node_N[nd] += 1
+            act_N[nd, a] += 1
+            delta = ret - act_V[nd, a]
+            act_V[nd, a] += delta / act_N[nd, a]
+            act_M2[nd, a] += delta * (ret - act_V[nd, a])
+    return n
+
+
+@njit(cache=True)
+def reject_sample(root_particles, a, o, n, max_attempts, T_cdf, Z_cdf):
+    """
+    Up to n successors of the root particles under action a which produce observation o
+    """
+    states = np.empty(n, dtype=np.int64)
+    found, attempts = 0, 0
+    while found < n and attempts < max_attempts:
+        attempts += 1
+        sj = sample(T_cdf[a, root_particles[np.random.randint(root_particles.shape[0])]])
+        if sample(Z_cdf[a, sj]) == o:
+            states[found] = sj
+            found += 1
+    return states[:found]
+
+
+class KernelTree(object):
+    """
+    Array-backed POMCP search tree over integer state, action and observation indices, searched by the
+    simulate kernel. Belief node 0 is the root and the action nodes of belief node b are the rows act_*[b].
+    The belief nodes below action a of b form a linked list starting at act_head[b, a] and chained by node_next,
+    node_obs holding the observation leading to each of them
+    """
+    FIELDS = ['node_N', 'node_budget', 'node_parent', 'node_obs', 'node_next', 'expanded', 'valid', 'act_head',
+              'act_N', 'act_V', 'act_M2', 'particle_head']
+
+    def __init__(self, model, C, leaf_values=None, rollout_values=None, capacity=1024):
+        c = model.compiled
+        self.model = model
+        self.C = C
+        self.discount = float(model.discount)
+        self.T_cdf = np.cumsum(c.T, axis=2)
+        self.Z_cdf = np.cumsum(c.Z, axis=2)
+        self.R = c.R
+        self.costs = np.array([model.cost_function(a) for a in c.actions], dtype=float)
+
+        S, A = len(c.states), len(c.actions)
+        self.legal = np.zeros((S, A), dtype=np.int64)
+        self.legal_count = np.zeros(S, dtype=np.int64)
+        # model.legal_mask as padded lists of action indices
+        for si, row in enumerate(model.legal_mask):
+            actions = np.flatnonzero(row)
+            self.legal[si, :len(actions)] = actions
+            self.legal_count[si] = len(actions)
+
+        self.use_leaf_values = leaf_values is not None
+        self.leaf_values = np.asarray(leaf_values if leaf_values is not None else np.zeros(S), dtype=float)
+        self.greedy = rollout_values is not None
+        self.rollout_values = np.asarray(rollout_values if rollout_values is not None else np.zeros((A, S)), dtype=float)
+
+        self.capacity = capacity
+        self.reset()
+
+    def allocate(self, capacity):
+        A = self.T_cdf.shape[0]
+        return {
+            'node_N': np.zeros(capacity, dtype=np.int64),
+            'node_budget': np.zeros(capacity),
+            'node_parent': np.full(capacity, -1, dtype=np.int64),
+            'node_obs': np.full(capacity, -1, dtype=np.int64),
+            'node_next': np.full(capacity, -1, dtype=np.int64),
+            'expanded': np.zeros(capacity, dtype=np.bool_),
+            'valid': np.zeros((capacity, A), dtype=np.bool_),
+            'act_head': np.full((capacity, A), -1, dtype=np.int64),
+            'act_N': np.zeros((capacity, A), dtype=np.int64),
+            'act_V': np.zeros((capacity, A)),
+            'act_M2': np.zeros((capacity, A)),
+            'particle_head': np.full(capacity, -1, dtype=np.int64),
+        }
+
+    def reset(self, budget=float('inf')):
+        self.__dict__.update(self.allocate(self.capacity))
+        self.node_budget[0] = budget
+        self.node_count = np.ones(1, dtype=np.int64)
+        self.particle_state = np.empty(self.capacity, dtype=np.int64)
+        self.particle_next = np.empty(self.capacity, dtype=np.int64)
+        self.particle_count = np.zeros(1, dtype=np.int64)
+
+    def reserve(self, nodes, particles):
+        """
+        Grows the arrays, by doubling, to hold that many more nodes and particles
+        """
+        needed = self.node_count[0] + nodes
+        if needed > self.capacity:
+            capacity = self.capacity
+            while capacity < needed:
+                capacity *= 2
+            grown = self.allocate(capacity)
+            for field in self.FIELDS:
+                grown[field][:self.capacity] = getattr(self, field)
+            self.__dict__.update(grown)
+            self.capacity = capacity
+
+        needed = self.particle_count[0] + particles
+        if needed > self.particle_state.shape[0]:
+            capacity = max(needed, 2 * self.particle_state.shape[0])
+            for field in ('particle_state', 'particle_next'):
+                grown = np.empty(capacity, dtype=np.int64)
+                grown[:self.particle_count[0]] = getattr(self, field)[:self.particle_count[0]]
+                setattr(self, field, grown)
+
+    def simulate(self, n, max_depth, root_particles, first_action=-1):
+        self.reserve(n, n)
+        seed(np.random.randint(2 ** 31))
+        return simulate(n, max_depth, first_action, root_particles, self.T_cdf, self.Z_cdf, self.R, self.costs,
+                        self.discount, self.C, self.legal, self.legal_count, self.leaf_values, self.use_leaf_values,
+                        self.rollout_values, self.greedy, self.node_N, self.node_budget, self.node_parent,
+                        self.node_obs, self.node_next, self.expanded, self.valid, self.act_head, self.act_N,
+                        self.act_V, self.act_M2, self.node_count, self.particle_head, self.particle_state,
+                        self.particle_next, self.particle_count)
+
+    def size(self):
+        """
+        :return: number of belief and action nodes, counted as in the BeliefTree
+        """
+        n = self.node_count[0]
+        return int(n + np.count_nonzero(self.valid[:n]))
+
+    def children(self, node, ai):
+        """
+        :return: (observation index, belief node) pairs below action ai of 'node'
+        """
+        pairs, nxt = [], self.act_head[node, ai]
+        while nxt >= 0:
+            pairs.append((self.node_obs[nxt], nxt))
+            nxt = self.node_next[nxt]
+        return pairs
+
+    def reject_sample(self, root_particles, ai, oi, n, max_attempts):
+        seed(np.random.randint(2 ** 31))
+        return reject_sample(root_particles, ai, oi, n, max_attempts, self.T_cdf, self.Z_cdf)
+
+    def particles(self, node):
+        """
+        :return: state indices recorded at a child of the root
+        """
+        states, p = [], self.particle_head[node]
+        while p >= 0:
+            states.append(self.particle_state[p])
+            p = self.particle_next[p]
+        return states
+
+    def reroot(self, ai, oi):
+        """
+        Keeps the subtree below (ai, oi) only, the new root becomes node 0. Particles are dropped, the new
+        root's children start recording theirs with the next simulations
+        :return: False if the subtree does not exist, the tree is then reset
+        """
+        new_root = find_child(0, ai, oi, self.act_head, self.node_obs, self.node_next)
+        if new_root < 0:
+            self.reset(self.node_budget[0] - self.costs[ai])
+            return False
+
+        # breadth first collection of the subtree, one level at a time, in creation order
+        count = self.node_count[0]
+        parents = self.node_parent[:count]
+        kept, frontier = [], np.array([new_root])
+        while frontier.size:
+            kept.append(frontier)
+            frontier = np.flatnonzero(np.isin(parents, frontier))
+        kept = np.concatenate(kept)
+
+        # -1 stays -1 through the remapping
+        remap = np.full(self.capacity + 1, -1, dtype=np.int64)
+        remap[kept] = np.arange(kept.size)
+        old = {field: getattr(self, field) for field in self.FIELDS}
+        self.reset()
+        for field in self.FIELDS:
+            getattr(self, field)[:kept.size] = old[field][kept]
+        for field in ('node_parent', 'node_next', 'act_head'):
+            getattr(self, field)[:kept.size] = remap[old[field][kept]]
+        self.node_parent[0], self.node_obs[0], self.node_next[0] = -1, -1, -1
+        self.particle_head[:kept.size] = -1
+        self.node_count[0] = kept.size
+        return True
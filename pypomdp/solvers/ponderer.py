@@ -0,0 +1,68 @@
+import time
+import threading
+
+
+class Ponderer(object):
+    """
+    Keeps a POMCP tree growing in a background thread while the runner is busy outside of solve (executing the
+    action in the environment, logging, ...). While the environment executes an action, simulations are
+    restricted to that action's branch, so when the observation arrives update_belief promotes an already
+    grown subtree.
+    Needs the numba engine, whose kernel releases the GIL: python simulations would compete with the runner for
+    the interpreter and only add a handful per step. Every batch of kernel_batch simulations holds the lock, the
+    tree must only be touched by the caller while pondering is paused, see collect() for what pondering adds
+    """
+    def __init__(self, solver, T):
+        if solver.kernel is None:
+            raise ValueError('Pondering needs the numba POMCP engine ("engine": "numba")')
+        self.solver = solver
+        self.T = T
+        self.action = None
+        self.simulations = 0
+        self.elapsed = 0.0  # seconds spent simulating
+
+        self.lock = threading.Lock()
+        self.active = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__run, name='ponderer', daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        while not self.stopped:
+            if not self.active.wait(timeout=0.1):
+                continue
+            with self.lock:
+                if not self.active.is_set() or self.stopped:
+                    continue
+                begin = time.perf_counter()
+                self.simulations += self.solver.simulate_kernel(self.T, self.solver.kernel_batch, self.action)
+                self.elapsed += time.perf_counter() - begin
+
+    def resume(self, action=None):
+        """
+        Starts pondering from the current root, restricted to the subtree of 'action' if given
+        """
+        self.action = action
+        self.active.set()
+
+    def pause(self):
+        """
+        Stops pondering and waits for the simulations in flight to finish
+        """
+        self.active.clear()
+        with self.lock:
+            pass
+
+    def collect(self):
+        """
+        :return: the number of simulations performed and the seconds spent on them since the last call
+        """
+        with self.lock:
+            simulations, elapsed = self.simulations, self.elapsed
+            self.simulations, self.elapsed = 0, 0.0
+        return simulations, elapsed
+
+    def close(self):
+        self.stopped = True
+        self.active.clear()
+        self.thread.join()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from solvers import Solver
+
+
+class QMDP(Solver):
+    """
+    QMDP approximation: acts greedily on sum_s b(s) Q_MDP(a, s), i.e. assumes the state becomes fully
+    observable after the next step. Q_MDP comes from value iteration over the model's compiled arrays.
+    """
+    def __init__(self, model):
+        Solver.__init__(self, model)
+        self.epsilon = None
+        self.V = None
+        self.Q = None
+        self.solved = False
+
+    def add_configs(self, epsilon=1e-6):
+        Solver.add_configs(self)
+        self.epsilon = epsilon
+
+    def solve(self, T):
+        """
+        :param T: maximum number of value iteration sweeps
+        """
+        if self.solved:
+            return
+
+        self.V, self.Q = self.model.compiled.value_iteration(epsilon=self.epsilon, max_iterations=T)
+        self.solved = True
+
+    def get_action(self, belief):
+        return self.model.actions[int(np.argmax(np.dot(self.Q, belief)))]
+
+    def policy_matrix(self):
+        """
+        :return: (S x A) matrix with one Q_MDP column per action, and the action index of each column
+        """
+        return self.Q.T, np.arange(len(self.model.actions))
+
+    def update_belief(self, belief, action, obs):
+        c = self.model.compiled
+        b_new = c.belief_update(belief, c.action_index[action], c.obs_index[obs])
+        if b_new is None:
+            raise ValueError('Observation {} is impossible after taking {} from the current belief'.format(obs, action))
+        return b_new.tolist()
@@ -4,6 +4,8 @@ from abc import abstractmethod
 class Solver(object):
     def __init__(self, model):
         self.model = model
+        # called by iterative offline solvers with the solver after each iteration, e.g. to checkpoint it
+        self.on_iteration = None
 
     @abstractmethod
     def solve(self, T):
@@ -38,6 +40,13 @@ class Solver(object):
         :return:
         """
 
+    def reset(self, budget=float('inf'), initial_belief=None):
+        """
+        Discards any episode specific state (e.g. search trees), keeping the configuration and offline policy
+        :param budget: total action budget of the new episode
+        :param initial_belief: prior belief distribution of the new episode
+        """
+
     def take_action(self, action):
         """
         Just a shallow Facade to expose model's take_action method to the external runner
@@ -62,3 +71,14 @@ class Solver(object):
     #     max_vals = np.max(vals, axis=0)
     #     plt.plot(belief_points[:, 0], max_vals, 'k', linewidth=2)
     #     plt.show()
+
+    def get_state(self):
+        """
+        :return: the state an interrupted offline solve resumes from (see set_state), None if there is none
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restores a state returned by get_state, solve then carries on from there
+        """
@@ -0,0 +1,202 @@
+import os
+import csv
+import json
+import math
+import random
+import argparse
+import itertools
+import statistics
+import multiprocessing
+
+from pomdp_runner import PomdpRunner
+from models import SharedModel
+from util import RunnerParams, set_seed
+from logger import Logger as log
+
+# worker side: config id => runner whose model and solver are built once per configuration
+runners = {}
+worker_params = None
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_grid(specs):
+    """
+    :param specs: KEY=v1,v2,... items
+    :return: the configurations of the cartesian product, as {key: value} overrides
+    """
+    keys, values = [], []
+    for spec in specs:
+        key, _, vals = spec.partition('=')
+        keys.append(key)
+        values.append([parse_value(v) for v in vals.split(',')])
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def sample_ranges(specs, n):
+    """
+    :param specs: KEY=lo:hi items, integers are drawn when both bounds are integers, prefix the bounds with
+    'log:' to draw uniformly on a log scale (e.g. C=log:0.1:100)
+    :return: n random configurations, as {key: value} overrides
+    """
+    ranges = []
+    for spec in specs:
+        key, _, bounds = spec.partition('=')
+        log_scale = bounds.startswith('log:')
+        lo, hi = [parse_value(b) for b in bounds[4 if log_scale else 0:].split(':')]
+        ranges.append((key, lo, hi, log_scale))
+
+    configs = []
+    for _ in range(n):
+        overrides = {}
+        for key, lo, hi, log_scale in ranges:
+            if log_scale:
+                value = math.exp(random.uniform(math.log(lo), math.log(hi)))
+            else:
+                value = random.uniform(lo, hi)
+            overrides[key] = int(round(value)) if isinstance(lo, int) and isinstance(hi, int) else value
+        configs.append(overrides)
+    return configs
+
+
+def init_worker(params, level):
+    global worker_params
+    worker_params = params
+    log.set_level(level)
+
+
+def run_episode(job):
+    """
+    Plays one episode of a configuration, the runner of a configuration is built (and offline policies solved)
+    the first time the worker meets it
+    """
+    config_id, algo_params, setup_seed, seed = job
+    if config_id not in runners:
+        set_seed(setup_seed)
+        runner = PomdpRunner(worker_params)
+        runner.setup(**algo_params)
+        runners[config_id] = runner
+
+    runners[config_id].seed_episode(seed)
+    steps, reward = runners[config_id].runBench(**algo_params)
+    log.flush()
+    return config_id, steps, reward
+
+
+def summarise(rewards, z=1.96):
+    n = len(rewards)
+    std = statistics.stdev(rewards) if n > 1 else 0.0
+    return statistics.mean(rewards), std, z * std / math.sqrt(n)
+
+
+def successive_halving(configs, base, args, pool):
+    """
+    Plays min_episodes episodes per configuration, keeps the best 1/eta configurations by mean reward and
+    multiplies their episodes by eta, until one configuration is left or max_episodes is reached.
+    :return: the rewards of each configuration and the rung at which it was stopped
+    """
+    rewards = {cid: [] for cid in range(len(configs))}
+    stopped = {}
+    alive, episodes, rung = list(rewards), args.min_episodes, 0
+    # the i-th episode of every configuration shares its seed, hence its environment noise, which makes the
+    # comparisons less noisy
+    setup_seed, seeds = random.randrange(2 ** 32), []
+
+    while True:
+        seeds += [random.randrange(2 ** 32) for _ in range(episodes - len(seeds))]
+        jobs = []
+        for cid in alive:
+            algo_params = dict(base, **configs[cid])
+            jobs += [(cid, algo_params, setup_seed, seeds[i]) for i in range(len(rewards[cid]), episodes)]
+
+        for cid, _, reward in pool.imap_unordered(run_episode, jobs):
+            rewards[cid].append(reward)
+
+        log.info('rung {}: {} configuration(s) x {} episodes', rung, len(alive), episodes)
+        if len(alive) == 1 or episodes >= args.max_episodes:
+            break
+
+        alive.sort(key=lambda cid: statistics.mean(rewards[cid]), reverse=True)
+        keep = max(1, len(alive) // args.eta)
+        for cid in alive[keep:]:
+            stopped[cid] = rung
+        alive = alive[:keep]
+        episodes = min(episodes * args.eta, args.max_episodes)
+        rung += 1
+
+    return rewards, stopped
+
+
+def report(configs, rewards, stopped, out=None):
+    rows = []
+    for cid, overrides in enumerate(configs):
+        mean, std, ci = summarise(rewards[cid])
+        rows.append(dict(overrides, id=cid, episodes=len(rewards[cid]), mean_reward=mean, std_reward=std,
+                         ci_reward=ci, stopped_at_rung=stopped.get(cid)))
+    rows.sort(key=lambda row: (row['stopped_at_rung'] is not None, -row['mean_reward']))
+
+    keys = sorted(set(k for overrides in configs for k in overrides))
+    fields = ['id'] + keys + ['episodes', 'mean_reward', 'std_reward', 'ci_reward', 'stopped_at_rung']
+    lines = [''.join('{:>16}'.format(f[:15]) for f in fields)]
+    for row in rows:
+        lines.append(''.join('{:>16.6g}'.format(row[f]) if isinstance(row[f], float) else '{:>16}'.format(str(row[f]))
+                             for f in fields))
+    log.info('\n'.join(lines))
+
+    if out:
+        with open(out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        log.info('Results written to {}', out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hyperparameter sweep with successive halving')
+    parser.add_argument('config', type=str, help='The algorithm configuration the sweep starts from (without JSON extension)')
+    parser.add_argument('--env', type=str, default='Tiger-2D.POMDP', help='The name of environment\'s config file')
+    parser.add_argument('--grid', type=str, nargs='*', default=[],
+                        help='Parameter grids as KEY=v1,v2,..., the sweep runs their cartesian product')
+    parser.add_argument('--random', type=str, nargs='*', default=[],
+                        help='Parameter ranges as KEY=lo:hi or KEY=log:lo:hi, sampled --samples times')
+    parser.add_argument('--samples', type=int, default=10, help='Number of random configurations')
+    parser.add_argument('--min_episodes', type=int, default=5, help='Episodes per configuration at the first rung')
+    parser.add_argument('--max_episodes', type=int, default=100, help='Episodes per configuration at the last rung')
+    parser.add_argument('--eta', type=int, default=3, help='Only the best 1/eta configurations move up a rung')
+    parser.add_argument('--max_play', type=int, default=100, help='Maximum number of play steps per episode')
+    parser.add_argument('--budget', type=float, default=float('inf'), help='The total action budget')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes (defaults to the CPU count)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the sampled configurations and episodes')
+    parser.add_argument('--log_level', type=str, default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Log level of the workers (defaults to WARNING)')
+    parser.add_argument('--out', type=str, default=None, help='CSV path of the results table')
+    args = parser.parse_args()
+
+    set_seed(args.seed)
+    with open(os.path.join('configs', args.config + '.json')) as algo_config:
+        base = json.load(algo_config)
+
+    configs = parse_grid(args.grid) if args.grid else [{}]
+    if args.random:
+        configs = [dict(grid, **sampled) for grid in configs for sampled in sample_ranges(args.random, args.samples)]
+
+    params = RunnerParams(args.env, None, args.config, args.budget, args.max_play, False, False, 1)
+    log.info('~~~ Sweeping {} configuration(s) of {} on {} ~~~', len(configs), args.config, args.env)
+    # every configuration of every worker attaches to the same copy of the model's tables, except for sparse model
+    # files whose dense tables may not fit in memory, which every worker loads
+    shared = None
+    if not params.sparse_env:
+        shared = SharedModel.publish(PomdpRunner(params).load_model())
+        params.shared_model = shared.path
+    try:
+        with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(params, args.log_level)) as pool:
+            rewards, stopped = successive_halving(configs, base, args, pool)
+    finally:
+        if shared is not None:
+            shared.close()
+    report(configs, rewards, stopped, args.out)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+# the modules of the package import each other from its folder, as when main.py runs there
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE)
+
+from pomdp_runner import PomdpRunner
+from util import RunnerParams
+
+ENV_FOLDER = os.path.join(PACKAGE, 'environments', 'pomdp')
+
+
+def env_runner(env, dtype=None):
+    """
+    Runner of a shipped environment, which loads and builds its model as the benchmarks do
+    """
+    params = RunnerParams(env, None, None, float('inf'), 0, False, False, 0, dtype=dtype)
+    params.env_folder = ENV_FOLDER
+    return PomdpRunner(params)
+
+
+def load(env, dtype=None):
+    """
+    :return: the model of a shipped environment and its prior belief
+    """
+    runner = env_runner(env, dtype)
+    with runner.open_env() as ctx:
+        return runner.create_model(ctx.copy_env()), ctx.generate_beliefs()
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from conftest import load
+from models import Model, CompiledModel, SharedModel
+from util import set_seed, draw_arg
+
+# largest difference between the float32 and float64 beliefs accepted by perf_suite.py accuracy
+BELIEF_TOLERANCE = 1e-4
+STEPS = 200
+
+
+@pytest.mark.parametrize('env', ['Tiger-2D.POMDP', 'Web.POMDP', 'Tag.POMDP'])
+def test_float32_belief_updates(env):
+    set_seed(0)
+    model, prior = load(env, dtype='float64')
+    models = {dtype: CompiledModel.from_model(model, dtype) for dtype in ('float64', 'float32')}
+    assert models['float32'].dtype == np.float32
+
+    # random play, restarted from the prior when an observation has no support left in the float32 belief
+    beliefs = {dtype: np.array(prior, dtype=dtype) for dtype in models}
+    c = models['float64']
+    state = model.states[draw_arg(prior)]
+    for _ in range(STEPS):
+        ai = np.random.randint(len(c.actions))
+        state, obs, _, _ = model.simulate_action(state, c.actions[ai])
+        updated = {dtype: m.belief_update(beliefs[dtype], ai, c.obs_index[obs]) for dtype, m in models.items()}
+        assert updated['float64'] is not None
+        if updated['float32'] is None:
+            beliefs = {dtype: np.array(prior, dtype=dtype) for dtype in models}
+            continue
+        assert np.abs(updated['float32'] - updated['float64']).max() < BELIEF_TOLERANCE
+        beliefs = updated
+
+
+@pytest.mark.parametrize('env', ['Tiger-2D.POMDP', 'Web.POMDP'])
+def test_simulate_float32_shared_model(env, tmp_path):
+    """
+    Workers of a pooled benchmark sample their steps from the float32 tables of the published model
+    """
+    set_seed(0)
+    model, prior = load(env, dtype='float32')
+    with SharedModel.publish(model, directory=str(tmp_path)) as shared:
+        attached = Model(SharedModel.attach(shared.path))
+        assert attached.dtype == np.float32
+        state = attached.states[draw_arg(prior)]
+        for _ in range(STEPS):
+            action = attached.actions[np.random.randint(attached.num_actions)]
+            state, obs, _, _ = attached.simulate_action(state, action)
+            assert state in attached.states and obs in attached.observations
@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from conftest import load
+from planning_server import PlanningService
+from solvers import QMDP
+
+
+def tiger_service():
+    model, prior = load('Tiger-2D.POMDP')
+    qmdp = QMDP(model)
+    qmdp.add_configs()
+    qmdp.solve(5)
+    return PlanningService(model, qmdp, prior)
+
+
+async def concurrent_resets(service, beliefs):
+    service.start()
+    try:
+        sessions = [service.session() for _ in beliefs]
+        return await asyncio.gather(*[s.reset(b) for s, b in zip(sessions, beliefs)], return_exceptions=True)
+    finally:
+        await service.stop()
+
+
+@pytest.mark.parametrize('belief', [[0.2, 0.3, 0.5], [0.5, float('nan')], [0.7, 0.7], [-0.5, 1.5], ['a', 'b']])
+def test_reset_rejects_invalid_beliefs(belief):
+    service = tiger_service()
+    invalid, valid = asyncio.run(concurrent_resets(service, [belief, None]))
+    assert isinstance(invalid, ValueError)
+    assert valid in service.compiled.actions
+
+
+def test_failed_request_leaves_the_batch_served():
+    service = tiger_service()
+
+    async def play():
+        service.start()
+        try:
+            good, bad = service.session(), service.session()
+            await asyncio.gather(good.reset(), bad.reset())
+            # a belief broken behind the service's back makes its whole batch fail to stack
+            bad.belief = np.zeros(5)
+            obs = service.compiled.observations[0]
+            return await asyncio.gather(good.act(obs), bad.act(obs), return_exceptions=True)
+        finally:
+            await service.stop()
+
+    good, bad = asyncio.run(play())
+    assert good in service.compiled.actions
+    assert isinstance(bad, Exception)
@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import load
+from solvers import POMCP
+from util import set_seed
+
+SIMULATIONS = 2000
+HORIZON = 3
+
+
+def root_visits(model, prior, engine, seed):
+    """
+    :return: the action chosen at the root after SIMULATIONS simulations, and the share of root visits of each action
+    """
+    set_seed(seed)
+    pomcp = POMCP(model)
+    pomcp.add_configs(initial_belief=prior, max_particles=700, C=10.0, engine=engine)
+    if engine == 'numba':
+        pomcp.simulate_kernel(HORIZON, SIMULATIONS)
+        pomcp.sync_tree()
+    else:
+        for _ in range(SIMULATIONS):
+            pomcp.simulate_root(HORIZON)
+
+    # the first simulation expands the root and rolls out without visiting an action
+    children = pomcp.tree.root.children
+    visits = sum(action.N for action in children)
+    assert visits == pomcp.tree.root.N == SIMULATIONS - 1
+    return pomcp.get_action(prior), {action.action: action.N / visits for action in children}
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_numba_engine_matches_python_on_tiger(seed):
+    model, prior = load('Tiger-2D.POMDP')
+    python_action, python_shares = root_visits(model, prior, 'python', seed)
+    numba_action, numba_shares = root_visits(model, prior, 'numba', seed)
+
+    # listening is the only sensible first move from the uniform prior, both engines end up focusing on it
+    assert python_action == numba_action == 'listen'
+    assert set(python_shares) == set(numba_shares) == set(model.actions)
+    for action in model.actions:
+        assert numba_shares[action] == pytest.approx(python_shares[action], abs=0.05)
+
+
+def test_kernel_tree_mirrored_to_snapshot_depth():
+    set_seed(0)
+    model, prior = load('Tiger-2D.POMDP')
+    pomcp = POMCP(model)
+    pomcp.add_configs(initial_belief=prior, max_particles=700, C=10.0, engine='numba')
+    pomcp.simulate_kernel(HORIZON, SIMULATIONS)
+    # a simulation adds at most the belief node it stops at
+    assert pomcp.kernel.node_count[0] <= SIMULATIONS + 1
+
+    pomcp.sync_tree()
+    assert max(len(node.h) for node in pomcp.tree.nodes.values()) == 2
+    pomcp.sync_tree(depth=4)
+    assert max(len(node.h) for node in pomcp.tree.nodes.values()) == 4
+
+    # every mirrored action node holds the visits of its belief children
+    for node in pomcp.tree.nodes.values():
+        if hasattr(node, 'action') and node.children:
+            assert sum(child.N for child in node.children) <= node.N
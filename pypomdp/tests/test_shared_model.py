@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+
+from conftest import load
+from models import SharedModel
+
+
+def test_attach_round_trip(tmp_path):
+    model, _ = load('Tiger-2D.POMDP')
+    c = model.compiled
+    with SharedModel.publish(model, directory=str(tmp_path)) as shared:
+        env = SharedModel.attach(shared.path)
+        attached = env['compiled']
+        for name in ('T', 'Z', 'R'):
+            np.testing.assert_array_equal(getattr(attached, name), getattr(c, name))
+        assert attached.dtype == c.dtype
+        assert (env['states'], env['actions'], env['observations']) == (c.states, c.actions, c.observations)
+        assert env['discount'] == model.discount
+
+        # the dictionary views answer the lookups of Model.T, Model.Z and Model.R
+        for table in ('T', 'Z', 'R'):
+            for key, value in getattr(model, table).items():
+                assert env[table].get(key) == value
+        del env, attached
+    assert not os.path.exists(shared.path)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from environments.grid_world_maker import GridWorldMaker
+from models import Model, CompiledModel, load_sparse
+
+# non square, so that rows and columns can't be swapped unnoticed
+BOARD = [
+    [-1, -1, 10, -1, -1],
+    [-1, 5, -1, -1, -1],
+    [20, -1, -1, -1, 40],
+]
+
+
+def make_grid():
+    return GridWorldMaker({
+        'discount': 0.9,
+        'values': 'reward',
+        'actions': 'up down left right halt',
+        'costs': '1 1 1 1 0.25',
+        'observation_probability': 0.85,
+        'init_state': '7',
+        'board': BOARD,
+        'action_map': lambda action, i, j: {
+            'up': (i - 1, j),
+            'down': (i + 1, j),
+            'left': (i, j - 1),
+            'right': (i, j + 1),
+            'halt': (i, j)
+        }.get(action)
+    })
+
+
+def test_load_sparse_reproduces_compiled(tmp_path):
+    maker = make_grid()
+    path = str(tmp_path / 'grid.npz')
+    maker.save(path)
+
+    expected = maker.compiled(dtype='float64')
+    loaded = CompiledModel.from_model(Model(load_sparse(path)), dtype='float64')
+    assert (loaded.states, loaded.actions, loaded.observations) == (expected.states, expected.actions,
+                                                                   expected.observations)
+    assert loaded.discount == expected.discount
+    for name in ('T', 'Z', 'R'):
+        np.testing.assert_allclose(getattr(loaded, name), getattr(expected, name))
+    # moves are deterministic and every reached cell is observed
+    np.testing.assert_allclose(expected.T.sum(axis=2), 1.0)
+    assert expected.T.shape == (5, 15, 15)
@@ -2,5 +2,8 @@
 from .helper import *
 from .alpha_vector import AlphaVector
 from .belief_tree import Node, BeliefTree, BeliefNode, ActionNode
+from .scenario_tree import ScenarioTree, ScenarioBeliefNode, ScenarioActionNode
 from .runner_params import RunnerParams
+from .running_stats import RunningStats
 
+from .belief_cache import BeliefCache
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# bookkeeping of an entry besides its key and value bytes: tuple key, OrderedDict node, value object
+ENTRY_OVERHEAD = 200
+
+
+class BeliefCache(object):
+    """
+    Least recently used table of results computed from a belief, keyed on the belief rounded to 'decimals' (plus
+    e.g. the action and observation of a belief update). Models with few reachable beliefs under a policy end up
+    answering most queries from the table.
+    The table is sized in bytes, so that it holds as many entries as fit in the budget whatever the number of states:
+    beliefs are stored as read-only arrays and handed out as copies
+    """
+    def __init__(self, max_bytes=16 * 2 ** 20, decimals=6):
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        # cumulative over clear(), which only drops the entries
+        self.hits, self.misses = 0, 0
+
+    def key(self, belief, *args):
+        """
+        :param args: what the cached result depends on besides the belief, e.g. action and observation
+        """
+        return (np.round(np.asarray(belief, dtype=float), self.decimals).tobytes(),) + args
+
+    @staticmethod
+    def entry_bytes(key, value):
+        value_bytes = value.nbytes if isinstance(value, np.ndarray) else 0
+        return len(key[0]) + value_bytes + ENTRY_OVERHEAD
+
+    def get(self, key):
+        """
+        :return: the cached value, a copy for arrays, None on a miss
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value.copy() if isinstance(value, np.ndarray) else value
+
+    def put(self, key, value):
+        """
+        :param value: arrays are copied, so that the caller's later changes don't reach the table
+        """
+        if isinstance(value, np.ndarray):
+            value = np.array(value)
+            value.flags.writeable = False
+        if key in self.entries:
+            self.nbytes -= self.entry_bytes(key, self.entries[key])
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.nbytes += self.entry_bytes(key, value)
+        while self.nbytes > self.max_bytes and self.entries:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.nbytes -= self.entry_bytes(old_key, old_value)
+
+    def clear(self):
+        """
+        Drops the entries, the hit and miss counts carry on
+        """
+        self.entries.clear()
+        self.nbytes = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate, 'size': len(self.entries),
+                'bytes': self.nbytes}
@@ -67,11 +67,25 @@ class ActionNode(Node):
         self.cost = cost
         self.action = action_index
         self.obs_map = {}
+        self.M2 = 0.0  # sum of squared deviations of the simulated returns from V
 
     def update_stats(self, cost, reward):
         self.mean_cost = (self.mean_cost * self.N + cost) / (self.N + 1)
         self.mean_reward = (self.mean_reward * self.N + reward) / (self.N + 1)
 
+    def update_value(self, R):
+        """
+        Adds a simulated return to the running mean V and variance (Welford's algorithm)
+        """
+        self.N += 1
+        delta = R - self.V
+        self.V += delta / self.N
+        self.M2 += delta * (R - self.V)
+
+    @property
+    def variance(self):
+        return self.M2 / (self.N - 1) if self.N > 1 else float('inf')
+
     def add_child(self, node):
         self.children.append(node)
         self.obs_map[node.observation] = node
@@ -1,13 +1,10 @@
 import numpy as np
 import math, random, time, sys
 
-from numba import jit, jitclass
 from collections import Counter
 from functools import wraps
 
 
-np.random.seed()
-random.seed()
 MAX = np.inf
 
 def timeit(comment=None):
@@ -30,12 +27,35 @@ def timeit(comment=None):
     return decorator
 
 
+def set_seed(seed=None):
+    """
+    Seeds both global random number generators, None reseeds them from system entropy
+    """
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def split_seed(seed, n=2):
+    """
+    Derives n independent seeds from one, e.g. the environment and solver streams of an episode
+    """
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n)]
+
+
 def gen_distribution(n):
     rand_nums = np.random.randint(0, 100, size=n)
     base = sum(rand_nums)*1.0
     return [x/base for x in rand_nums]
 
 
+def normalise(probs):
+    """
+    :return: the probabilities rescaled to sum to 1 in double precision
+    """
+    total = math.fsum(probs)
+    return [p / total for p in probs]
+
+
 def draw_arg(probs):
     assert(abs(sum(probs) - 1.0) < 0.00000001)
     probs = np.array(probs)
@@ -43,6 +63,15 @@ def draw_arg(probs):
     return np.random.choice(list(range(len(probs))), p=probs/probs.sum())
 
 
+def draw_arg_det(probs, u):
+    """
+    Deterministic counterpart of draw_arg: inverts the cumulative distribution at the uniform number u,
+    so the same u always yields the same outcome
+    """
+    cdf = np.cumsum(probs)
+    return min(int(np.searchsorted(cdf, u * cdf[-1], side='right')), len(probs) - 1)
+
+
 def elem_distribution(arr):
     cnt = Counter(arr)
     _sum = sum(cnt.values())
@@ -50,36 +79,31 @@ def elem_distribution(arr):
 
 ######################################
 # High performance utility functions #
-######################################s
-@jit
+######################################
 def round(num, dec_places=2):
     return float('%.{}f'.format(dec_places) % num)
 
 
-@jit
 def rand(n=1, seed=None):
     if seed:
         np.random.seed(seed)
     return np.random.rand() * n
 
 
-@jit
 def rand_choice(candidates):
     return random.choice(candidates)
 
 
-@jit
 def randint(low, high, seed=None):
     if seed:
         np.random.seed(seed)
     return np.random.randint(low, high)
 
 
-@jit(nopython=True)
 def ucb(N_h, N_ha):
     if N_h == 0:
         return 0.0
     if N_ha == 0:
         return MAX
-    return np.sqrt(np.log(N_h) / N_ha)  # Upper-Confidence-Bound
+    return math.sqrt(math.log(N_h) / N_ha)  # Upper-Confidence-Bound
 
@@ -3,7 +3,10 @@ import os
 ROOT = os.getcwd()
 
 class RunnerParams:
-	def __init__(self, env, logfile, config, budget, max_play, snapshot, random_prior, benchmark):
+	def __init__(self, env, logfile, config, budget, max_play, snapshot, random_prior, benchmark, ponder=False, vectorized=False,
+				 metrics=None, snapshot_dir=os.path.join('dev', 'snapshots'), snapshot_depth=4, snapshot_top_k=5, seed=None,
+				 checkpoint=None, checkpoint_interval=60.0, resume=False, shared_model=None,
+				 dtype=None):
 		# given params
 		self.env = env
 		self.budget = budget
@@ -11,9 +14,23 @@ class RunnerParams:
 		self.config = config
 		self.random_prior = random_prior
 		self.snapshot = snapshot
+		self.snapshot_dir = snapshot_dir
+		self.snapshot_depth = snapshot_depth
+		self.snapshot_top_k = snapshot_top_k
 		self.logfile = logfile
 		#New argument
 		self.benchmark = benchmark
+		self.ponder = ponder
+		self.vectorized = vectorized
+		self.metrics = metrics
+		self.seed = seed
+		self.checkpoint = checkpoint
+		self.checkpoint_interval = checkpoint_interval
+		self.resume = resume
+		# folder of a SharedModel the runner attaches to instead of loading the environment
+		self.shared_model = shared_model
+		# floating point type of the compiled tables, beliefs and alpha vectors, None picks it by model size
+		self.dtype = dtype
 
 		# default params
 		self.config_folder = os.path.join(ROOT, 'configs')
@@ -26,3 +43,8 @@ class RunnerParams:
 	@property
 	def env_config(self):
 		return os.path.join(self.env_folder, self.env)
+
+	@property
+	def sparse_env(self):
+		# sparse model files (.npz) are small to load, while their dense compiled tables may not fit in memory
+		return self.env.endswith('.npz')
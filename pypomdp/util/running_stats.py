@@ -0,0 +1,44 @@
+import math
+
+
+class RunningStats(object):
+    """
+    Streaming mean and variance of a sample (Welford's algorithm), the sample itself is not stored
+    """
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.mean = 0.0
+        self.M2 = 0.0  # sum of squared deviations from the mean
+
+    def push(self, x):
+        self.n += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.M2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.M2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def ci(self, z=1.96):
+        """
+        :return: half-width of the normal confidence interval of the mean
+        """
+        if self.n < 2:
+            return float('inf')
+        return z * self.std / math.sqrt(self.n)
+
+    def precise(self, z=1.96, width=None, rel_error=None):
+        """
+        Whether the confidence interval half-width is within 'width' or within 'rel_error' times the absolute mean
+        """
+        half = self.ci(z)
+        if width is not None and half <= width:
+            return True
+        return rel_error is not None and half <= rel_error * abs(self.mean)
@@ -0,0 +1,71 @@
+from util.belief_tree import BeliefTree, BeliefNode, ActionNode
+from util.helper import round
+
+
+class ScenarioBeliefNode(BeliefNode):
+    """
+    Belief node of a DESPOT, the particles in B are the current states of the scenarios listed in scenario_ids.
+    Node bounds are weighted by the share of scenarios reaching the node and discounted by its depth
+    """
+    def __init__(self, nid, name, h, obs_index, parent=None, V=0, N=0, budget=float('inf')):
+        BeliefNode.__init__(self, nid, name, h, obs_index, parent, V, N, budget)
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.scenario_ids = []
+        self.default_lower = 0.0
+        self.lower = 0.0
+        self.upper = 0.0
+
+    def add_scenario(self, sid, state):
+        self.scenario_ids.append(sid)
+        self.B.append(state)
+
+    def __repr__(self):
+        return 'Bid = {}, |Phi| = {}, L = {}, U = {}'.format(self.id, len(self.B), round(self.lower, 6),
+                                                             round(self.upper, 6))
+
+
+class ScenarioActionNode(ActionNode):
+    """
+    Action node of a DESPOT, holding the weighted discounted immediate reward (rho) and the bounds of the action
+    """
+    def __init__(self, nid, name, h, action_index, cost, parent=None, V=0, N=0):
+        ActionNode.__init__(self, nid, name, h, action_index, cost, parent, V, N)
+        self.depth = parent.depth
+        self.rho = 0.0
+        self.lower = 0.0
+        self.upper = 0.0
+
+    def __repr__(self):
+        return 'Aid = {}, L = {}, U = {}'.format(self.id, round(self.lower, 6), round(self.upper, 6))
+
+
+class ScenarioTree(BeliefTree):
+    """
+    The sparse belief tree of DESPOT, only the observation branches visited by the sampled scenarios exist.
+    """
+    def __init__(self, total_budget, root_particles):
+        """
+        :param root_particles: starting state of every scenario, the scenario id is the position in the list
+        """
+        BeliefTree.__init__(self, total_budget, [])
+        for sid, state in enumerate(root_particles):
+            self.root.add_scenario(sid, state)
+
+    def add(self, h, name, parent=None, action=None, observation=None,
+            particle=None, budget=None, cost=None):
+        history = h[:]
+
+        if action is not None:
+            n = ScenarioActionNode(self.counter, name, history, parent=parent, action_index=action, cost=cost)
+        else:
+            n = ScenarioBeliefNode(self.counter, name, history, parent=parent, obs_index=observation, budget=budget)
+
+        if particle is not None:
+            n.add_particle(particle)
+
+        self.nodes[n.id] = n
+        self.counter += 1
+
+        if parent is not None:
+            parent.add_child(n)
+        return n
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+def episode_ended(action, state):
+    """
+    Problem specific end of a benchmark episode, given the action taken and the state it led to
+    """
+    return "open" in action or "tagged" in state or "adv" in action or "arrive" in action
+
+
+def sample_rows(probs, u):
+    """
+    Draws one index per row of 'probs' by inverting the rows' cumulative distributions at the uniform numbers u
+    """
+    cdf = probs.cumsum(axis=1)
+    idx = (cdf < u[:, None] * cdf[:, -1:]).sum(axis=1)
+    return np.minimum(idx, probs.shape[1] - 1)
+
+
+class VectorEvaluator(object):
+    """
+    Plays many episodes of an offline policy in lockstep over the model's compiled arrays: actions come from one
+    (N x S).(S x G) product, next states and observations are sampled in batch and beliefs are updated with one
+    matrix product per action. Finished episodes are masked out.
+    """
+    def __init__(self, model, solver, rng=np.random):
+        """
+        :param model: the environment
+        :param solver: a solved policy exposing policy_matrix(), e.g. PBVI or QMDP
+        :param rng: random stream of the environment (initial states, transition and observation noise)
+        """
+        self.model = model
+        self.solver = solver
+        self.rng = rng
+
+        c = model.compiled
+        self.done = np.array([[episode_ended(a, s) for s in c.states] for a in c.actions])
+
+    def initial_states(self, n):
+        c = self.model.compiled
+        if self.model.init_state:
+            return np.full(n, c.state_index[self.model.init_state])
+        return self.rng.randint(0, len(c.states), size=n)
+
+    def update_beliefs(self, beliefs, actions, observations):
+        """
+        Batched Bayesian update, rows sharing an action are propagated through T with a single matmul
+        """
+        c = self.model.compiled
+        new_beliefs = np.empty_like(beliefs)
+        for ai in np.unique(actions):
+            rows = np.flatnonzero(actions == ai)
+            predicted = np.dot(beliefs[rows], c.T[ai])
+            new_beliefs[rows] = predicted * c.Z[ai][:, observations[rows]].T
+
+        totals = new_beliefs.sum(axis=1, keepdims=True)
+        # impossible observations under the current belief keep the previous belief
+        return np.where(totals > 0, new_beliefs / np.where(totals > 0, totals, 1.0), beliefs)
+
+    def evaluate(self, priors, max_play, z=1.96):
+        """
+        :param priors: (N x S) prior belief of each episode
+        :param max_play: maximum number of steps per episode
+        :param z: width of the reported confidence intervals, in standard errors
+        :return: reward and step statistics with the half width of their confidence intervals
+        """
+        c = self.model.compiled
+        gamma, alpha_actions = self.solver.policy_matrix()
+
+        n = priors.shape[0]
+        beliefs = np.array(priors, dtype=c.dtype)
+        states = self.initial_states(n)
+        active = np.ones(n, dtype=bool)
+        steps = np.zeros(n, dtype=int)
+        rewards = np.zeros(n)
+
+        for _ in range(max_play):
+            idx = np.flatnonzero(active)
+            if idx.size == 0:
+                break
+
+            b, s = beliefs[idx], states[idx]
+            a = alpha_actions[np.argmax(np.dot(b, gamma), axis=1)]
+            sj = sample_rows(c.T[a, s], self.rng.random_sample(idx.size))
+            o = sample_rows(c.Z[a, sj], self.rng.random_sample(idx.size))
+
+            rewards[idx] += c.R[a, s]
+            steps[idx] += 1
+            states[idx] = sj
+            beliefs[idx] = self.update_beliefs(b, a, o)
+            active[idx[self.done[a, sj]]] = False
+
+        def interval(values):
+            std = values.std(ddof=1) if n > 1 else 0.0
+            return values.mean(), std, z * std / np.sqrt(n)
+
+        mean_reward, std_reward, ci_reward = interval(rewards)
+        mean_steps, std_steps, ci_steps = interval(steps)
+        return {
+            'episodes': n,
+            'unfinished': int(active.sum()),
+            'mean_reward': mean_reward, 'std_reward': std_reward, 'ci_reward': ci_reward,
+            'mean_steps': mean_steps, 'std_steps': std_steps, 'ci_steps': ci_steps,
+        }